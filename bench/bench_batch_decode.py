@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+
+import argparse
+import tempfile
+import os
+
+from bench_common import get_messages, time_call, report
+from message_object import MessageObject
+from message_batch import MessageBatch, decode_message, decode_messages, numpy
+
+# per object against columnar decode of an exported log, like push_to_queue replay of radio_msg.log
+
+cli_parser = argparse.ArgumentParser(description='Batch decode benchmark')
+cli_parser.add_argument('--count', action='store', type=int, required=False, default=1000000,help="Number of lines in generated log")
+cli_parser.add_argument('--batch-size', action='store', type=int, required=False, default=500,help="Exporter read batch size for drain decode")
+cli_args = cli_parser.parse_args()
+
+if __name__ == '__main__':
+    if numpy is None:
+        raise ValueError("columnar batch decode requires numpy module")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        log_file = os.path.join(tmp_dir,"radio_msg.log")
+        with open(log_file,'wb') as radio_log:
+            for msg in get_messages(cli_args.count):
+                radio_log.write(msg.export_message_bytes() + b"\n")
+        print("batch: {count} line log, {size:.1f} MB".format(count=cli_args.count,size=os.path.getsize(log_file) / 1e6))
+        with open(log_file,'rb') as radio_log:
+            records = [line.rstrip(b"\n") for line in radio_log]
+
+    def per_object(records):
+        valid_count = 0
+        for record in records:
+            if MessageObject().create_message_from_bytes(record):
+                valid_count += 1
+        return valid_count
+
+    valid_count, elapsed = time_call(per_object,records)
+    report("batch: per object JSON",cli_args.count,elapsed,"{valid} valid".format(valid=valid_count))
+    message_batch, elapsed = time_call(MessageBatch.from_records,records)
+    report("batch: columnar JSON",cli_args.count,elapsed,"{valid} valid".format(valid=message_batch.get_valid_count()))
+
+    binary_records = message_batch.export_binary()
+    valid_count, elapsed = time_call(per_object,binary_records)
+    report("batch: per object binary",cli_args.count,elapsed,"{valid} valid".format(valid=valid_count))
+    message_batch, elapsed = time_call(MessageBatch.from_records,binary_records)
+    report("batch: columnar binary",cli_args.count,elapsed,"{valid} valid".format(valid=message_batch.get_valid_count()))
+
+    # exporter drains need message objects, read batch by read batch
+    def drain(records,decode):
+        valid_count = 0
+        for i in range(0,len(records),cli_args.batch_size):
+            valid_count += sum(msg_obj is not None for msg_obj in decode(records[i:i+cli_args.batch_size]))
+        return valid_count
+
+    for name, drain_records in (("JSON",records),("binary",binary_records)):
+        valid_count, elapsed = time_call(drain,drain_records,lambda rmsgs: [decode_message(rmsg) for rmsg in rmsgs])
+        report("batch: drain per object {name}".format(name=name),cli_args.count,elapsed,"{valid} valid".format(valid=valid_count))
+        valid_count, elapsed = time_call(drain,drain_records,decode_messages)
+        report("batch: drain decode_messages {name}".format(name=name),cli_args.count,elapsed,"{valid} valid".format(valid=valid_count))
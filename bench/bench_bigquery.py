@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+
+import argparse
+import importlib.util
+import base64
+import json
+import types
+import time
+import sys,os
+
+from bench_common import get_messages, report
+
+# cloud function against fake BigQuery client, every client call costs latency seconds
+
+class FakeBigQueryClient:
+
+    calls = {"client": 0, "get_table": 0, "insert_rows_json": 0, "rows": 0}
+    latency = 0.0
+
+    def __init__(self):
+        self.calls["client"] += 1
+        time.sleep(self.latency)
+
+    def dataset(self,dataset_name):
+        return self
+
+    def table(self,table_name):
+        return table_name
+
+    def get_table(self,table):
+        self.calls["get_table"] += 1
+        time.sleep(self.latency)
+        return table
+
+    def insert_rows_json(self,table,rows,ignore_unknown_values=False):
+        self.calls["insert_rows_json"] += 1
+        self.calls["rows"] += len(rows)
+        time.sleep(self.latency)
+        return []
+
+def load_cloud_function():
+    # cloud function imports google.cloud.bigquery at module level, fake module is put in its place
+    google_module = sys.modules.setdefault("google",types.ModuleType("google"))
+    cloud_module = types.ModuleType("google.cloud")
+    cloud_module.bigquery = types.SimpleNamespace(Client=FakeBigQueryClient)
+    google_module.cloud = cloud_module
+    sys.modules["google.cloud"] = cloud_module
+    sys.modules["google.cloud.bigquery"] = cloud_module.bigquery
+    module_spec = importlib.util.spec_from_file_location("cf_main",os.path.abspath(os.path.dirname(__file__))+"/../src_cf/main.py")
+    cf_main = importlib.util.module_from_spec(module_spec)
+    module_spec.loader.exec_module(cf_main)
+    return cf_main
+
+cli_parser = argparse.ArgumentParser(description='Cloud function benchmark against fake BigQuery client')
+cli_parser.add_argument('--count', action='store', type=int, required=False, default=20000,help="Number of messages in array payloads")
+cli_parser.add_argument('--latency', action='store', type=float, required=False, default=0.01,help="Seconds each BigQuery client call takes")
+cli_args = cli_parser.parse_args()
+
+if __name__ == '__main__':
+    cf_main = load_cloud_function()
+    FakeBigQueryClient.latency = cli_args.latency
+    msgs = [json.loads(msg.export_message()) for msg in get_messages(cli_args.count)]
+
+    def run(name,events,cold):
+        for call_name in FakeBigQueryClient.calls:
+            FakeBigQueryClient.calls[call_name] = 0
+        start_time = time.perf_counter()
+        for event in events:
+            if cold:
+                # client and table fetched on every event, as cloud function worked before
+                cf_main.bq_client = None
+                cf_main.bq_destination_table = None
+            cf_main.pubsub_to_bigq(event,None)
+        report(name,FakeBigQueryClient.calls["rows"],time.perf_counter() - start_time,"{events} events, {calls}".format(events=len(events),calls=FakeBigQueryClient.calls))
+
+    # event per message takes round trips each, few events are enough to see the rate
+    single_events = [{"data": base64.b64encode(json.dumps(msg).encode('utf-8'))} for msg in msgs[:500]]
+    run("bigquery: event per message, new client",single_events,True)
+    run("bigquery: event per message, cached",single_events,False)
+    for array_size in (100,500):
+        array_events = [{"data": base64.b64encode(json.dumps(msgs[i:i+array_size]).encode('utf-8'))} for i in range(0,len(msgs),array_size)]
+        run("bigquery: arrays of {size}".format(size=array_size),array_events,False)
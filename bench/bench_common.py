@@ -0,0 +1,26 @@
+#!/usr/bin/env python3
+
+import time
+import sys,os
+
+sys.path.append(os.path.abspath(os.path.dirname(__file__))+"/../src/lib")
+
+from message_object import MessageObject
+
+# helpers shared by bench scripts, each script runs on its own
+
+def get_raw_lines(count):
+    # v1 radio lines over all measure codes and 50 devices
+    measure_codes = list(MessageObject.dict_measure_codes.values())
+    return ["{device:02d}{code}{value:.2f}|{cycle}".format(device=i % 50,code=measure_codes[i % len(measure_codes)],value=(i % 400) / 10.0,cycle=i) for i in range(count)]
+
+def get_messages(count):
+    return [MessageObject(raw_line) for raw_line in get_raw_lines(count)]
+
+def time_call(func,*args):
+    start_time = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start_time
+
+def report(name,count,elapsed,extra=""):
+    print("{name:<40} {count:>9} in {elapsed:7.3f}s {rate:>12,.0f}/s {extra}".format(name=name,count=count,elapsed=elapsed,rate=count / elapsed if elapsed > 0 else 0,extra=extra))
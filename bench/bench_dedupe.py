@@ -0,0 +1,30 @@
+#!/usr/bin/env python3
+
+import argparse
+import tracemalloc
+
+from bench_common import get_messages, time_call, report
+from message_deduplicator import MessageDeduplicator
+
+# duplicate checks at message rate, memory stays bounded by max_size
+
+cli_parser = argparse.ArgumentParser(description='Message deduplicator benchmark')
+cli_parser.add_argument('--count', action='store', type=int, required=False, default=200000,help="Number of unique messages, retransmissions come on top")
+cli_args = cli_parser.parse_args()
+
+if __name__ == '__main__':
+    # every fourth message is followed by a retransmission of a message received about 10 messages ago
+    msgs = []
+    for index, msg in enumerate(get_messages(cli_args.count)):
+        msgs.append(msg)
+        if index % 4 == 0:
+            msgs.append(msgs[max(0,len(msgs) - 12)])
+
+    for max_size in (1024,4096,65536):
+        tracemalloc.start()
+        message_deduplicator = MessageDeduplicator(max_size=max_size)
+        duplicates, elapsed = time_call(lambda: sum([message_deduplicator.is_duplicate(msg) for msg in msgs]))
+        memory_used = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        stats = message_deduplicator.get_stats()
+        report("dedupe: max_size {size}".format(size=max_size),len(msgs),elapsed,"{dup} duplicates, {keys} keys, {memory:.1f} MB".format(dup=duplicates,keys=stats["tracked_keys"],memory=memory_used / 1e6))
@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+
+import argparse
+import http.server
+import threading
+import time
+import requests
+
+from bench_common import get_messages, report
+from http_client import ExporterHttpClient
+
+# per message requests.post against keep-alive session, local HTTP stub answers 200 at once
+
+class StubHttpHandler(http.server.BaseHTTPRequestHandler):
+
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        self.send_response(200)
+        self.send_header('Content-Length','0')
+        self.end_headers()
+
+    def log_message(self,format,*args):
+        pass
+
+cli_parser = argparse.ArgumentParser(description='Exporter HTTP client benchmark against local stub')
+cli_parser.add_argument('--count', action='store', type=int, required=False, default=2000,help="Number of messages sent")
+cli_args = cli_parser.parse_args()
+
+if __name__ == '__main__':
+    http_server = http.server.ThreadingHTTPServer(("127.0.0.1",0),StubHttpHandler)
+    threading.Thread(target=http_server.serve_forever,daemon=True).start()
+    url = "http://127.0.0.1:{port}/".format(port=http_server.server_address[1])
+    headers = {"Authorization": "Bearer user:password"}
+    msgs_bytes = [msg.export_message().encode('utf-8') for msg in get_messages(cli_args.count)]
+
+    start_time = time.perf_counter()
+    for msg_bytes in msgs_bytes:
+        # new connection and headers for every message, as exporters worked before
+        requests.post(url,data=msg_bytes,headers={"Authorization": "Bearer {user}:{password}".format(user="user",password="password"),"Content-Type": "application/json"})
+    report("http: requests.post per message",cli_args.count,time.perf_counter() - start_time)
+
+    http_client = ExporterHttpClient(url,headers=headers)
+    start_time = time.perf_counter()
+    for msg_bytes in msgs_bytes:
+        http_client.post_data(msg_bytes)
+    report("http: keep-alive session per message",cli_args.count,time.perf_counter() - start_time)
+
+    for gzip_threshold in (0,4096):
+        http_client = ExporterHttpClient(url,headers=headers,gzip_threshold=gzip_threshold)
+        start_time = time.perf_counter()
+        for i in range(0,cli_args.count,100):
+            http_client.post_data(b"\n".join(msgs_bytes[i:i+100]),content_type="application/x-ndjson")
+        report("http: batches of 100, gzip {state}".format(state="on" if gzip_threshold else "off"),cli_args.count,time.perf_counter() - start_time)
+    http_server.shutdown()
@@ -0,0 +1,31 @@
+#!/usr/bin/env python3
+
+import argparse
+
+from bench_common import get_messages, time_call, report
+from message_object import MessageObject
+
+# measure code -> name lookups, and the JSON decode path which does them for every message
+
+cli_parser = argparse.ArgumentParser(description='Measure code/name lookup benchmark')
+cli_parser.add_argument('--count', action='store', type=int, required=False, default=200000,help="Number of lookups and decoded messages")
+cli_args = cli_parser.parse_args()
+
+if __name__ == '__main__':
+    measure_codes = list(MessageObject.dict_measure_names) * (cli_args.count // len(MessageObject.dict_measure_names))
+    msg = MessageObject()
+
+    def linear_lookup():
+        # lists rebuilt on every call, as lookups worked before
+        for measure_code in measure_codes:
+            list(MessageObject.dict_measure_codes.keys())[list(MessageObject.dict_measure_codes.values()).index(measure_code)]
+
+    def map_lookup():
+        for measure_code in measure_codes:
+            msg.get_measure_name_by_code(measure_code)
+
+    report("lookup: linear list index",len(measure_codes),time_call(linear_lookup)[1])
+    report("lookup: precomputed map",len(measure_codes),time_call(map_lookup)[1])
+
+    json_msgs = [msg_obj.export_message() for msg_obj in get_messages(cli_args.count)]
+    report("lookup: JSON decode path",cli_args.count,time_call(lambda: [MessageObject().create_message_from_json(json_msg) for json_msg in json_msgs])[1])
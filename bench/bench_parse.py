@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+
+import argparse
+
+from bench_common import get_raw_lines, time_call, report
+from message_object import MessageObject
+
+# raw UART line parsing, on a recorded radio log or on generated v1 and v2 lines
+
+cli_parser = argparse.ArgumentParser(description='Raw radio line parser benchmark')
+cli_parser.add_argument('--count', action='store', type=int, required=False, default=200000,help="Number of generated lines")
+cli_parser.add_argument('--corpus-file', action='store', type=str, required=False, default=None,help="Recorded raw radio log, generated lines are used without it")
+cli_args = cli_parser.parse_args()
+
+if __name__ == '__main__':
+    if cli_args.corpus_file is not None:
+        with open(cli_args.corpus_file,'r') as corpus:
+            raw_lines = [line.strip() for line in corpus if MessageObject.detect_version(line)]
+    else:
+        # every fourth line is v2
+        raw_lines = [raw_line if i % 4 else raw_line.replace("|","!") for i, raw_line in enumerate(get_raw_lines(cli_args.count))]
+
+    def extract_parse():
+        # extract_* helpers and a temporary dict, as raw lines were parsed before
+        for raw_line in raw_lines:
+            msg = MessageObject()
+            msg.create_message_from_dict({
+                "device_id": msg.extract_device_id(raw_line),
+                "measure_code": msg.extract_measure_code(raw_line),
+                "measure_value": msg.extract_measure_value(raw_line),
+                "cycle_number": msg.extract_cycle_number(raw_line)
+            })
+
+    def single_pass_parse():
+        for raw_line in raw_lines:
+            MessageObject(raw_line)
+
+    report("parse: extract + dict",len(raw_lines),time_call(extract_parse)[1])
+    report("parse: single pass",len(raw_lines),time_call(single_pass_parse)[1])
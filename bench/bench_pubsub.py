@@ -0,0 +1,36 @@
+#!/usr/bin/env python3
+
+import argparse
+import time
+
+from bench_common import get_messages, report
+from pubsub_publisher import PipelinedPublisher, StubPublisherClient
+
+# serial publish + sleep against pipelined publishing, stub publisher resolves futures after latency seconds
+
+cli_parser = argparse.ArgumentParser(description='PubSub publishing benchmark with stub publisher')
+cli_parser.add_argument('--count', action='store', type=int, required=False, default=20000,help="Number of messages published")
+cli_parser.add_argument('--latency', action='store', type=float, required=False, default=0.01,help="Seconds each stub publish takes")
+cli_args = cli_parser.parse_args()
+
+if __name__ == '__main__':
+    rmsgs = [msg.export_message().encode('utf-8') for msg in get_messages(cli_args.count)]
+
+    # publish, drop the future and sleep 50ms, as exporter worked before; few messages are enough to see the rate
+    serial_count = min(cli_args.count,100)
+    publisher_client = StubPublisherClient(latency=cli_args.latency)
+    start_time = time.perf_counter()
+    for rmsg in rmsgs[:serial_count]:
+        publisher_client.publish("topic",rmsg)
+        time.sleep(0.05)
+    report("pubsub: serial publish + sleep",serial_count,time.perf_counter() - start_time)
+
+    for max_in_flight in (100,1000):
+        publisher_client = StubPublisherClient(latency=cli_args.latency,workers=64)
+        pipelined_publisher = PipelinedPublisher(publisher_client,"topic",max_in_flight=max_in_flight)
+        start_time = time.perf_counter()
+        for rmsg in rmsgs:
+            pipelined_publisher.publish(rmsg)
+        pipelined_publisher.wait_all()
+        succeeded, failed = pipelined_publisher.collect_results()
+        report("pubsub: pipelined, {in_flight} in flight".format(in_flight=max_in_flight),cli_args.count,time.perf_counter() - start_time,"{ok} ok, {failed} failed".format(ok=len(succeeded),failed=len(failed)))
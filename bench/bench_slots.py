@@ -0,0 +1,26 @@
+#!/usr/bin/env python3
+
+import argparse
+import tracemalloc
+
+from bench_common import get_raw_lines, time_call, report
+from message_object import MessageObject
+
+# construction rate and memory of queued messages, slotted MessageObject against the same class with __dict__
+
+# same class with per-instance __dict__ instead of __slots__, as message objects were before
+DictMessage = type("DictMessage",(),{name: value for name, value in vars(MessageObject).items() if name not in MessageObject.__slots__ and name != "__slots__"})
+
+cli_parser = argparse.ArgumentParser(description='MessageObject memory and construction benchmark')
+cli_parser.add_argument('--count', action='store', type=int, required=False, default=200000,help="Number of queued messages")
+cli_args = cli_parser.parse_args()
+
+if __name__ == '__main__':
+    raw_lines = get_raw_lines(cli_args.count)
+    for name, msg_class in (("dict objects",DictMessage),("slotted MessageObject",MessageObject)):
+        tracemalloc.start()
+        msgs, elapsed = time_call(lambda: [msg_class(raw_line) for raw_line in raw_lines])
+        memory_used = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        report("slots: " + name,cli_args.count,elapsed,"{size:.0f} bytes per queued message".format(size=memory_used / cli_args.count))
+        del msgs
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+
+import argparse
+import time
+import redis
+
+from bench_common import get_messages, report
+from redis_consumer import RedisReliableConsumer
+from redis_stream_transport import RedisStreamConsumer, redis_write_messages_stream
+
+# three lists against one stream with three consumer groups, only keys with bench_ prefix are touched
+
+cli_parser = argparse.ArgumentParser(description='Redis lists against stream transport benchmark')
+cli_parser.add_argument('--count', action='store', type=int, required=False, default=20000,help="Number of messages written")
+cli_parser.add_argument('--redis-server', action='store', type=str, required=False, default="localhost",help="Redis server")
+cli_parser.add_argument('--redis-port', action='store', type=int, required=False, default=6379,help="Redis port")
+cli_args = cli_parser.parse_args()
+
+if __name__ == '__main__':
+    redis_conn = redis.Redis(host=cli_args.redis_server,port=cli_args.redis_port)
+    redis_lists = ["bench_metrics_pubsub","bench_metrics_graphite","bench_metrics_webapi"]
+    redis_stream = "bench_metrics_stream"
+    bench_keys = redis_lists + [redis_list + ":processing:bench" for redis_list in redis_lists] + [redis_stream]
+    redis_conn.delete(*bench_keys)
+    rmsgs = [msg.export_message().encode('utf-8') for msg in get_messages(cli_args.count)]
+
+    start_time = time.perf_counter()
+    for i in range(0,cli_args.count,100):
+        redis_pipeline = redis_conn.pipeline(transaction=False)
+        for redis_list in redis_lists:
+            redis_pipeline.lpush(redis_list,*rmsgs[i:i+100])
+        redis_pipeline.execute()
+    lists_memory = sum([redis_conn.memory_usage(redis_list,samples=0) for redis_list in redis_lists])
+    report("streams: LPUSH to 3 lists",cli_args.count,time.perf_counter() - start_time,"{memory:.1f} MB".format(memory=lists_memory / 1e6))
+
+    start_time = time.perf_counter()
+    for i in range(0,cli_args.count,100):
+        redis_write_messages_stream(rmsgs[i:i+100],redis_conn,redis_stream,maxlen=cli_args.count)
+    stream_memory = redis_conn.memory_usage(redis_stream,samples=0)
+    report("streams: XADD to one stream",cli_args.count,time.perf_counter() - start_time,"{memory:.1f} MB".format(memory=stream_memory / 1e6))
+
+    list_consumers = [RedisReliableConsumer(redis_conn,redis_list,"bench",block_timeout=1) for redis_list in redis_lists]
+    stream_consumers = [RedisStreamConsumer(redis_conn,redis_stream,group_name,"bench",block_timeout=1) for group_name in ("pubsub","graphite","webapi")]
+    for name, consumers in (("lists",list_consumers),("stream",stream_consumers)):
+        start_time = time.perf_counter()
+        read_count = 0
+        for consumer in consumers:
+            consumer_read_count = 0
+            while consumer_read_count < cli_args.count:
+                rmsgs_read = consumer.read_batch(500)
+                if len(rmsgs_read) == 0:
+                    break
+                consumer.ack(rmsgs_read)
+                consumer_read_count += len(rmsgs_read)
+            read_count += consumer_read_count
+        report("streams: read + ack by 3 consumers, " + name,read_count,time.perf_counter() - start_time)
+
+    redis_conn.delete(*bench_keys)
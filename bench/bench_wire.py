@@ -0,0 +1,24 @@
+#!/usr/bin/env python3
+
+import argparse
+
+from bench_common import get_messages, time_call, report
+from message_object import MessageObject
+
+# JSON against binary wire format: encode and decode rate, bytes per message in Redis
+
+cli_parser = argparse.ArgumentParser(description='Wire format benchmark')
+cli_parser.add_argument('--count', action='store', type=int, required=False, default=200000,help="Number of messages")
+cli_args = cli_parser.parse_args()
+
+if __name__ == '__main__':
+    msgs = get_messages(cli_args.count)
+    json_records, json_encode = time_call(lambda: [msg.export_message_bytes() for msg in msgs])
+    binary_records, binary_encode = time_call(lambda: [msg.export_message_binary() for msg in msgs])
+    json_size = sum([len(record) for record in json_records]) / cli_args.count
+    binary_size = sum([len(record) for record in binary_records]) / cli_args.count
+
+    report("wire: JSON encode",cli_args.count,json_encode,"{size:.0f} bytes per message".format(size=json_size))
+    report("wire: binary encode",cli_args.count,binary_encode,"{size:.0f} bytes per message".format(size=binary_size))
+    report("wire: JSON decode",cli_args.count,time_call(lambda: [MessageObject().create_message_from_bytes(record) for record in json_records])[1])
+    report("wire: binary decode",cli_args.count,time_call(lambda: [MessageObject().create_message_from_bytes(record) for record in binary_records])[1])
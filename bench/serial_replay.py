@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+
+import argparse
+import threading
+import statistics
+import time
+import sys,os
+import serial
+
+sys.path.append(os.path.abspath(os.path.dirname(__file__))+"/../src/lib")
+
+from serial_line_reader import SerialLineReader
+
+# replays radio lines through a pty into SerialLineReader, reports reader CPU time and line latency
+
+def get_replay_lines(lines_count):
+    return [b"01%d.5|%d" % (i % 40,i) for i in range(lines_count)]
+
+def load_replay_lines(file_name,lines_count=None):
+    # captured radio output, one line per message, empty lines are skipped like the reader does
+    with open(file_name,'rb') as replay_file:
+        lines = [line.rstrip(b"\r\n") for line in replay_file]
+    lines = [line for line in lines if len(line) > 0]
+    if lines_count is not None:
+        lines = lines[:lines_count]
+    return lines
+
+def write_lines(master_fd,lines,rate,chunk_size,sent_at):
+    # lines are cut into chunk_size pieces, like radio module output arriving at random boundaries
+    interval = 1.0 / rate if rate > 0 else 0
+    next_time = time.perf_counter()
+    pending = b""
+    for index, line in enumerate(lines):
+        sent_at[index] = time.perf_counter()
+        pending += line + b"\n"
+        while len(pending) >= chunk_size:
+            os.write(master_fd,pending[:chunk_size])
+            pending = pending[chunk_size:]
+        if interval > 0:
+            next_time += interval
+            time_left = next_time - time.perf_counter()
+            if time_left > 0:
+                time.sleep(time_left)
+    if len(pending) > 0:
+        os.write(master_fd,pending)
+
+def get_percentile(values,percentile):
+    values = sorted(values)
+    return values[min(len(values) - 1,int(len(values) * percentile / 100))]
+
+cli_parser = argparse.ArgumentParser(description='Serial line reader replay over pty')
+cli_parser.add_argument('--lines', action='store', type=int, required=False, default=None,help="Number of lines replayed, 20000 generated lines or whole replay file by default")
+cli_parser.add_argument('--replay-file', action='store', type=str, required=False, default=None,help="Replay lines from this file (captured radio output) instead of generated ones")
+cli_parser.add_argument('--rate', action='store', type=float, required=False, default=2000,help="Lines per second, 0 writes as fast as possible")
+cli_parser.add_argument('--chunk-size', action='store', type=int, required=False, default=7,help="Bytes written to pty at once")
+cli_parser.add_argument('--timeout', action='store', type=float, required=False, default=1,help="Serial port read timeout")
+cli_args = cli_parser.parse_args()
+
+if __name__ == '__main__':
+    master_fd, slave_fd = os.openpty()
+    serial_port = serial.Serial(os.ttyname(slave_fd),timeout=cli_args.timeout)
+    serial_reader = SerialLineReader(serial_port)
+
+    if cli_args.replay_file is not None:
+        lines = load_replay_lines(cli_args.replay_file,cli_args.lines)
+    else:
+        lines = get_replay_lines(cli_args.lines or 20000)
+    sent_at = [0.0] * len(lines)
+    latencies = []
+    writer_thread = threading.Thread(name="ptyWriter", target=write_lines, args=(master_fd,lines,cli_args.rate,cli_args.chunk_size,sent_at))
+    writer_thread.daemon = True
+
+    start_time = time.perf_counter()
+    start_cpu = time.thread_time()
+    writer_thread.start()
+    received_count = 0
+    while received_count < len(lines):
+        raw_lines = serial_reader.read_lines()
+        received_at = time.perf_counter()
+        # lines come out in the order they were written, captured lines have no unique index in them
+        for index in range(received_count,min(len(lines),received_count + len(raw_lines))):
+            latencies.append(received_at - sent_at[index])
+        received_count += len(raw_lines)
+        # a read can end inside a line, stop only when writer is done and port is drained
+        if len(raw_lines) == 0 and not writer_thread.is_alive() and serial_port.in_waiting == 0:
+            break
+    reader_cpu = time.thread_time() - start_cpu
+    elapsed = time.perf_counter() - start_time
+
+    print("lines received: {count}/{total}, dropped bytes: {dropped}".format(count=received_count,total=len(lines),dropped=serial_reader.dropped_bytes))
+    print("elapsed: {elapsed:.2f}s, reader cpu: {cpu:.3f}s ({per_line:.1f}us per line, {load:.1f}% of one core)".format(elapsed=elapsed,cpu=reader_cpu,per_line=reader_cpu / max(1,received_count) * 1e6,load=reader_cpu / elapsed * 100))
+    if len(latencies) > 0:
+        print("latency ms: p50 {p50:.3f}, p99 {p99:.3f}, max {max:.3f}, mean {mean:.3f}".format(p50=get_percentile(latencies,50) * 1000,p99=get_percentile(latencies,99) * 1000,max=max(latencies) * 1000,mean=statistics.mean(latencies) * 1000))
+
+    serial_port.close()
+    os.close(master_fd)
+    os.close(slave_fd)
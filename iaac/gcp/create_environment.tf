@@ -104,6 +104,36 @@ resource "google_bigquery_table" "iot_base_table" {
     "type": "INTEGER",
     "mode": "NULLABLE",
     "description": "Location ID"
+  },
+  {
+    "name": "interval",
+    "type": "INTEGER",
+    "mode": "NULLABLE",
+    "description": "Aggregation window length in seconds, empty for raw messages"
+  },
+  {
+    "name": "count",
+    "type": "INTEGER",
+    "mode": "NULLABLE",
+    "description": "Messages aggregated in window, measure_value is their mean"
+  },
+  {
+    "name": "min_value",
+    "type": "NUMERIC",
+    "mode": "NULLABLE",
+    "description": "Lowest measure value in window"
+  },
+  {
+    "name": "max_value",
+    "type": "NUMERIC",
+    "mode": "NULLABLE",
+    "description": "Highest measure value in window"
+  },
+  {
+    "name": "last_value",
+    "type": "NUMERIC",
+    "mode": "NULLABLE",
+    "description": "Newest measure value in window"
   }]
 EOF
 }
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+
+import os
+import json
+import math
+import gzip
+
+from message_object import MessageObject
+from message_batch import MessageBatch, numpy
+
+def open_input_file(file_name):
+    # rotated data file segments are gzipped
+    if file_name.endswith(".gz"):
+        return gzip.open(file_name,"rb")
+    return open(file_name,"rb")
+
+def get_input_ranges(file_name,start_offset,end_offset,workers):
+    # gzip can not be split without decompressing from start, one worker reads it all
+    if file_name.endswith(".gz") or workers <= 1:
+        return [(start_offset,end_offset)]
+    if end_offset is None:
+        end_offset = os.path.getsize(file_name)
+    range_size = max(1,(end_offset - start_offset) // workers)
+    range_starts = list(range(start_offset,end_offset,range_size))[:workers]
+    return list(zip(range_starts,range_starts[1:] + [end_offset]))
+
+def seek_line_start(input_file,offset):
+    # offset can point into the middle of a line, that line belongs to previous range
+    if offset == 0:
+        return 0
+    input_file.seek(offset - 1)
+    if input_file.read(1) == b"\n":
+        return offset
+    return offset + len(input_file.readline())
+
+def read_line_chunks(input_file,chunk_size,start_offset=0,end_offset=None):
+    # yields lines with offset just after them, lines starting before end_offset belong to this range
+    offset = seek_line_start(input_file,start_offset)
+    while end_offset is None or offset < end_offset:
+        lines = []
+        for line in input_file:
+            lines.append(line)
+            offset += len(line)
+            if len(lines) >= chunk_size or (end_offset is not None and offset >= end_offset):
+                break
+        if len(lines) == 0:
+            return
+        yield lines, offset
+
+def get_record_message(record):
+    # same rules as MessageBatch: timestamp is required (backfill must not get current time),
+    # values are finite and fields fit binary layout
+    msg = MessageObject()
+    if MessageObject.is_binary_message(record):
+        if not msg.create_message_from_bytes(record):
+            return None
+    else:
+        msg_dict = json.loads(record)
+        if not isinstance(msg_dict,dict) or 'timestamp' not in msg_dict:
+            return None
+        if not msg.create_message_from_dict(msg_dict):
+            return None
+    if not (math.isfinite(float(msg.get_timestamp())) and math.isfinite(float(msg.get_measure_value()))):
+        return None
+    msg.export_message_binary()
+    return msg
+
+def get_valid_messages(lines,wire_format):
+    records = [line.strip() for line in lines if line.strip()]
+    if numpy is not None:
+        # whole chunk validated at once, JSON goes to Redis in the same form the reader writes
+        message_batch = MessageBatch.from_records(records)
+        if wire_format == "binary":
+            return message_batch.export_binary(), len(records)
+        msg_objs = message_batch.get_message_objects(records)
+        return [msg_obj.export_message_bytes() for msg_obj, valid in zip(msg_objs,message_batch.valid.tolist()) if valid and msg_obj is not None], len(records)
+
+    msgs = []
+    for record in records:
+        # one bad line is counted as invalid, it does not stop the load
+        try:
+            msg = get_record_message(record)
+        except Exception:
+            msg = None
+        if msg is None:
+            continue
+        if wire_format == "binary":
+            msgs.append(msg.export_message_binary())
+        else:
+            msgs.append(msg.export_message_bytes())
+    return msgs, len(records)
@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+
+import abc
+import asyncio
+import concurrent.futures
+import logging
+import traceback
+
+from http_client import ExporterHttpClient
+from retry_policy import is_permanent_status
+from message_aggregator import AggregatedMessage, MessageAggregator
+from pubsub_publisher import get_envelope
+
+## graphite helpers, shared with msg_export_graphite.py
+def get_metric_object(metric,value,timestamp,interval=60):
+    metric_object = dict()
+    metric_object['name'] = metric
+    metric_object['metric'] = metric
+    metric_object['value'] = value
+    metric_object['interval'] = interval
+    # metric_object['unit'] = Null
+    metric_object['time'] = int(timestamp)
+    metric_object['mtype'] = "count"
+    # graphite_data['tags'] = []
+    return metric_object
+
+def get_graphite_metrics(msg_obj,configuration):
+    metric_key = "{prefix}.{device}.{metric_name}".format(device=msg_obj.get_device_id(),metric_name=msg_obj.get_measure_name(),prefix=configuration['prefix'])
+    metric_key_cycle = "{prefix}.{device}.cycle_number".format(device=msg_obj.get_device_id(),prefix=configuration['prefix'])
+    logging.debug("Metric: {metric_key}:{value}".format(metric_key=metric_key,value=msg_obj.get_measure_value()))
+
+    if not isinstance(msg_obj,AggregatedMessage):
+        interval = configuration.get('interval',60)
+        graphite_measure_data = get_metric_object(metric_key,msg_obj.get_measure_value(),msg_obj.get_timestamp(),interval)
+        graphite_cycle_number = get_metric_object(metric_key_cycle,msg_obj.get_cycle_number(),msg_obj.get_timestamp(),interval)
+        return [graphite_measure_data,graphite_cycle_number]
+
+    # aggregated window, mean stays under the raw metric name so existing dashboards keep working
+    interval = msg_obj.get_interval()
+    timestamp = msg_obj.get_timestamp()
+    return [
+        get_metric_object(metric_key,msg_obj.get_measure_value(),timestamp,interval),
+        get_metric_object(metric_key+"_min",msg_obj.get_min_value(),timestamp,interval),
+        get_metric_object(metric_key+"_max",msg_obj.get_max_value(),timestamp,interval),
+        get_metric_object(metric_key+"_last",msg_obj.get_last_value(),timestamp,interval),
+        get_metric_object(metric_key+"_count",msg_obj.get_count(),timestamp,interval),
+        get_metric_object(metric_key_cycle,msg_obj.get_cycle_number(),timestamp,interval)
+    ]
+
+def graphite_http_client_open(configuration,timeout,gzip_threshold,pool_size=2):
+    headers = {
+        "Authorization": "Bearer {user}:{password}".format(user=configuration['user'],password=configuration['password'])
+    }
+    return ExporterHttpClient(configuration['url'],headers=headers,timeout=timeout,gzip_threshold=gzip_threshold,pool_size=pool_size)
+
+## webapi helpers, shared with msg_export_webapi.py
+def webapi_http_client_open(configuration,timeout,gzip_threshold,pool_size=2):
+    headers = {
+        "Authorization": "Bearer {auth_bearer}".format(auth_bearer=configuration['auth'])
+    }
+    return ExporterHttpClient(configuration['url'],headers=headers,timeout=timeout,gzip_threshold=gzip_threshold,pool_size=pool_size)
+
+def get_webapi_batch_body(msg_objs,batch_format):
+    # messages are already serialized, batch body is just joined bytes
+    if batch_format == "ndjson":
+        body = b"\n".join([msg_obj.export_message_bytes() for msg_obj in msg_objs]) + b"\n"
+        return body, "application/x-ndjson"
+    body = b"[" + b",".join([msg_obj.export_message_bytes() for msg_obj in msg_objs]) + b"]"
+    return body, "application/json"
+
+# endpoint does not take batches at all, exporter switches to single messages for good
+webapi_batch_unsupported_codes = frozenset([404,405,415])
+# some message in batch is bad, only this batch goes as single messages
+webapi_batch_fallback_codes = frozenset([400,422])
+webapi_batch_too_large_code = 413
+
+def webapi_send_each(msg_objs,rmsgs,http_client,rmsg_sent,rmsg_failed,rmsg_rejected):
+    for msg_obj, rmsg in zip(msg_objs,rmsgs):
+        try:
+            result = http_client.post_data(msg_obj.export_message_bytes())
+        except Exception:
+            logging.error("Error during message publishing")
+            logging.error(traceback.format_exc())
+            rmsg_failed.append(rmsg)
+            continue
+        if result.ok:
+            rmsg_sent.append(rmsg)
+            continue
+        logging.error("Error while exporting data to webapi: {}".format(result.text))
+        if is_permanent_status(result.status_code):
+            rmsg_rejected.append(rmsg)
+        else:
+            rmsg_failed.append(rmsg)
+
+def webapi_send_messages(msg_objs,rmsgs,http_client,batch_format):
+    # returns sent, failed (worth retry) and rejected (permanent) raw messages, and batch format for next batches
+    rmsg_sent = []
+    rmsg_failed = []
+    rmsg_rejected = []
+    batches = [(msg_objs,rmsgs)]
+    while len(batches) > 0:
+        msg_batch, rmsg_batch = batches.pop(0)
+        if batch_format is None or len(msg_batch) == 1:
+            webapi_send_each(msg_batch,rmsg_batch,http_client,rmsg_sent,rmsg_failed,rmsg_rejected)
+            continue
+
+        body, content_type = get_webapi_batch_body(msg_batch,batch_format)
+        logging.debug("Batch of {count} messages to webapi, {size} bytes".format(count=len(msg_batch),size=len(body)))
+        try:
+            result = http_client.post_data(body,content_type=content_type)
+        except Exception:
+            logging.error("Error during batch publishing")
+            logging.error(traceback.format_exc())
+            rmsg_failed.extend(rmsg_batch)
+            continue
+
+        if result.ok:
+            rmsg_sent.extend(rmsg_batch)
+        elif result.status_code == webapi_batch_too_large_code:
+            # halves go first, order of messages is kept
+            logging.warning("Webapi batch of {count} messages is too large, splitting it".format(count=len(msg_batch)))
+            half = len(msg_batch) // 2
+            batches[0:0] = [(msg_batch[:half],rmsg_batch[:half]),(msg_batch[half:],rmsg_batch[half:])]
+        elif result.status_code in webapi_batch_unsupported_codes:
+            logging.warning("Webapi does not accept batches (status {code}), switching to single messages".format(code=result.status_code))
+            batch_format = None
+            batches.insert(0,(msg_batch,rmsg_batch))
+        elif result.status_code in webapi_batch_fallback_codes:
+            logging.warning("Webapi rejected batch with status {code}, sending its messages one by one".format(code=result.status_code))
+            webapi_send_each(msg_batch,rmsg_batch,http_client,rmsg_sent,rmsg_failed,rmsg_rejected)
+        elif is_permanent_status(result.status_code):
+            logging.error("Webapi rejected batch with status {code}: {text}".format(code=result.status_code,text=result.text))
+            rmsg_rejected.extend(rmsg_batch)
+        else:
+            logging.error("Error while exporting batch to webapi: {}".format(result.text))
+            rmsg_failed.extend(rmsg_batch)
+    return rmsg_sent, rmsg_failed, rmsg_rejected, batch_format
+
+## sinks for msg_exporter.py
+class ExportSink(abc.ABC):
+
+    name = None
+    default_redis_list = None
+    default_batch_size = 100
+    default_concurrency = 1
+
+    def __init__(self,redis_list=None,batch_size=None,concurrency=None,aggregate_window=None,aggregate_max_pending=10000):
+        self.redis_list = redis_list or self.default_redis_list
+        self.batch_size = batch_size or self.default_batch_size
+        self.concurrency = concurrency or self.default_concurrency
+        # own thread pool, one slow sink can not take threads of the others
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.concurrency,thread_name_prefix=self.name)
+        # raw messages by default, with window set the sink gets AggregatedMessage objects
+        self.aggregator = None
+        if aggregate_window:
+            self.aggregator = MessageAggregator(window=aggregate_window,max_pending=aggregate_max_pending)
+
+    def accepts(self,msg_obj):
+        return True
+
+    async def run_blocking(self,func,*args):
+        # HTTP clients are synchronous, they run on the sink thread pool
+        return await asyncio.get_running_loop().run_in_executor(self.executor,func,*args)
+
+    @abc.abstractmethod
+    async def send_batch(self,msg_objs,rmsgs):
+        # every sink implements it, returns list of raw messages which failed and need to go back to queue
+        pass
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+class GraphiteSink(ExportSink):
+
+    name = "graphite"
+    default_redis_list = "metrics_graphite"
+    default_batch_size = 100
+    default_concurrency = 2
+
+    def __init__(self,configuration,timeout=30,gzip_threshold=0,**kwargs):
+        super().__init__(**kwargs)
+        self.configuration = configuration
+        # one pooled connection for each concurrent send_batch
+        self.http_client = graphite_http_client_open(configuration,timeout=timeout,gzip_threshold=gzip_threshold,pool_size=self.concurrency)
+
+    async def send_batch(self,msg_objs,rmsgs):
+        graphite_data = []
+        for msg_obj in msg_objs:
+            graphite_data.extend(get_graphite_metrics(msg_obj,self.configuration))
+        result = await self.run_blocking(self.http_client.post_json,graphite_data)
+        if not result.ok:
+            logging.error("Error while exporting data to graphite: {}".format(result.text))
+            return rmsgs
+        return []
+
+    def close(self):
+        super().close()
+        self.http_client.close()
+
+class WebapiSink(ExportSink):
+
+    name = "webapi"
+    default_redis_list = "metrics_webapi"
+    default_batch_size = 100
+    default_concurrency = 1
+
+    def __init__(self,configuration,batch_format=None,timeout=30,gzip_threshold=0,**kwargs):
+        super().__init__(**kwargs)
+        self.batch_format = batch_format
+        if batch_format is None:
+            self.batch_size = 1
+        self.measure_names = frozenset(configuration.get('measure_names',["MSGC_TEMPERATURE","MSGC_HUMIDITY"]))
+        self.http_client = webapi_http_client_open(configuration,timeout=timeout,gzip_threshold=gzip_threshold,pool_size=self.concurrency)
+
+    def accepts(self,msg_obj):
+        return msg_obj.get_measure_name() in self.measure_names
+
+    async def send_batch(self,msg_objs,rmsgs):
+        # rejected messages go back too, after max attempts they end in dead letter list
+        rmsg_sent, rmsg_failed, rmsg_rejected, self.batch_format = await self.run_blocking(webapi_send_messages,msg_objs,rmsgs,self.http_client,self.batch_format)
+        return rmsg_failed + rmsg_rejected
+
+    def close(self):
+        super().close()
+        self.http_client.close()
+
+class PubSubSink(ExportSink):
+
+    name = "pubsub"
+    default_redis_list = "metrics_pubsub"
+    default_batch_size = 500
+    default_concurrency = 4
+
+    def __init__(self,publisher,topic,envelope_size=0,**kwargs):
+        super().__init__(**kwargs)
+        self.publisher = publisher
+        self.topic = topic
+        self.envelope_size = envelope_size
+
+    async def send_batch(self,msg_objs,rmsgs):
+        # raw bytes go to PubSub as they are, futures from client are awaited together
+        if self.envelope_size > 0:
+            rmsg_groups = [rmsgs[i:i+self.envelope_size] for i in range(0,len(rmsgs),self.envelope_size)]
+            publishing_futures = []
+            for rmsg_group in rmsg_groups:
+                envelope_data, envelope_attributes = get_envelope(rmsg_group)
+                publishing_futures.append(asyncio.wrap_future(self.publisher.publish(self.topic,envelope_data,**envelope_attributes)))
+        else:
+            rmsg_groups = [[rmsg] for rmsg in rmsgs]
+            publishing_futures = [asyncio.wrap_future(self.publisher.publish(self.topic,rmsg)) for rmsg in rmsgs]
+        results = await asyncio.gather(*publishing_futures,return_exceptions=True)
+
+        rmsg_failed = []
+        for rmsg_group, result in zip(rmsg_groups,results):
+            if isinstance(result,Exception):
+                logging.error("Error during message publishing: {err}".format(err=result))
+                rmsg_failed.extend(rmsg_group)
+        return rmsg_failed
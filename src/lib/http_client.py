@@ -0,0 +1,35 @@
+#!/usr/bin/env python3
+
+import json
+import gzip
+import requests
+from requests.adapters import HTTPAdapter
+
+class ExporterHttpClient:
+
+    # one keep-alive session per exporter, headers are prepared once
+    def __init__(self,url,headers=None,timeout=(5,30),gzip_threshold=0,pool_size=2):
+        self.url = url
+        self.timeout = timeout
+        self.gzip_threshold = gzip_threshold
+
+        self.session = requests.Session()
+        http_adapter = HTTPAdapter(pool_connections=1,pool_maxsize=pool_size)
+        self.session.mount("http://",http_adapter)
+        self.session.mount("https://",http_adapter)
+        if headers is not None:
+            self.session.headers.update(headers)
+
+    def post_json(self,payload):
+        return self.post_data(json.dumps(payload).encode('utf-8'))
+
+    def post_data(self,body,content_type='application/json'):
+        headers = {'Content-Type': content_type}
+        # off by default, not every endpoint accepts gzip bodies; small bodies are not worth the CPU
+        if self.gzip_threshold and len(body) >= self.gzip_threshold:
+            body = gzip.compress(body,compresslevel=5)
+            headers['Content-Encoding'] = 'gzip'
+        return self.session.post(self.url,data=body,headers=headers,timeout=self.timeout)
+
+    def close(self):
+        self.session.close()
@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+
+import time
+import json
+import logging
+
+# optional faster JSON encoder, output is plain JSON in both cases
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+class AggregatedMessage:
+
+    # min/max/mean/last/count of one series in one window, exporters read it like MessageObject
+    __slots__ = (
+        "device_id",
+        "measure_code",
+        "measure_name",
+        "version",
+        "location_id",
+        "window_start",
+        "window",
+        "count",
+        "min_value",
+        "max_value",
+        "sum_value",
+        "last_value",
+        "last_timestamp",
+        "cycle_number",
+        "updated_at",
+        "export_cache"
+    )
+
+    def __init__(self,msg_obj,window_start,window):
+        self.device_id = msg_obj.get_device_id()
+        self.measure_code = msg_obj.get_measure_code()
+        self.measure_name = msg_obj.get_measure_name()
+        self.version = msg_obj.get_version()
+        self.location_id = msg_obj.get_location_id()
+        self.window_start = window_start
+        self.window = window
+        self.count = 0
+        self.min_value = None
+        self.max_value = None
+        self.sum_value = 0.0
+        self.last_value = None
+        self.last_timestamp = None
+        self.cycle_number = None
+        self.updated_at = None
+        self.export_cache = None
+
+    def add(self,msg_obj):
+        value = msg_obj.get_measure_value()
+        if self.count == 0:
+            self.min_value = value
+            self.max_value = value
+        else:
+            self.min_value = min(self.min_value,value)
+            self.max_value = max(self.max_value,value)
+        self.count += 1
+        self.sum_value += value
+        # messages can come newest first, last is decided by timestamp
+        timestamp = msg_obj.get_timestamp()
+        if self.last_timestamp is None or timestamp >= self.last_timestamp:
+            self.last_timestamp = timestamp
+            self.last_value = value
+            self.cycle_number = msg_obj.get_cycle_number()
+        self.export_cache = None
+
+    def get_device_id(self):
+        return self.device_id
+
+    def get_measure_code(self):
+        return self.measure_code
+
+    def get_measure_name(self):
+        return self.measure_name
+
+    def get_measure_value(self):
+        return self.sum_value / self.count
+
+    def get_timestamp(self):
+        return self.window_start
+
+    def get_cycle_number(self):
+        return self.cycle_number
+
+    def get_version(self):
+        return self.version
+
+    def get_location_id(self):
+        return self.location_id
+
+    def get_interval(self):
+        return self.window
+
+    def get_count(self):
+        return self.count
+
+    def get_min_value(self):
+        return self.min_value
+
+    def get_max_value(self):
+        return self.max_value
+
+    def get_last_value(self):
+        return self.last_value
+
+    def export_message(self):
+        return self.export_message_bytes().decode('utf-8')
+
+    def export_message_bytes(self):
+        if self.export_cache is not None:
+            return self.export_cache
+
+        # same fields as raw message, measure_value is the mean of the window
+        msg = dict()
+        msg["timestamp"] = float(self.get_timestamp())
+        msg["device_id"] = str(self.get_device_id())
+        msg["measure_code"] = str(self.get_measure_code())
+        msg["measure_value"] = float(self.get_measure_value())
+        msg["measure_name"] = str(self.get_measure_name())
+        msg["cycle_number"] = int(self.get_cycle_number())
+        msg["version"] = int(self.get_version())
+        msg["location_id"] = int(self.get_location_id())
+        msg["interval"] = int(self.get_interval())
+        msg["count"] = int(self.get_count())
+        msg["min_value"] = float(self.get_min_value())
+        msg["max_value"] = float(self.get_max_value())
+        msg["last_value"] = float(self.get_last_value())
+        if orjson is not None:
+            self.export_cache = orjson.dumps(msg)
+        else:
+            self.export_cache = json.dumps(msg).encode('utf-8')
+        return self.export_cache
+
+class MessageAggregator:
+
+    # few open windows per device_id + measure_code, memory does not grow with message rate
+    def __init__(self,window=60,grace=5,max_windows=4,max_pending=10000,clock=time.time):
+        self.window = window
+        self.grace = grace
+        self.max_windows = max_windows
+        # raw messages are acked when folded, failed windows are kept in memory up to this many
+        self.max_pending = max_pending
+        self.clock = clock
+        self.series = {}
+        self.closed = []
+        self.aggregated_total = 0
+        self.evicted_total = 0
+        self.dropped_total = 0
+
+    def get_window_start(self,timestamp):
+        return int(timestamp // self.window * self.window)
+
+    def add(self,msg_obj):
+        series_key = (msg_obj.get_device_id(),msg_obj.get_measure_code())
+        window_start = self.get_window_start(msg_obj.get_timestamp())
+        self.aggregated_total += 1
+
+        # consumers take newest messages first, so windows are filled in either direction
+        series_windows = self.series.setdefault(series_key,{})
+        aggregate = series_windows.get(window_start)
+        if aggregate is None:
+            if len(series_windows) >= self.max_windows:
+                # window farthest from the new one is the one traversal has left behind
+                evicted_start = max(series_windows,key=lambda open_start: abs(open_start - window_start))
+                self.closed.append(series_windows.pop(evicted_start))
+                self.evicted_total += 1
+            aggregate = AggregatedMessage(msg_obj,window_start,self.window)
+            series_windows[window_start] = aggregate
+        aggregate.add(msg_obj)
+        aggregate.updated_at = self.clock()
+        return aggregate
+
+    def collect(self,now=None):
+        # windows which ended and got no message for grace seconds, plus windows evicted by add
+        if now is None:
+            now = self.clock()
+        for series_key, series_windows in list(self.series.items()):
+            for window_start, aggregate in list(series_windows.items()):
+                if window_start + self.window <= now and aggregate.updated_at + self.grace <= now:
+                    self.closed.append(series_windows.pop(window_start))
+            if len(series_windows) == 0:
+                del self.series[series_key]
+
+        closed = self.closed
+        self.closed = []
+        return closed
+
+    def requeue(self,aggregates):
+        # windows which failed to export are returned by next collect, oldest ones over max_pending are dropped
+        self.closed[0:0] = aggregates
+        dropped_count = len(self.closed) - self.max_pending
+        if self.max_pending <= 0 or dropped_count <= 0:
+            return len(aggregates)
+        del self.closed[:dropped_count]
+        self.dropped_total += dropped_count
+        logging.warning("Dropping {count} oldest aggregated windows, more than {max_pending} wait for export".format(count=dropped_count,max_pending=self.max_pending))
+        return max(0,len(aggregates) - dropped_count)
+
+    def get_stats(self):
+        return {
+            "open_series": len(self.series),
+            "open_windows": sum([len(series_windows) for series_windows in self.series.values()]),
+            "closed_pending": len(self.closed),
+            "aggregated_total": self.aggregated_total,
+            "evicted_total": self.evicted_total,
+            "dropped_total": self.dropped_total
+        }
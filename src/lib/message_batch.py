@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+
+import json
+
+from message_object import MessageObject
+
+# numpy is optional, only bulk paths need it
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# optional faster JSON decoder
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+def get_binary_dtype():
+    # same packed layout as MessageObject.binary_struct
+    return numpy.dtype([
+        ("magic","u1"),
+        ("timestamp","<f8"),
+        ("device_id","S2"),
+        ("measure_code","S1"),
+        ("measure_value","<f8"),
+        ("cycle_number","<u4"),
+        ("location_id","<u2"),
+        ("version","u1")
+    ])
+
+def get_json_record_values(record):
+    if orjson is not None:
+        msg = orjson.loads(record)
+    else:
+        msg = json.loads(record)
+    values = (
+        float(msg["timestamp"]),
+        str(msg["device_id"]).encode('ascii'),
+        str(msg["measure_code"]).encode('ascii'),
+        float(msg["measure_value"]),
+        int(msg["cycle_number"]),
+        int(msg.get("location_id",101)),
+        int(msg.get("version",1))
+    )
+    # columns have fixed width, records not fitting them are invalid
+    if len(values[1]) != 2 or len(values[2]) != 1:
+        raise ValueError("device id or measure code does not fit")
+    if not (0 <= values[4] < 2**32 and 0 <= values[5] < 2**16 and 0 <= values[6] < 2**8):
+        raise ValueError("cycle number, location id or version out of range")
+    return values
+
+def decode_message(record):
+    msg_obj = MessageObject()
+    if msg_obj.create_message_from_bytes(record):
+        return msg_obj
+    return None
+
+def decode_messages(records):
+    # message objects in order of records, None for invalid ones
+    if numpy is None or len(records) == 0:
+        return [decode_message(record) for record in records]
+    return MessageBatch.from_records(records).get_message_objects(records)
+
+class MessageBatch:
+
+    # columnar view of many exported messages, bad records are masked out instead of collecting error lists
+    def __init__(self,size):
+        if numpy is None:
+            raise ValueError("columnar batch decode requires numpy module")
+        self.timestamps = numpy.zeros(size,dtype=numpy.float64)
+        self.device_ids = numpy.zeros(size,dtype="S2")
+        self.measure_codes = numpy.zeros(size,dtype="S1")
+        self.measure_values = numpy.zeros(size,dtype=numpy.float64)
+        self.cycle_numbers = numpy.zeros(size,dtype=numpy.uint32)
+        self.location_ids = numpy.zeros(size,dtype=numpy.uint16)
+        self.versions = numpy.zeros(size,dtype=numpy.uint8)
+        self.valid = numpy.zeros(size,dtype=bool)
+
+    def __len__(self):
+        return len(self.valid)
+
+    @classmethod
+    def from_records(cls,records):
+        batch = cls(len(records))
+        binary_size = MessageObject.binary_struct.size
+        binary_index = []
+        json_index = []
+        for index, record in enumerate(records):
+            if MessageObject.is_binary_message(record) and len(record) == binary_size:
+                binary_index.append(index)
+            else:
+                json_index.append(index)
+
+        if len(binary_index) > 0:
+            batch.decode_binary(numpy.array(binary_index,dtype=numpy.intp),b"".join([records[index] for index in binary_index]))
+        if len(json_index) > 0:
+            batch.decode_json(numpy.array(json_index,dtype=numpy.intp),[records[index] for index in json_index])
+
+        # measure codes are checked for whole batch at once
+        known_codes = numpy.array([code.encode('ascii') for code in MessageObject.dict_measure_names],dtype="S1")
+        batch.valid &= numpy.isin(batch.measure_codes,known_codes)
+        batch.valid &= numpy.char.str_len(batch.device_ids) > 0
+        batch.valid &= numpy.isfinite(batch.measure_values)
+        batch.valid &= numpy.isfinite(batch.timestamps)
+        return batch
+
+    def decode_binary(self,index,records_bytes):
+        # fixed size records, whole block is read without a Python loop
+        binary_records = numpy.frombuffer(records_bytes,dtype=get_binary_dtype())
+        self.timestamps[index] = binary_records["timestamp"]
+        self.device_ids[index] = binary_records["device_id"]
+        self.measure_codes[index] = binary_records["measure_code"]
+        self.measure_values[index] = binary_records["measure_value"]
+        self.cycle_numbers[index] = binary_records["cycle_number"]
+        self.location_ids[index] = binary_records["location_id"]
+        self.versions[index] = binary_records["version"]
+        self.valid[index] = binary_records["magic"] == MessageObject.binary_magic
+
+    def decode_json(self,index,records):
+        # JSON has no fixed layout, records are parsed one by one into plain tuples and copied as columns
+        rows = []
+        rows_valid = []
+        for record in records:
+            try:
+                rows.append(get_json_record_values(record))
+                rows_valid.append(True)
+            except Exception:
+                rows.append((0.0,b"",b"",0.0,0,0,0))
+                rows_valid.append(False)
+
+        timestamps, device_ids, measure_codes, measure_values, cycle_numbers, location_ids, versions = zip(*rows)
+        self.timestamps[index] = timestamps
+        self.device_ids[index] = device_ids
+        self.measure_codes[index] = measure_codes
+        self.measure_values[index] = measure_values
+        self.cycle_numbers[index] = cycle_numbers
+        self.location_ids[index] = location_ids
+        self.versions[index] = versions
+        self.valid[index] = rows_valid
+
+    def get_valid_count(self):
+        return int(numpy.count_nonzero(self.valid))
+
+    def get_measure_names(self):
+        measure_names = numpy.empty(len(self),dtype=object)
+        for measure_code, measure_name in MessageObject.dict_measure_names.items():
+            measure_names[self.measure_codes == measure_code.encode('ascii')] = measure_name
+        return measure_names
+
+    def get_message_objects(self,records):
+        # exporters still need one object per message, valid rows are filled from columns in one pass
+        msg_objs = [None] * len(self)
+        columns = zip(
+            self.valid.tolist(),
+            self.timestamps.tolist(),
+            self.device_ids.tolist(),
+            self.measure_codes.tolist(),
+            self.measure_values.tolist(),
+            self.cycle_numbers.tolist(),
+            self.location_ids.tolist(),
+            self.versions.tolist()
+        )
+        for index, (valid, timestamp, device_id, measure_code, measure_value, cycle_number, location_id, version) in enumerate(columns):
+            if valid and device_id.isascii():
+                msg_obj = MessageObject()
+                if msg_obj.create_message_from_values(timestamp,device_id.decode('ascii'),measure_code.decode('ascii'),measure_value,cycle_number,location_id,version):
+                    msg_objs[index] = msg_obj
+            else:
+                # columns are stricter than MessageObject, rejected rows get the per-object decode
+                msg_objs[index] = decode_message(records[index])
+        return msg_objs
+
+    def export_binary(self,mask=None):
+        # packed records for Redis, mask defaults to valid records
+        if mask is None:
+            mask = self.valid
+        binary_records = numpy.zeros(int(numpy.count_nonzero(mask)),dtype=get_binary_dtype())
+        binary_records["magic"] = MessageObject.binary_magic
+        binary_records["timestamp"] = self.timestamps[mask]
+        binary_records["device_id"] = self.device_ids[mask]
+        binary_records["measure_code"] = self.measure_codes[mask]
+        binary_records["measure_value"] = self.measure_values[mask]
+        binary_records["cycle_number"] = self.cycle_numbers[mask]
+        binary_records["location_id"] = self.location_ids[mask]
+        binary_records["version"] = self.versions[mask]
+        record_size = binary_records.dtype.itemsize
+        records_bytes = binary_records.tobytes()
+        return [records_bytes[i:i+record_size] for i in range(0,len(records_bytes),record_size)]
@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+
+import time
+import collections
+
+class MessageDeduplicator:
+
+    # radio retransmissions repeat device_id/cycle_number/measure_code, recent keys are kept in bounded LRU
+    def __init__(self,max_size=4096,max_age=300,clock=time.monotonic):
+        self.max_size = max_size
+        self.max_age = max_age
+        self.clock = clock
+        self.recent_keys = collections.OrderedDict()
+        self.duplicates_total = 0
+        self.evicted_total = 0
+
+    def get_message_key(self,msg_obj):
+        return (msg_obj.get_device_id(),msg_obj.get_cycle_number(),msg_obj.get_measure_code())
+
+    def is_duplicate(self,msg_obj):
+        msg_key = self.get_message_key(msg_obj)
+        now = self.clock()
+
+        seen_at = self.recent_keys.get(msg_key)
+        # cycle counter wraps around, same key after max_age is a new message
+        if seen_at is not None and now - seen_at < self.max_age:
+            # key still in use stays in cache, first seen time is kept so max_age still holds
+            self.recent_keys.move_to_end(msg_key)
+            self.duplicates_total += 1
+            return True
+
+        self.recent_keys[msg_key] = now
+        self.recent_keys.move_to_end(msg_key)
+        if len(self.recent_keys) > self.max_size:
+            self.recent_keys.popitem(last=False)
+            self.evicted_total += 1
+        return False
+
+    def get_stats(self):
+        return {
+            "tracked_keys": len(self.recent_keys),
+            "duplicates_total": self.duplicates_total,
+            "evicted_total": self.evicted_total
+        }
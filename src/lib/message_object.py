@@ -1,13 +1,22 @@
 #!/usr/bin/env python3
 
 import datetime
+import time
 import ast
 import traceback
 import json
+import struct
+from types import MappingProxyType
+
+# optional faster JSON encoder, output is plain JSON in both cases
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 class MessageObject:
 
-    dict_measure_codes = {
+    dict_measure_codes = MappingProxyType({
         "MSGC_TEMPERATURE": "1",
         "MSGC_HUMIDITY": "2",
         "MSGC_BATTERY_VOLTAGE": "3",
@@ -23,20 +32,43 @@ class MessageObject:
         "MSGC_ID_3" : "d", # 13
         "MSGC_ID_4" : "e", # 14
         "MSGC_STARTUP_CODE" : "f" # 0xF, 15
-    }
-
-    measure_name = None
-    measure_code = None
-    measure_value = None
-    device_id = None
-    timestamp = None
-    cycle_number = None
-    version = None
-    location_id = None
-
-    validation_errors = []
+    })
+
+    # reverse lookup, built once at import
+    dict_measure_names = MappingProxyType({code: name for name, code in dict_measure_codes.items()})
+
+    # binary wire format v1: magic, timestamp, device id, measure code, value, cycle, location id, message version
+    binary_magic = 0xB1
+    binary_struct = struct.Struct("<Bd2s1sdIHB")
+
+    # fixed attribute layout, messages can pile up in queues so no per-instance __dict__
+    __slots__ = (
+        "measure_name",
+        "measure_code",
+        "measure_value",
+        "device_id",
+        "timestamp",
+        "cycle_number",
+        "version",
+        "location_id",
+        "validation_errors",
+        "source",
+        "export_cache"
+    )
 
     def __init__(self,msg_raw_line=None):
+        self.measure_name = None
+        self.measure_code = None
+        self.measure_value = None
+        self.device_id = None
+        self.timestamp = None
+        self.cycle_number = None
+        self.version = None
+        self.location_id = None
+        self.validation_errors = []
+        self.source = None
+        self.export_cache = None
+
         if msg_raw_line is not None:
             self.source = msg_raw_line
             self.create_message_from_raw_data(self.source)
@@ -85,19 +117,97 @@ class MessageObject:
         
 
     def create_message_from_raw_data(self,msg_raw_line):
-        try:
-            msg_raw_dict = {}
-            msg_raw_dict['timestamp'] = datetime.datetime.now().timestamp()
-            msg_raw_dict['device_id'] = self.extract_device_id(msg_raw_line)
-            msg_raw_dict['measure_code'] = self.extract_measure_code(msg_raw_line)
-            msg_raw_dict['measure_value'] = self.extract_measure_value(msg_raw_line)
-            msg_raw_dict['cycle_number'] = self.extract_cycle_number(msg_raw_line)
-            return self.create_message_from_dict(msg_raw_dict)
-        except Exception:
+        # single pass over DDcVALUE|CYCLE (v1) or DDcVALUE!CYCLE (v2) line
+        msg_head, separator, cycle_number = msg_raw_line.partition('|')
+        version = 1
+        if not separator:
+            msg_head, separator, cycle_number = msg_raw_line.partition('!')
+            version = 2
+        if not separator or len(msg_head) < 4:
             self.add_validation_error('cant process raw data')
             return False
 
+        measure_code = msg_head[2]
+        try:
+            measure_value = float(msg_head[3:])
+        except ValueError:
+            measure_value = None
+
+        self.export_cache = None
+        self.timestamp = time.time()
+        self.version = version
+        self.device_id = msg_head[0:2]
+        self.measure_code = measure_code if measure_code in self.dict_measure_names else None
+        self.measure_name = self.dict_measure_names.get(measure_code)
+        self.measure_value = measure_value
+        # truncated lines can end right after separator, cycle must be a plain integer
+        cycle_number = cycle_number.strip()
+        self.cycle_number = cycle_number if cycle_number.isascii() and cycle_number.isdigit() else None
+        self.location_id = 101
+        return self.validate()
+
+    def create_message_from_bytes(self,msg_bytes):
+        # binary wire format is recognised by its first byte, anything else is JSON
+        if not self.is_binary_message(msg_bytes):
+            return self.create_message_from_json(msg_bytes)
+
+        try:
+            magic, timestamp, device_id, measure_code, measure_value, cycle_number, location_id, version = self.binary_struct.unpack(msg_bytes)
+            device_id = device_id.decode('ascii')
+            measure_code = measure_code.decode('ascii')
+        except (struct.error,UnicodeDecodeError):
+            self.add_validation_error("cant unpack binary data")
+            return False
+
+        return self.create_message_from_values(timestamp,device_id,measure_code,measure_value,cycle_number,location_id,version)
+
+    def create_message_from_values(self,timestamp,device_id,measure_code,measure_value,cycle_number,location_id,version):
+        # already decoded fields, used by binary and columnar decode, setters are skipped
+        self.export_cache = None
+        self.timestamp = timestamp
+        self.version = version
+        self.device_id = device_id
+        self.measure_code = measure_code if measure_code in self.dict_measure_names else None
+        self.measure_name = self.dict_measure_names.get(measure_code)
+        self.measure_value = measure_value
+        self.cycle_number = cycle_number
+        self.location_id = location_id
+        return self.validate()
+
+    @classmethod
+    def is_binary_message(cls,msg_bytes):
+        return isinstance(msg_bytes,(bytes,bytearray)) and len(msg_bytes) > 0 and msg_bytes[0] == cls.binary_magic
+
+    def export_message_binary(self):
+        device_id = str(self.get_device_id()).encode('ascii')
+        measure_code = str(self.get_measure_code()).encode('ascii')
+        cycle_number = int(self.get_cycle_number())
+        location_id = int(self.get_location_id())
+        version = int(self.get_version())
+        # struct.error is not a ValueError, fields out of binary range are reported like the rest
+        if len(device_id) != 2 or len(measure_code) != 1 or not (0 <= cycle_number < 2**32 and 0 <= location_id < 2**16 and 0 <= version < 2**8):
+            raise ValueError("Message does not fit binary format: {device_id}:{measure_code}:{cycle}:{location}:{version}" \
+                .format(device_id=self.get_device_id(),measure_code=self.get_measure_code(),cycle=cycle_number,location=location_id,version=version)
+            )
+        return self.binary_struct.pack(
+            self.binary_magic,
+            float(self.get_timestamp()),
+            device_id,
+            measure_code,
+            float(self.get_measure_value()),
+            cycle_number,
+            location_id,
+            version
+        )
+
     def export_message(self):
+        return self.export_message_bytes().decode('utf-8')
+
+    def export_message_bytes(self):
+        # serialized once, setters drop the cached bytes
+        if self.export_cache is not None:
+            return self.export_cache
+
         msg = dict()
         msg["timestamp"] = float(self.get_timestamp())
         msg["device_id"] = str(self.get_device_id())
@@ -107,9 +217,14 @@ class MessageObject:
         msg["cycle_number"] = int(self.get_cycle_number())
         msg["version"] = int(self.get_version())
         msg["location_id"] = int(self.get_location_id())
-        return json.dumps(msg)
+        if orjson is not None:
+            self.export_cache = orjson.dumps(msg)
+        else:
+            self.export_cache = json.dumps(msg).encode('utf-8')
+        return self.export_cache
 
     def set_version(self,version):
+        self.export_cache = None
         self.version = version
         return True
 
@@ -168,6 +283,7 @@ class MessageObject:
         return msg_raw_line[0:2]
 
     def set_device_id(self,device_id):
+        self.export_cache = None
         self.device_id = device_id
         return True
 
@@ -178,7 +294,8 @@ class MessageObject:
         return msg_raw_line[2:3]
 
     def set_measure_code(self,measure_code):
-        if measure_code in self.dict_measure_codes.values():
+        self.export_cache = None
+        if measure_code in self.dict_measure_names:
             self.measure_code = measure_code
             return True
         else:
@@ -196,11 +313,12 @@ class MessageObject:
 
     def get_measure_name_by_code(self,measure_code):
         try:
-            return list(self.dict_measure_codes.keys())[list(self.dict_measure_codes.values()).index( measure_code )]
+            return self.dict_measure_names[measure_code]
         except:
             return None
 
     def set_measure_name(self,measure_name):
+        self.export_cache = None
         if measure_name is None or measure_name is False:
             self.measure_name = None
         else:
@@ -214,6 +332,7 @@ class MessageObject:
         return msg_raw_line[3:msg_raw_line.find('|',0)]
 
     def set_measure_value(self,measure_value):
+        self.export_cache = None
         try:
             self.measure_value = float(measure_value)
             return True
@@ -228,6 +347,7 @@ class MessageObject:
         return msg_raw_line[msg_raw_line.find('|',0)+1:len(msg_raw_line)].strip()
 
     def set_cycle_number(self,cycle_number):
+        self.export_cache = None
         self.cycle_number = cycle_number
         return True
 
@@ -235,6 +355,7 @@ class MessageObject:
         return self.cycle_number
 
     def set_location_id(self,location_id):
+        self.export_cache = None
         self.location_id = location_id
     
     def get_location_id(self):
@@ -244,6 +365,7 @@ class MessageObject:
         return self.timestamp
 
     def set_timestamp(self,timestamp=None):
+        self.export_cache = None
         if timestamp == None:
             self.timestamp = datetime.datetime.now().timestamp()
         else:
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+
+import threading
+import queue
+import time
+import random
+import concurrent.futures
+
+from message_object import MessageObject
+
+# envelope packs many messages into one PubSub message, cloud function recognises it by attributes
+envelope_schema_ndjson = "iot_msg_ndjson"
+envelope_schema_binary = "iot_msg_binary"
+envelope_version = "1"
+
+def get_envelope_attributes(count,schema=envelope_schema_ndjson):
+    # PubSub attributes are strings only
+    return {"schema": schema, "version": envelope_version, "count": str(count)}
+
+def get_ndjson_envelope(msgs_bytes):
+    return b"\n".join(msgs_bytes) + b"\n"
+
+def get_json_message(msg_bytes):
+    if not MessageObject.is_binary_message(msg_bytes):
+        return msg_bytes
+    msg = MessageObject()
+    msg.create_message_from_bytes(msg_bytes)
+    return msg.export_message_bytes()
+
+def get_envelope(msgs_bytes):
+    # binary messages have fixed size and are just concatenated, mixed batches go as NDJSON
+    if all([MessageObject.is_binary_message(msg_bytes) for msg_bytes in msgs_bytes]):
+        return b"".join(msgs_bytes), get_envelope_attributes(len(msgs_bytes),schema=envelope_schema_binary)
+    return get_ndjson_envelope([get_json_message(msg_bytes) for msg_bytes in msgs_bytes]), get_envelope_attributes(len(msgs_bytes))
+
+class PipelinedPublisher:
+
+    def __init__(self,publisher,topic,max_in_flight=1000):
+        self.publisher = publisher
+        self.topic = topic
+        self.max_in_flight = max_in_flight
+        self.in_flight = 0
+        self.in_flight_cond = threading.Condition()
+        self.completed = queue.Queue()
+
+    def get_in_flight(self):
+        return self.in_flight
+
+    def publish(self,rmsg,data=None,attributes=None):
+        # block while the window of outstanding futures is full
+        with self.in_flight_cond:
+            while self.in_flight >= self.max_in_flight:
+                self.in_flight_cond.wait()
+            self.in_flight += 1
+
+        try:
+            # rmsg identifies the message in results, data is sent instead of it when given
+            publishing_future = self.publisher.publish(self.topic,rmsg if data is None else data,**(attributes or {}))
+        except Exception:
+            self.release()
+            raise
+        publishing_future.add_done_callback(lambda future: self.on_publish_done(rmsg,future))
+        return publishing_future
+
+    def publish_envelope(self,rmsgs,data,attributes=None):
+        # one PubSub message for many raw messages, results are reported for each of them
+        return self.publish(tuple(rmsgs),data=data,attributes=attributes)
+
+    def on_publish_done(self,rmsg,future):
+        try:
+            future.result()
+            self.completed.put((rmsg,None))
+        except Exception as e:
+            self.completed.put((rmsg,e))
+        finally:
+            self.release()
+
+    def release(self):
+        with self.in_flight_cond:
+            self.in_flight -= 1
+            self.in_flight_cond.notify_all()
+
+    def wait_all(self,timeout=None):
+        with self.in_flight_cond:
+            return self.in_flight_cond.wait_for(lambda: self.in_flight == 0,timeout=timeout)
+
+    def collect_results(self):
+        succeeded = []
+        failed = []
+        while True:
+            try:
+                rmsg, error = self.completed.get_nowait()
+            except queue.Empty:
+                break
+            rmsgs = rmsg if isinstance(rmsg,tuple) else [rmsg]
+            if error is None:
+                succeeded.extend(rmsgs)
+            else:
+                failed.extend([(rmsg,error) for rmsg in rmsgs])
+        return succeeded, failed
+
+class StubPublisherClient:
+
+    # local stand-in for pubsub_v1.PublisherClient, futures resolve on a thread pool
+    def __init__(self,latency=0.0,failure_rate=0.0,workers=4):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+        self.published_count = 0
+        self.published_lock = threading.Lock()
+
+    def topic_path(self,project,topic):
+        return "projects/{project}/topics/{topic}".format(project=project,topic=topic)
+
+    def publish(self,topic,data,**attrs):
+        return self.executor.submit(self.deliver,data)
+
+    def deliver(self,data):
+        if self.latency > 0:
+            time.sleep(self.latency)
+        if random.random() < self.failure_rate:
+            raise RuntimeError("stub publish failure")
+        with self.published_lock:
+            self.published_count += 1
+        return str(self.published_count)
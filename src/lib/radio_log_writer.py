@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+
+import os
+import time
+import datetime
+import gzip
+import glob
+import shutil
+import threading
+import logging
+import traceback
+
+# zstd is optional, gzip from stdlib is always available
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+class RotatingLogWriter:
+
+    compression_suffix = {
+        "gzip": ".gz",
+        "zstd": ".zst"
+    }
+
+    def __init__(self,file_name,max_bytes=16*1024*1024,max_age=24*3600,flush_count=100,flush_interval=1.0,fsync=False,compression=None,max_segments=0,max_total_bytes=0):
+        if compression is not None and compression not in self.compression_suffix:
+            raise ValueError("Unknown compression: {c}".format(c=compression))
+        if compression == "zstd" and zstandard is None:
+            raise ValueError("zstd compression requires zstandard module")
+
+        self.file_name = file_name
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.flush_count = flush_count
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        self.compression = compression
+        # retention of rotated segments, 0 means keep all
+        self.max_segments = max_segments
+        self.max_total_bytes = max_total_bytes
+
+        self.lock = threading.Lock()
+        self.retention_lock = threading.Lock()
+        # segments being compressed are not removed under the compress thread
+        self.compressing = set()
+        self.log_file = None
+        self.open()
+
+    def open(self):
+        self.log_file = open(self.file_name,'ab')
+        self.file_size = self.log_file.tell()
+        self.file_opened = time.time()
+        self.pending_count = 0
+        self.last_commit = time.time()
+
+    def write(self,msg_bytes):
+        with self.lock:
+            self.log_file.write(msg_bytes + b"\n")
+            self.file_size += len(msg_bytes) + 1
+            self.pending_count += 1
+
+            if self.pending_count >= self.flush_count:
+                self.commit_locked()
+            if self.file_size >= self.max_bytes or time.time() - self.file_opened >= self.max_age:
+                self.rotate_locked()
+
+    def commit_if_due(self):
+        # group commit: flush after flush_count messages or flush_interval seconds, whichever first
+        with self.lock:
+            if self.pending_count > 0 and time.time() - self.last_commit >= self.flush_interval:
+                self.commit_locked()
+            if self.file_size > 0 and time.time() - self.file_opened >= self.max_age:
+                self.rotate_locked()
+
+    def commit(self):
+        with self.lock:
+            self.commit_locked()
+
+    def commit_locked(self):
+        self.log_file.flush()
+        if self.fsync:
+            os.fsync(self.log_file.fileno())
+        self.pending_count = 0
+        self.last_commit = time.time()
+
+    def rotate(self):
+        with self.lock:
+            self.rotate_locked()
+
+    def rotate_locked(self):
+        self.commit_locked()
+        self.log_file.close()
+
+        segment_name = "{file}.{dt}".format(file=self.file_name,dt=datetime.datetime.now().strftime("%Y%m%d_%H%M%S_%f"))
+        os.rename(self.file_name,segment_name)
+        logging.info("Log rotated to {segment}".format(segment=segment_name))
+
+        if self.compression is not None:
+            # compressing on side thread so writer is not blocked by it, retention runs after it
+            with self.retention_lock:
+                self.compressing.add(segment_name)
+            compress_thread = threading.Thread(name="logCompress", target=self.compress_segment, args=(segment_name,))
+            compress_thread.daemon = True
+            compress_thread.start()
+        else:
+            self.apply_retention()
+
+        self.open()
+
+    def list_segments(self):
+        # segment names carry rotation time, sorting them by name gives oldest first
+        segments = {}
+        for segment_file_name in glob.glob(glob.escape(self.file_name) + ".*"):
+            segment_name = segment_file_name
+            for suffix in self.compression_suffix.values():
+                if segment_name.endswith(suffix):
+                    segment_name = segment_name[:-len(suffix)]
+            segments.setdefault(segment_name,[]).append(segment_file_name)
+        return [(segment_name,segments[segment_name]) for segment_name in sorted(segments)]
+
+    def apply_retention(self):
+        if self.max_segments <= 0 and self.max_total_bytes <= 0:
+            return 0
+        with self.retention_lock:
+            segments = [(segment_name,segment_files) for segment_name, segment_files in self.list_segments() if segment_name not in self.compressing]
+            segment_sizes = []
+            for segment_name, segment_files in segments:
+                segment_size = 0
+                for segment_file_name in segment_files:
+                    try:
+                        segment_size += os.path.getsize(segment_file_name)
+                    except OSError:
+                        pass
+                segment_sizes.append(segment_size)
+
+            removed_count = 0
+            total_bytes = sum(segment_sizes)
+            while len(segments) > 0 and ((self.max_segments > 0 and len(segments) > self.max_segments) or (self.max_total_bytes > 0 and total_bytes > self.max_total_bytes)):
+                segment_name, segment_files = segments.pop(0)
+                total_bytes -= segment_sizes.pop(0)
+                for segment_file_name in segment_files:
+                    try:
+                        os.remove(segment_file_name)
+                    except FileNotFoundError:
+                        pass
+                removed_count += 1
+                logging.info("Log segment {segment} removed by retention".format(segment=segment_name))
+            return removed_count
+
+    def compress_segment(self,segment_name):
+        compressed_name = segment_name + self.compression_suffix[self.compression]
+        try:
+            with open(segment_name,'rb') as src_file:
+                if self.compression == "gzip":
+                    with gzip.open(compressed_name,'wb') as dst_file:
+                        shutil.copyfileobj(src_file,dst_file)
+                else:
+                    with open(compressed_name,'wb') as dst_file:
+                        zstandard.ZstdCompressor().copy_stream(src_file,dst_file)
+            os.remove(segment_name)
+        except Exception:
+            logging.error("Cant compress log segment {segment}".format(segment=segment_name))
+            logging.error(traceback.format_exc())
+        with self.retention_lock:
+            self.compressing.discard(segment_name)
+        self.apply_retention()
+
+    def close(self):
+        with self.lock:
+            self.commit_locked()
+            self.log_file.close()
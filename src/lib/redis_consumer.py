@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+
+import time
+
+class RedisListConsumer:
+
+    def __init__(self,redis_conn,redis_list,block_timeout=30):
+        self.redis_conn = redis_conn
+        self.redis_list = redis_list
+        self.block_timeout = block_timeout
+        self.dead_letter_list = "{redis_list}:dead".format(redis_list=redis_list)
+
+    def get_queue_length(self):
+        return self.redis_conn.llen(self.redis_list)
+
+    def wait_message(self,timeout):
+        # BLPOP returns (list_name,message) or None after timeout
+        result = self.redis_conn.blpop(self.redis_list,timeout=timeout)
+        if result is None:
+            return None
+        return result[1]
+
+    def read_message(self):
+        return self.wait_message(self.block_timeout)
+
+    def read_available(self,count):
+        # take up to count messages from the head of the list in one round trip
+        redis_pipeline = self.redis_conn.pipeline(transaction=True)
+        redis_pipeline.lrange(self.redis_list,0,count-1)
+        redis_pipeline.ltrim(self.redis_list,count,-1)
+        rmsgs, _ = redis_pipeline.execute()
+        return rmsgs
+
+    def read_batch(self,batch_size,linger=0,block_timeout=None):
+        if block_timeout is None:
+            block_timeout = self.block_timeout
+        rmsg = self.wait_message(block_timeout)
+        if rmsg is None:
+            return []
+
+        rmsgs = [rmsg]
+        batch_deadline = time.time() + linger
+        while len(rmsgs) < batch_size:
+            rmsgs.extend(self.read_available(batch_size-len(rmsgs)))
+            linger_left = batch_deadline - time.time()
+            if len(rmsgs) >= batch_size or linger_left <= 0:
+                break
+            rmsg = self.wait_message(linger_left)
+            if rmsg is None:
+                break
+            rmsgs.append(rmsg)
+        return rmsgs
+
+    def ack(self,rmsgs):
+        return True
+
+    def requeue(self,rmsgs):
+        # put messages back to the head of the list keeping their original order
+        if len(rmsgs) == 0:
+            return 0
+        return self.redis_conn.lpush(self.redis_list,*reversed(rmsgs))
+
+    def dead_letter(self,rmsgs):
+        if len(rmsgs) == 0:
+            return 0
+        self.redis_conn.rpush(self.dead_letter_list,*rmsgs)
+        return len(rmsgs)
+
+class RedisReliableConsumer(RedisListConsumer):
+
+    # moves up to ARGV[1] messages from the head of KEYS[1] to the tail of KEYS[2]
+    # unpack is limited by Lua stack size, so RPUSH takes them in chunks
+    script_move_batch = """
+        local rmsgs = redis.call('LRANGE', KEYS[1], 0, tonumber(ARGV[1]) - 1)
+        if #rmsgs > 0 then
+            redis.call('LTRIM', KEYS[1], #rmsgs, -1)
+            for i = 1, #rmsgs, 1000 do
+                redis.call('RPUSH', KEYS[2], unpack(rmsgs, i, math.min(i + 999, #rmsgs)))
+            end
+        end
+        return rmsgs
+    """
+
+    # takes messages ARGV[2..] off processing list KEYS[1] and counts the attempt in hash KEYS[3]
+    # below ARGV[1] attempts (0 is no limit) they go back to the head of KEYS[2], else to dead letter list KEYS[4]
+    script_requeue = """
+        local max_attempts = tonumber(ARGV[1])
+        local requeued = 0
+        local dead = {}
+        for i = #ARGV, 2, -1 do
+            redis.call('LREM', KEYS[1], 1, ARGV[i])
+            local attempts = redis.call('HINCRBY', KEYS[3], ARGV[i], 1)
+            if max_attempts > 0 and attempts >= max_attempts then
+                redis.call('HDEL', KEYS[3], ARGV[i])
+                dead[#dead + 1] = ARGV[i]
+            else
+                redis.call('LPUSH', KEYS[2], ARGV[i])
+                requeued = requeued + 1
+            end
+        end
+        for i = #dead, 1, -1 do
+            redis.call('RPUSH', KEYS[4], dead[i])
+        end
+        return requeued
+    """
+
+    # moves everything from KEYS[1] back to the head of KEYS[2]
+    script_requeue_all = """
+        local moved = 0
+        while redis.call('RPOPLPUSH', KEYS[1], KEYS[2]) do
+            moved = moved + 1
+        end
+        return moved
+    """
+
+    def __init__(self,redis_conn,redis_list,consumer_name,block_timeout=30,max_attempts=0):
+        super().__init__(redis_conn,redis_list,block_timeout=block_timeout)
+        self.processing_list = "{redis_list}:processing:{consumer}".format(redis_list=redis_list,consumer=consumer_name)
+        # failed sends per message are shared by all consumers of the list
+        self.attempts_hash = "{redis_list}:attempts".format(redis_list=redis_list)
+        self.max_attempts = max_attempts
+        self.move_batch = self.redis_conn.register_script(self.script_move_batch)
+        self.requeue_all = self.redis_conn.register_script(self.script_requeue_all)
+        self.requeue_counted = self.redis_conn.register_script(self.script_requeue)
+
+    def get_in_flight_length(self):
+        return self.redis_conn.llen(self.processing_list)
+
+    def recover_in_flight(self):
+        # anything left on our processing list was not acked by previous run
+        return self.requeue_all(keys=[self.processing_list,self.redis_list])
+
+    def wait_message(self,timeout):
+        return self.redis_conn.blmove(self.redis_list,self.processing_list,timeout,src="LEFT",dest="RIGHT")
+
+    def read_available(self,count):
+        return self.move_batch(keys=[self.redis_list,self.processing_list],args=[count])
+
+    def ack(self,rmsgs):
+        if len(rmsgs) == 0:
+            return True
+        # one round trip for the whole batch
+        redis_pipeline = self.redis_conn.pipeline(transaction=False)
+        for rmsg in rmsgs:
+            redis_pipeline.lrem(self.processing_list,1,rmsg)
+        redis_pipeline.hdel(self.attempts_hash,*rmsgs)
+        redis_pipeline.execute()
+        return True
+
+    def requeue(self,rmsgs):
+        # returns number of messages put back, the rest went to dead letter list
+        if len(rmsgs) == 0:
+            return 0
+        return self.requeue_counted(keys=[self.processing_list,self.redis_list,self.attempts_hash,self.dead_letter_list],args=[self.max_attempts,*rmsgs])
+
+    def dead_letter(self,rmsgs):
+        # messages which can never be delivered are kept aside instead of retried
+        if len(rmsgs) == 0:
+            return 0
+        redis_pipeline = self.redis_conn.pipeline(transaction=True)
+        for rmsg in rmsgs:
+            redis_pipeline.lrem(self.processing_list,1,rmsg)
+        redis_pipeline.hdel(self.attempts_hash,*rmsgs)
+        redis_pipeline.rpush(self.dead_letter_list,*rmsgs)
+        redis_pipeline.execute()
+        return len(rmsgs)
+
+class AsyncRedisReliableConsumer:
+
+    # same queue layout as RedisReliableConsumer, for redis.asyncio clients
+    def __init__(self,redis_conn,redis_list,consumer_name,block_timeout=30,max_attempts=0):
+        self.redis_conn = redis_conn
+        self.redis_list = redis_list
+        self.block_timeout = block_timeout
+        self.processing_list = "{redis_list}:processing:{consumer}".format(redis_list=redis_list,consumer=consumer_name)
+        self.attempts_hash = "{redis_list}:attempts".format(redis_list=redis_list)
+        self.dead_letter_list = "{redis_list}:dead".format(redis_list=redis_list)
+        self.max_attempts = max_attempts
+        self.move_batch = self.redis_conn.register_script(RedisReliableConsumer.script_move_batch)
+        self.requeue_all = self.redis_conn.register_script(RedisReliableConsumer.script_requeue_all)
+        self.requeue_counted = self.redis_conn.register_script(RedisReliableConsumer.script_requeue)
+
+    async def get_queue_length(self):
+        return await self.redis_conn.llen(self.redis_list)
+
+    async def recover_in_flight(self):
+        return await self.requeue_all(keys=[self.processing_list,self.redis_list])
+
+    async def read_batch(self,batch_size,linger=0):
+        rmsg = await self.redis_conn.blmove(self.redis_list,self.processing_list,self.block_timeout,src="LEFT",dest="RIGHT")
+        if rmsg is None:
+            return []
+
+        rmsgs = [rmsg]
+        batch_deadline = time.time() + linger
+        while len(rmsgs) < batch_size:
+            rmsgs.extend(await self.move_batch(keys=[self.redis_list,self.processing_list],args=[batch_size-len(rmsgs)]))
+            linger_left = batch_deadline - time.time()
+            if len(rmsgs) >= batch_size or linger_left <= 0:
+                break
+            rmsg = await self.redis_conn.blmove(self.redis_list,self.processing_list,linger_left,src="LEFT",dest="RIGHT")
+            if rmsg is None:
+                break
+            rmsgs.append(rmsg)
+        return rmsgs
+
+    async def ack(self,rmsgs):
+        if len(rmsgs) == 0:
+            return True
+        redis_pipeline = self.redis_conn.pipeline(transaction=False)
+        for rmsg in rmsgs:
+            redis_pipeline.lrem(self.processing_list,1,rmsg)
+        redis_pipeline.hdel(self.attempts_hash,*rmsgs)
+        await redis_pipeline.execute()
+        return True
+
+    async def requeue(self,rmsgs):
+        if len(rmsgs) == 0:
+            return 0
+        return await self.requeue_counted(keys=[self.processing_list,self.redis_list,self.attempts_hash,self.dead_letter_list],args=[self.max_attempts,*rmsgs])
+
+    async def dead_letter(self,rmsgs):
+        if len(rmsgs) == 0:
+            return 0
+        redis_pipeline = self.redis_conn.pipeline(transaction=True)
+        for rmsg in rmsgs:
+            redis_pipeline.lrem(self.processing_list,1,rmsg)
+        redis_pipeline.hdel(self.attempts_hash,*rmsgs)
+        redis_pipeline.rpush(self.dead_letter_list,*rmsgs)
+        await redis_pipeline.execute()
+        return len(rmsgs)
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+
+import sqlite3
+import threading
+import time
+import logging
+import traceback
+
+def redis_push_messages_list(redis_pipeline,redis_list,msgs):
+    return redis_pipeline.lpush(redis_list,*msgs)
+
+def redis_write_messages(msgs,redis_conn,redis_lists,push_messages=redis_push_messages_list):
+    return redis_write_messages_by_list(redis_conn,{r_list: msgs for r_list in redis_lists},push_messages=push_messages)
+
+def redis_write_messages_by_list(redis_conn,msgs_by_list,push_messages=redis_push_messages_list):
+    # one round trip for all lists, each list gets a single multi-value LPUSH (or one XADD per message for stream),
+    # raises when Redis is not reachable, command errors are returned as status of their list
+    redis_pipeline = redis_conn.pipeline(transaction=False)
+    redis_commands = []
+    for r_list, msgs in msgs_by_list.items():
+        commands_before = len(redis_pipeline)
+        push_messages(redis_pipeline,r_list,msgs)
+        redis_commands.append((r_list,commands_before,len(redis_pipeline)))
+    redis_results = redis_pipeline.execute(raise_on_error=False)
+
+    redis_status = {}
+    for r_list, commands_start, commands_end in redis_commands:
+        r_errors = [r for r in redis_results[commands_start:commands_end] if isinstance(r,Exception)]
+        redis_status[r_list] = r_errors[0] if len(r_errors) > 0 else redis_results[commands_start:commands_end]
+    return redis_status
+
+class RedisOutageBuffer:
+
+    # messages which could not reach Redis wait here (SQLite in WAL mode) until replay succeeds
+    def __init__(self,db_file,redis_conn,replay_batch_size=500,replay_interval=5,push_messages=None):
+        self.redis_conn = redis_conn
+        # push_messages(redis_pipeline,target,msgs) queues write of msgs to target, LPUSH to list by default
+        self.push_messages = push_messages or redis_push_messages_list
+        self.replay_batch_size = replay_batch_size
+        self.replay_interval = replay_interval
+        self.lock = threading.Lock()
+        self.replay_stop = threading.Event()
+        self.replay_thread = None
+        self.stored_total = 0
+        self.replayed_total = 0
+
+        self.db_conn = sqlite3.connect(db_file,check_same_thread=False)
+        self.db_conn.execute("PRAGMA journal_mode=WAL")
+        self.db_conn.execute("PRAGMA synchronous=NORMAL")
+        self.db_conn.execute("CREATE TABLE IF NOT EXISTS pending_messages (id INTEGER PRIMARY KEY AUTOINCREMENT, redis_list TEXT NOT NULL, msg BLOB NOT NULL)")
+        self.db_conn.commit()
+
+    def store(self,redis_list,msgs):
+        with self.lock:
+            self.db_conn.executemany("INSERT INTO pending_messages (redis_list,msg) VALUES (?,?)",[(redis_list,msg) for msg in msgs])
+            self.db_conn.commit()
+            self.stored_total += len(msgs)
+
+    def write(self,redis_lists,msgs):
+        # write path of uart reader, lists which fail get the messages stored here, failed lists are returned
+        redis_failed_lists = []
+        try:
+            redis_writing_status = redis_write_messages(msgs,self.redis_conn,redis_lists,push_messages=self.push_messages)
+            for r_list, r_status in redis_writing_status.items():
+                if isinstance(r_status,Exception):
+                    logging.error("Problem with writing {count} messages to redis list {r_list}: {err}".format(count=len(msgs),r_list=r_list,err=r_status))
+                    redis_failed_lists.append(r_list)
+        except Exception:
+            logging.error("Redis not available: {err}".format(err=traceback.format_exc()))
+            redis_failed_lists = list(redis_lists)
+
+        for r_list in redis_failed_lists:
+            self.store(r_list,msgs)
+        return redis_failed_lists
+
+    def get_pending_count(self):
+        with self.lock:
+            return self.db_conn.execute("SELECT COUNT(*) FROM pending_messages").fetchone()[0]
+
+    def replay_once(self):
+        with self.lock:
+            rows = self.db_conn.execute("SELECT id,redis_list,msg FROM pending_messages ORDER BY id LIMIT ?",(self.replay_batch_size,)).fetchall()
+        if len(rows) == 0:
+            return 0
+
+        msgs_by_list = {}
+        row_ids_by_list = {}
+        for row_id, redis_list, msg in rows:
+            msgs_by_list.setdefault(redis_list,[]).append(msg)
+            row_ids_by_list.setdefault(redis_list,[]).append(row_id)
+
+        # same pipeline as the writer, only rows of lists which got their messages are deleted
+        replayed_row_ids = []
+        redis_writing_status = redis_write_messages_by_list(self.redis_conn,msgs_by_list,push_messages=self.push_messages)
+        for redis_list, r_status in redis_writing_status.items():
+            if isinstance(r_status,Exception):
+                logging.error("Replay to redis list {r_list} failed: {err}".format(r_list=redis_list,err=r_status))
+                continue
+            replayed_row_ids.extend(row_ids_by_list[redis_list])
+
+        with self.lock:
+            self.db_conn.executemany("DELETE FROM pending_messages WHERE id = ?",[(row_id,) for row_id in replayed_row_ids])
+            self.db_conn.commit()
+            self.replayed_total += len(replayed_row_ids)
+        return len(replayed_row_ids)
+
+    def replay_loop(self):
+        while not self.replay_stop.wait(self.replay_interval):
+            try:
+                replayed_count = self.replay_once()
+                while replayed_count > 0:
+                    logging.info("Replayed {count} buffered messages to Redis".format(count=replayed_count))
+                    replayed_count = self.replay_once()
+            except Exception:
+                logging.warning("Redis still not available, {count} messages buffered".format(count=self.get_pending_count()))
+                logging.debug(traceback.format_exc())
+
+    def start_replay_thread(self):
+        self.replay_thread = threading.Thread(name="redisReplay", target=self.replay_loop)
+        self.replay_thread.daemon = True
+        self.replay_thread.start()
+        return self.replay_thread
+
+    def get_stats(self):
+        return {
+            "pending": self.get_pending_count(),
+            "stored_total": self.stored_total,
+            "replayed_total": self.replayed_total
+        }
+
+    def close(self):
+        self.replay_stop.set()
+        if self.replay_thread is not None:
+            self.replay_thread.join()
+        with self.lock:
+            self.db_conn.close()
@@ -0,0 +1,298 @@
+#!/usr/bin/env python3
+
+import time
+import collections
+import redis
+
+# every message is one stream entry with a single field
+stream_field = b"m"
+# XAUTOCLAIM used for entries of crashed consumers came with Redis 6.2
+required_redis_version = (6,2)
+
+def check_redis_version(server_info):
+    redis_version = tuple(int(part) for part in str(server_info["redis_version"]).split(".")[:2])
+    if redis_version < required_redis_version:
+        raise RuntimeError("Stream transport needs Redis {required}+, server is {version}".format(required=".".join(str(part) for part in required_redis_version),version=server_info["redis_version"]))
+    return redis_version
+
+def get_group_queue_length(groups_info,group_name,stream_length):
+    for group_info in groups_info:
+        if group_info["name"] in (group_name,group_name.encode()):
+            # lag is reported by Redis 7+, without it stream length is the upper bound
+            if group_info.get("lag") is not None:
+                return group_info["lag"]
+            return stream_length
+    return 0
+
+def redis_stream_add_messages(redis_pipeline,redis_stream,msgs,maxlen=None):
+    for msg in msgs:
+        redis_pipeline.xadd(redis_stream,{stream_field: msg},maxlen=maxlen,approximate=True)
+    return redis_pipeline
+
+def redis_write_messages_stream(msgs,redis_conn,redis_stream,maxlen=None):
+    # one XADD per message but one round trip for the whole batch
+    redis_pipeline = redis_conn.pipeline(transaction=False)
+    redis_stream_add_messages(redis_pipeline,redis_stream,msgs,maxlen=maxlen)
+    return redis_pipeline.execute()
+
+def get_stream_entries(xread_result):
+    # entries trimmed away while pending come back without fields, they are returned as None
+    entries = []
+    for stream_name, stream_entries in xread_result or []:
+        for entry_id, entry_fields in stream_entries:
+            entries.append((entry_id,(entry_fields or {}).get(stream_field)))
+    return entries
+
+class RedisStreamConsumer:
+
+    # consumer group reader with the same interface as RedisReliableConsumer
+    def __init__(self,redis_conn,redis_stream,group_name,consumer_name,block_timeout=30,claim_min_idle=300,max_attempts=0):
+        self.redis_conn = redis_conn
+        self.redis_stream = redis_stream
+        self.group_name = group_name
+        self.consumer_name = consumer_name
+        self.block_timeout = block_timeout
+        self.claim_min_idle = claim_min_idle
+        self.dead_letter_list = "{redis_stream}:{group}:dead".format(redis_stream=redis_stream,group=group_name)
+        self.max_attempts = max_attempts
+        # failed sends per stream entry id
+        self.attempts = {}
+        # stream entry id -> raw message, for messages handed out and not acked yet
+        self.in_flight = {}
+        # raw message -> its entry ids in delivery order, same bytes can come in more entries
+        self.entry_ids = {}
+        self.redeliver = []
+        self.create_group()
+
+    def create_group(self):
+        check_redis_version(self.redis_conn.info("server"))
+        try:
+            self.redis_conn.xgroup_create(self.redis_stream,self.group_name,id="0",mkstream=True)
+        except redis.exceptions.ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+
+    def get_queue_length(self):
+        # entries not delivered to the group yet, pending ones are counted by get_in_flight_length
+        return get_group_queue_length(self.redis_conn.xinfo_groups(self.redis_stream),self.group_name,self.redis_conn.xlen(self.redis_stream))
+
+    def get_in_flight_length(self):
+        # requeued entries stay in flight until they are acked
+        return len(self.in_flight)
+
+    def add_entries(self,entries):
+        # returns raw messages to hand out and ids of entries trimmed away while pending
+        rmsgs = []
+        rmsg_trimmed = []
+        for entry_id, rmsg in entries:
+            if rmsg is None:
+                rmsg_trimmed.append(entry_id)
+                continue
+            if entry_id in self.in_flight:
+                continue
+            self.in_flight[entry_id] = rmsg
+            self.entry_ids.setdefault(rmsg,collections.deque()).append(entry_id)
+            rmsgs.append(rmsg)
+        return rmsgs, rmsg_trimmed
+
+    def track_entries(self,entries):
+        rmsgs, rmsg_trimmed = self.add_entries(entries)
+        if len(rmsg_trimmed) > 0:
+            self.redis_conn.xack(self.redis_stream,self.group_name,*rmsg_trimmed)
+        return rmsgs
+
+    def recover_in_flight(self):
+        # own pending entries from previous run
+        entries = get_stream_entries(self.redis_conn.xreadgroup(self.group_name,self.consumer_name,{self.redis_stream: "0"}))
+        # entries of crashed consumers idle for too long
+        claim_start = "0-0"
+        while True:
+            claim_result = self.redis_conn.xautoclaim(self.redis_stream,self.group_name,self.consumer_name,self.claim_min_idle*1000,start_id=claim_start,count=1000)
+            claim_start = claim_result[0]
+            entries.extend(get_stream_entries([[self.redis_stream,claim_result[1]]]))
+            if claim_start in (b"0-0","0-0"):
+                break
+        self.redeliver.extend(self.track_entries(entries))
+        return len(self.redeliver)
+
+    def read_entries(self,count,block_ms):
+        xread_result = self.redis_conn.xreadgroup(self.group_name,self.consumer_name,{self.redis_stream: ">"},count=count,block=max(1,block_ms))
+        return self.track_entries(get_stream_entries(xread_result))
+
+    def read_batch(self,batch_size,linger=0,block_timeout=None):
+        if len(self.redeliver) > 0:
+            rmsgs = self.redeliver[:batch_size]
+            del self.redeliver[:batch_size]
+            return rmsgs
+
+        if block_timeout is None:
+            block_timeout = self.block_timeout
+        rmsgs = self.read_entries(batch_size,int(block_timeout*1000))
+
+        batch_deadline = time.time() + linger
+        while 0 < len(rmsgs) < batch_size:
+            linger_left = batch_deadline - time.time()
+            if linger_left <= 0:
+                break
+            rmsgs_more = self.read_entries(batch_size-len(rmsgs),int(linger_left*1000))
+            if len(rmsgs_more) == 0:
+                break
+            rmsgs.extend(rmsgs_more)
+        return rmsgs
+
+    def pop_entry_ids(self,rmsgs):
+        # oldest entry with the same bytes is done first, like LREM on the processing list
+        entry_ids = []
+        for rmsg in rmsgs:
+            rmsg_entry_ids = self.entry_ids.get(rmsg)
+            if not rmsg_entry_ids:
+                continue
+            entry_id = rmsg_entry_ids.popleft()
+            if len(rmsg_entry_ids) == 0:
+                del self.entry_ids[rmsg]
+            del self.in_flight[entry_id]
+            self.attempts.pop(entry_id,None)
+            entry_ids.append(entry_id)
+        return entry_ids
+
+    def count_attempts(self,rmsgs):
+        # splits failed messages to ones retried and ones over max_attempts
+        rmsg_retried = []
+        rmsg_dead = []
+        rmsg_seen = collections.Counter()
+        for rmsg in rmsgs:
+            rmsg_entry_ids = self.entry_ids.get(rmsg)
+            if not rmsg_entry_ids or rmsg_seen[rmsg] >= len(rmsg_entry_ids):
+                rmsg_retried.append(rmsg)
+                continue
+            entry_id = rmsg_entry_ids[rmsg_seen[rmsg]]
+            rmsg_seen[rmsg] += 1
+            self.attempts[entry_id] = self.attempts.get(entry_id,0) + 1
+            if self.max_attempts > 0 and self.attempts[entry_id] >= self.max_attempts:
+                rmsg_dead.append(rmsg)
+            else:
+                rmsg_retried.append(rmsg)
+        return rmsg_retried, rmsg_dead
+
+    def ack(self,rmsgs):
+        entry_ids = self.pop_entry_ids(rmsgs)
+        if len(entry_ids) > 0:
+            self.redis_conn.xack(self.redis_stream,self.group_name,*entry_ids)
+        return True
+
+    def requeue(self,rmsgs):
+        # entries stay pending in Redis, they are handed out again before new ones
+        rmsg_retried, rmsg_dead = self.count_attempts(rmsgs)
+        self.dead_letter(rmsg_dead)
+        self.redeliver.extend(rmsg_retried)
+        return len(rmsg_retried)
+
+    def dead_letter(self,rmsgs):
+        # copied to a list and acked, so the group does not deliver them again
+        if len(rmsgs) == 0:
+            return 0
+        entry_ids = self.pop_entry_ids(rmsgs)
+        redis_pipeline = self.redis_conn.pipeline(transaction=True)
+        redis_pipeline.rpush(self.dead_letter_list,*rmsgs)
+        if len(entry_ids) > 0:
+            redis_pipeline.xack(self.redis_stream,self.group_name,*entry_ids)
+        redis_pipeline.execute()
+        return len(rmsgs)
+
+class AsyncRedisStreamConsumer:
+
+    # RedisStreamConsumer for redis.asyncio clients
+    def __init__(self,redis_conn,redis_stream,group_name,consumer_name,block_timeout=30,claim_min_idle=300,max_attempts=0):
+        self.redis_conn = redis_conn
+        self.redis_stream = redis_stream
+        self.group_name = group_name
+        self.consumer_name = consumer_name
+        self.block_timeout = block_timeout
+        self.claim_min_idle = claim_min_idle
+        self.dead_letter_list = "{redis_stream}:{group}:dead".format(redis_stream=redis_stream,group=group_name)
+        self.max_attempts = max_attempts
+        # failed sends per stream entry id
+        self.attempts = {}
+        self.in_flight = {}
+        self.entry_ids = {}
+        self.redeliver = []
+
+    async def create_group(self):
+        check_redis_version(await self.redis_conn.info("server"))
+        try:
+            await self.redis_conn.xgroup_create(self.redis_stream,self.group_name,id="0",mkstream=True)
+        except redis.exceptions.ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+
+    async def get_queue_length(self):
+        return get_group_queue_length(await self.redis_conn.xinfo_groups(self.redis_stream),self.group_name,await self.redis_conn.xlen(self.redis_stream))
+
+    add_entries = RedisStreamConsumer.add_entries
+
+    async def track_entries(self,entries):
+        rmsgs, rmsg_trimmed = self.add_entries(entries)
+        if len(rmsg_trimmed) > 0:
+            await self.redis_conn.xack(self.redis_stream,self.group_name,*rmsg_trimmed)
+        return rmsgs
+
+    async def recover_in_flight(self):
+        await self.create_group()
+        entries = get_stream_entries(await self.redis_conn.xreadgroup(self.group_name,self.consumer_name,{self.redis_stream: "0"}))
+        claim_start = "0-0"
+        while True:
+            claim_result = await self.redis_conn.xautoclaim(self.redis_stream,self.group_name,self.consumer_name,self.claim_min_idle*1000,start_id=claim_start,count=1000)
+            claim_start = claim_result[0]
+            entries.extend(get_stream_entries([[self.redis_stream,claim_result[1]]]))
+            if claim_start in (b"0-0","0-0"):
+                break
+        self.redeliver.extend(await self.track_entries(entries))
+        return len(self.redeliver)
+
+    async def read_entries(self,count,block_ms):
+        xread_result = await self.redis_conn.xreadgroup(self.group_name,self.consumer_name,{self.redis_stream: ">"},count=count,block=max(1,block_ms))
+        return await self.track_entries(get_stream_entries(xread_result))
+
+    async def read_batch(self,batch_size,linger=0):
+        if len(self.redeliver) > 0:
+            rmsgs = self.redeliver[:batch_size]
+            del self.redeliver[:batch_size]
+            return rmsgs
+
+        rmsgs = await self.read_entries(batch_size,int(self.block_timeout*1000))
+        batch_deadline = time.time() + linger
+        while 0 < len(rmsgs) < batch_size:
+            linger_left = batch_deadline - time.time()
+            if linger_left <= 0:
+                break
+            rmsgs_more = await self.read_entries(batch_size-len(rmsgs),int(linger_left*1000))
+            if len(rmsgs_more) == 0:
+                break
+            rmsgs.extend(rmsgs_more)
+        return rmsgs
+
+    pop_entry_ids = RedisStreamConsumer.pop_entry_ids
+    count_attempts = RedisStreamConsumer.count_attempts
+
+    async def ack(self,rmsgs):
+        entry_ids = self.pop_entry_ids(rmsgs)
+        if len(entry_ids) > 0:
+            await self.redis_conn.xack(self.redis_stream,self.group_name,*entry_ids)
+        return True
+
+    async def requeue(self,rmsgs):
+        rmsg_retried, rmsg_dead = self.count_attempts(rmsgs)
+        await self.dead_letter(rmsg_dead)
+        self.redeliver.extend(rmsg_retried)
+        return len(rmsg_retried)
+
+    async def dead_letter(self,rmsgs):
+        if len(rmsgs) == 0:
+            return 0
+        entry_ids = self.pop_entry_ids(rmsgs)
+        redis_pipeline = self.redis_conn.pipeline(transaction=True)
+        redis_pipeline.rpush(self.dead_letter_list,*rmsgs)
+        if len(entry_ids) > 0:
+            redis_pipeline.xack(self.redis_stream,self.group_name,*entry_ids)
+        await redis_pipeline.execute()
+        return len(rmsgs)
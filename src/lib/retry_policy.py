@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+
+import time
+import random
+import logging
+
+# client errors are not fixed by sending the same request again, except timeout and rate limit
+retryable_client_codes = frozenset([408,429])
+
+def is_permanent_status(status_code):
+    return status_code is not None and 400 <= status_code < 500 and status_code not in retryable_client_codes
+
+def is_permanent_error(error):
+    # records which can not be serialized, or API errors with permanent status like google.api_core InvalidArgument
+    if isinstance(error,(TypeError,ValueError)):
+        return True
+    status_code = getattr(error,"code",None)
+    return isinstance(status_code,int) and is_permanent_status(status_code)
+
+class RetryPolicy:
+
+    # capped exponential backoff with jitter, any success resets it
+    def __init__(self,base_delay=1.0,max_delay=300.0,multiplier=2.0,jitter=0.5,rand=random.random):
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.multiplier = multiplier
+        self.jitter = jitter
+        self.rand = rand
+        self.failures = 0
+
+    def get_delay(self):
+        if self.failures == 0:
+            return 0
+        delay = min(self.max_delay,self.base_delay * self.multiplier ** (self.failures - 1))
+        # jitter takes up to jitter*delay off, so exporters do not retry in lockstep
+        return delay * (1 - self.jitter * self.rand())
+
+    def record_success(self):
+        self.failures = 0
+
+    def record_failure(self):
+        self.failures += 1
+        return self.get_delay()
+
+class CircuitBreaker:
+
+    STATE_CLOSED = "closed"
+    STATE_OPEN = "open"
+    STATE_HALF_OPEN = "half_open"
+
+    def __init__(self,failure_threshold=5,reset_timeout=30.0,max_reset_timeout=900.0,clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.base_reset_timeout = reset_timeout
+        self.max_reset_timeout = max_reset_timeout
+        self.clock = clock
+
+        self.state = self.STATE_CLOSED
+        self.failures = 0
+        self.reset_timeout = reset_timeout
+        self.opened_at = None
+
+    def get_state(self):
+        return self.state
+
+    def allow_request(self):
+        if self.state == self.STATE_OPEN:
+            if self.clock() - self.opened_at < self.reset_timeout:
+                return False
+            # next result decides if circuit closes or opens again
+            self.state = self.STATE_HALF_OPEN
+            logging.info("Circuit half open, probing")
+        return True
+
+    def get_wait_time(self):
+        if self.state != self.STATE_OPEN:
+            return 0
+        return max(0,self.reset_timeout - (self.clock() - self.opened_at))
+
+    def record_success(self):
+        if self.state != self.STATE_CLOSED:
+            logging.info("Circuit closed")
+        self.state = self.STATE_CLOSED
+        self.failures = 0
+        self.reset_timeout = self.base_reset_timeout
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == self.STATE_HALF_OPEN:
+            # probe failed, stay open longer next time
+            self.reset_timeout = min(self.max_reset_timeout,self.reset_timeout * 2)
+            self.open()
+        elif self.state == self.STATE_CLOSED and self.failures >= self.failure_threshold:
+            self.open()
+
+    def open(self):
+        self.state = self.STATE_OPEN
+        self.opened_at = self.clock()
+        logging.warning("Circuit open after {count} failures, next probe in {timeout:.0f}s".format(count=self.failures,timeout=self.reset_timeout))
@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+
+class SerialLineReader:
+
+    def __init__(self,serial_port,max_line_length=1024):
+        self.serial_port = serial_port
+        self.max_line_length = max_line_length
+        self.buffer = bytearray()
+        self.dropped_bytes = 0
+        # after overflow the rest of the line is garbage too, it is skipped up to next newline
+        self.discarding = False
+
+    def read_chunk(self):
+        # blocks until at least one byte arrives or port timeout passes, then takes whatever is waiting
+        return self.serial_port.read(max(1,self.serial_port.in_waiting))
+
+    def split_lines(self,chunk):
+        self.buffer += chunk
+        if self.discarding:
+            newline_index = self.buffer.find(b"\n")
+            if newline_index < 0:
+                self.dropped_bytes += len(self.buffer)
+                self.buffer = bytearray()
+                return []
+            self.dropped_bytes += newline_index
+            del self.buffer[:newline_index+1]
+            self.discarding = False
+            chunk = self.buffer
+
+        if b"\n" not in chunk:
+            self.drop_overflow()
+            return []
+
+        lines = self.buffer.split(b"\n")
+        # last element is an incomplete line (or empty), kept for the next read
+        self.buffer = bytearray(lines.pop())
+        self.drop_overflow()
+        return [bytes(line.rstrip(b"\r")) for line in lines if len(line) > 0]
+
+    def drop_overflow(self):
+        # garbage on the line without newline must not grow the buffer forever
+        if len(self.buffer) > self.max_line_length:
+            self.dropped_bytes += len(self.buffer)
+            self.buffer = bytearray()
+            self.discarding = True
+
+    def read_lines(self):
+        chunk = self.read_chunk()
+        if not chunk:
+            return []
+        return self.split_lines(chunk)
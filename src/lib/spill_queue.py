@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+
+import os
+import glob
+import threading
+import collections
+import time
+import queue
+
+class SpillQueue:
+
+    # queue.Queue look-alike: keeps up to high_water_mark items in memory, the rest goes to segment files
+    def __init__(self,spill_file,encode,decode,high_water_mark=10000,segment_max_bytes=64*1024*1024):
+        self.spill_file_name = spill_file
+        self.encode = encode
+        self.decode = decode
+        self.high_water_mark = high_water_mark
+        self.refill_size = max(1,high_water_mark // 2)
+        self.segment_max_bytes = segment_max_bytes
+
+        # items with their (segment, offset after line) position, None for items which were never spilled
+        self.memory_items = collections.deque()
+        # positions of items handed out to writer and not done yet, writer stores them in order
+        self.handed_out = collections.deque()
+        self.lock = threading.Lock()
+        self.not_empty = threading.Condition(self.lock)
+        self.all_tasks_done = threading.Condition(self.lock)
+        self.unfinished_tasks = 0
+
+        self.spilled_total = 0
+        self.spilled_bytes_total = 0
+        self.replayed_total = 0
+        self.decode_errors = 0
+
+        self.spill_offset_file_name = self.spill_file_name + ".offset"
+        self.segments = self.list_segments()
+        if len(self.segments) == 0 and os.path.isfile(self.spill_file_name):
+            # single spill file of older versions becomes first segment
+            os.replace(self.spill_file_name,self.get_segment_file_name(0))
+            self.segments = [0]
+        self.commit_position = self.load_spill_read_offset()
+        self.uncommitted_count = 0
+        if len(self.segments) == 0:
+            self.segments = [self.commit_position[0]]
+        # segments stored completely by previous run
+        self.remove_segments_before(self.commit_position[0])
+
+        self.read_position = self.commit_position
+        self.read_file = None
+        self.spill_file = open(self.get_segment_file_name(self.segments[-1]),'ab')
+        self.spill_pending = self.count_spilled_lines()
+        self.unfinished_tasks = self.spill_pending
+
+    def get_segment_file_name(self,segment):
+        return "{spill_file}.{segment:08d}".format(spill_file=self.spill_file_name,segment=segment)
+
+    def list_segments(self):
+        segments = []
+        for segment_file_name in glob.glob(glob.escape(self.spill_file_name) + ".*"):
+            suffix = segment_file_name[len(self.spill_file_name)+1:]
+            if suffix.isdigit():
+                segments.append(int(suffix))
+        return sorted(segments)
+
+    def remove_segments_before(self,segment):
+        for old_segment in [old_segment for old_segment in self.segments if old_segment < segment]:
+            try:
+                os.remove(self.get_segment_file_name(old_segment))
+            except FileNotFoundError:
+                pass
+            self.segments.remove(old_segment)
+
+    def load_spill_read_offset(self):
+        # lines before saved segment and offset were stored by writer of previous run
+        try:
+            with open(self.spill_offset_file_name,'r') as offset_file:
+                offset_values = [int(value) for value in offset_file.read().split()]
+            if len(offset_values) == 1:
+                # offset of single spill file
+                offset_values = [0] + offset_values
+            spill_segment, spill_read_offset = offset_values
+        except (OSError,ValueError):
+            return (self.segments[0] if len(self.segments) > 0 else 0,0)
+        if spill_segment in self.segments and 0 <= spill_read_offset <= os.path.getsize(self.get_segment_file_name(spill_segment)):
+            return (spill_segment,spill_read_offset)
+        if len(self.segments) > 0:
+            return (self.segments[0],0)
+        return (max(0,spill_segment),0)
+
+    def save_spill_read_offset(self):
+        # written to temp file and renamed, crash leaves old or new offset, never a partial one
+        offset_tmp_file_name = self.spill_offset_file_name + ".tmp"
+        with open(offset_tmp_file_name,'w') as offset_file:
+            offset_file.write("{segment} {offset}".format(segment=self.commit_position[0],offset=self.commit_position[1]))
+            offset_file.flush()
+            os.fsync(offset_file.fileno())
+        os.replace(offset_tmp_file_name,self.spill_offset_file_name)
+
+    def count_spilled_lines(self):
+        # messages left on disk by previous run are replayed first
+        spilled_lines = 0
+        for segment in self.segments:
+            with open(self.get_segment_file_name(segment),'rb') as segment_file:
+                if segment == self.read_position[0]:
+                    segment_file.seek(self.read_position[1])
+                spilled_lines += sum(1 for _ in segment_file)
+        return spilled_lines
+
+    def start_segment(self):
+        self.spill_file.close()
+        self.segments.append(self.segments[-1] + 1)
+        self.spill_file = open(self.get_segment_file_name(self.segments[-1]),'ab')
+
+    def put(self,item,block=True,timeout=None):
+        with self.lock:
+            # once spilling started everything goes to disk to keep order
+            if self.spill_pending > 0 or len(self.memory_items) >= self.high_water_mark:
+                item_bytes = self.encode(item)
+                self.spill_file.write(item_bytes + b"\n")
+                self.spill_file.flush()
+                self.spill_pending += 1
+                self.spilled_total += 1
+                self.spilled_bytes_total += len(item_bytes) + 1
+                if self.spill_file.tell() >= self.segment_max_bytes:
+                    self.start_segment()
+            else:
+                self.memory_items.append((item,None))
+            self.unfinished_tasks += 1
+            self.not_empty.notify()
+
+    def put_nowait(self,item):
+        return self.put(item,block=False)
+
+    def refill_from_spill(self):
+        while len(self.memory_items) < self.refill_size and self.spill_pending > 0:
+            read_segment = self.read_position[0]
+            if self.read_file is None:
+                self.read_file = open(self.get_segment_file_name(read_segment),'rb')
+                self.read_file.seek(self.read_position[1])
+            line = self.read_file.readline()
+            if not line:
+                # segment read to the end, writer already moved to the next one
+                self.read_file.close()
+                self.read_file = None
+                self.read_position = (self.segments[self.segments.index(read_segment)+1],0)
+                continue
+            self.read_position = (read_segment,self.read_file.tell())
+            self.spill_pending -= 1
+            self.replayed_total += 1
+            try:
+                self.memory_items.append((self.decode(line.rstrip(b"\n")),self.read_position))
+            except Exception:
+                # broken line can not be processed, it is not coming back
+                self.decode_errors += 1
+                self.unfinished_tasks -= 1
+
+        if self.unfinished_tasks == 0:
+            self.all_tasks_done.notify_all()
+
+    def get(self,block=True,timeout=None):
+        with self.not_empty:
+            if timeout is not None:
+                deadline = time.time() + timeout
+            while len(self.memory_items) == 0:
+                if self.spill_pending > 0:
+                    self.refill_from_spill()
+                    continue
+                if not block:
+                    raise queue.Empty
+                if timeout is None:
+                    self.not_empty.wait()
+                else:
+                    time_left = deadline - time.time()
+                    if time_left <= 0:
+                        raise queue.Empty
+                    self.not_empty.wait(time_left)
+            item, spill_position = self.memory_items.popleft()
+            self.handed_out.append(spill_position)
+            return item
+
+    def get_nowait(self):
+        return self.get(block=False)
+
+    def task_done(self):
+        with self.all_tasks_done:
+            self.unfinished_tasks -= 1
+            if len(self.handed_out) > 0:
+                spill_position = self.handed_out.popleft()
+                if spill_position is not None:
+                    # item is stored by writer, restart does not need to replay it anymore
+                    segment_changed = spill_position[0] != self.commit_position[0]
+                    self.commit_position = spill_position
+                    self.uncommitted_count += 1
+                    spill_drained = self.spill_pending == 0 and self.commit_position == self.read_position
+                    if segment_changed or spill_drained or self.uncommitted_count >= self.refill_size:
+                        self.save_commit_position()
+            if self.unfinished_tasks <= 0:
+                self.all_tasks_done.notify_all()
+
+    def save_commit_position(self):
+        # called with lock held, offset file is written at most once per refill
+        if self.spill_pending == 0 and self.commit_position == self.read_position:
+            # everything spilled is stored, start over with new empty segment
+            if self.read_file is not None:
+                self.read_file.close()
+                self.read_file = None
+            self.start_segment()
+            self.commit_position = (self.segments[-1],0)
+            self.read_position = self.commit_position
+        self.save_spill_read_offset()
+        self.uncommitted_count = 0
+        self.remove_segments_before(self.commit_position[0])
+
+    def commit(self):
+        # writers which store in bulk can save the offset right after their batch
+        with self.lock:
+            if self.uncommitted_count > 0:
+                self.save_commit_position()
+
+    def join(self):
+        with self.all_tasks_done:
+            while self.unfinished_tasks > 0:
+                self.all_tasks_done.wait()
+
+    def qsize(self):
+        with self.lock:
+            return len(self.memory_items) + self.spill_pending
+
+    def empty(self):
+        return self.qsize() == 0
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                "memory_depth": len(self.memory_items),
+                "spill_depth": self.spill_pending,
+                "spill_segments": len(self.segments),
+                "spilled_total": self.spilled_total,
+                "spilled_bytes_total": self.spilled_bytes_total,
+                "replayed_total": self.replayed_total,
+                "decode_errors": self.decode_errors
+            }
+
+    def close(self):
+        with self.lock:
+            if self.uncommitted_count > 0:
+                self.save_commit_position()
+            if self.read_file is not None:
+                self.read_file.close()
+            self.spill_file.close()
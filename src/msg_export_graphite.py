@@ -8,12 +8,18 @@ import redis
 import logging
 import traceback
 import json
-import requests
+import socket
 
 sys.path.append(os.path.abspath(os.path.dirname(__file__))+"/lib")
 
 # import message_object
 from message_object import MessageObject
+from redis_consumer import RedisReliableConsumer
+from redis_stream_transport import RedisStreamConsumer
+from retry_policy import RetryPolicy, CircuitBreaker, is_permanent_status
+from export_sinks import get_graphite_metrics, graphite_http_client_open
+from message_aggregator import MessageAggregator
+from message_batch import decode_messages
 
 ## functions
 def redis_connection_open(host,port,database):
@@ -27,45 +33,73 @@ def redis_connection_close(redis):
 def redis_write_message(msg,redis_conn,redis_list):
     return redis_conn.lpush(redis_list, msg)
 
-def get_metric_object(metric,value,timestamp,interval=60):
-    metric_object = dict()
-    metric_object['name'] = metric
-    metric_object['metric'] = metric
-    metric_object['value'] = value
-    metric_object['interval'] = interval
-    # metric_object['unit'] = Null
-    metric_object['time'] = int(timestamp)
-    metric_object['mtype'] = "count"
-    # graphite_data['tags'] = []
-    return metric_object
-
-def graphite_write_metrics(msg_obj,configuration):
-
-    headers = {
-        "Authorization": "Bearer {user}:{password}".format(user=configuration['user'],password=configuration['password'])
-    }
-
-    metric_key = "{prefix}.{device}.{metric_name}".format(device=msg_obj.get_device_id(),metric_name=msg_obj.get_measure_name(),prefix=configuration['prefix'])
-    metric_key_cycle = "{prefix}.{device}.cycle_number".format(device=msg_obj.get_device_id(),prefix=configuration['prefix'])
-    logging.debug("Metric: {metric_key}:{value}".format(metric_key=metric_key,value=msg_obj.get_measure_value()))
-
-    graphite_measure_data = get_metric_object(metric_key,msg_obj.get_measure_value(),msg_obj.get_timestamp())
-    graphite_cycle_number = get_metric_object(metric_key_cycle,msg_obj.get_cycle_number(),msg_obj.get_timestamp())
-
-    result = requests.post(configuration['url'], json=[graphite_measure_data,graphite_cycle_number], headers=headers)
+def ack_messages(rmsgs,redis_consumer,message_aggregator):
+    # aggregated windows are not in Redis, raw messages were acked when folded
+    if message_aggregator is not None:
+        return True
+    return redis_consumer.ack(rmsgs)
+
+def requeue_messages(rmsgs,redis_consumer,message_aggregator):
+    if message_aggregator is not None:
+        return message_aggregator.requeue(rmsgs)
+    return redis_consumer.requeue(rmsgs)
+
+def dead_letter_messages(rmsgs,redis_consumer,message_aggregator):
+    # messages graphite will never accept are not retried
+    if message_aggregator is not None:
+        logging.error("Dropping {count} aggregated windows graphite will not accept".format(count=len(rmsgs)))
+        return 0
+    return redis_consumer.dead_letter(rmsgs)
+
+def get_graphite_batch_metrics(msg_objs,configuration):
+    # metrics of each message, None for messages which can not be turned into metrics
+    graphite_metrics = []
+    for msg_obj in msg_objs:
+        try:
+            graphite_metrics.append(get_graphite_metrics(msg_obj,configuration))
+        except (TypeError,ValueError):
+            logging.error("Cant serialize {name} message from device {device} for graphite".format(name=msg_obj.get_measure_name(),device=msg_obj.get_device_id()))
+            graphite_metrics.append(None)
+    return graphite_metrics
+
+def graphite_write_data(graphite_data,http_client):
+    result = http_client.post_json(graphite_data)
     if result.status_code != 200:
         logging.error("Error while exporting data to graphite: {}".format(result.text))
-    return result.ok
+    return result
+
+def graphite_write_metrics_batch(msg_objs,configuration,http_client):
+    graphite_data = []
+    for msg_obj in msg_objs:
+        graphite_data.extend(get_graphite_metrics(msg_obj,configuration))
+    return graphite_write_data(graphite_data,http_client).ok
+
+def graphite_write_metrics(msg_obj,configuration,http_client):
+    return graphite_write_metrics_batch([msg_obj],configuration,http_client)
 
 ## local defaults
 redis_server = "localhost"
 redis_port = 6379
 redis_list = "metrics_graphite"
+redis_transport = "list"
+redis_stream = "metrics_stream"
 redis_database = 0
 env_logger_file = "{homedir}/graphite_exporter.log".format(homedir=os.path.expanduser("~"))
 graphite_cfg_file= "{homedir}/graphite_cfg.json".format(homedir=os.path.expanduser("~"))
-
-publish_error_counter = 0
+batch_size = 100
+batch_linger = 5.0
+aggregate_window = 0
+aggregate_max_pending = 10000
+block_timeout = 30
+http_timeout = 30
+http_gzip_threshold = 0
+consumer_name = socket.gethostname()
+max_attempts = 0
+
+retry_base_delay = 1.0
+retry_max_delay = 300.0
+circuit_failure_threshold = 5
+circuit_reset_timeout = 30.0
 
 ## CLI parser
 cli_parser = argparse.ArgumentParser(description='Script for exporting messages from redis queue to pubsub topic')
@@ -75,8 +109,24 @@ cli_parser.add_argument('--graphite-cfg-file', action='store', type=str, require
 cli_parser.add_argument('--redis-port', action='store', type=int, required=False, default=redis_port,help="Redis port to connect too")
 cli_parser.add_argument('--redis-server', action='store', type=str, required=False, default=redis_server,help="Redis server host address")
 cli_parser.add_argument('--redis-list', action='append', type=str, required=False, default=redis_list,help="On which Redis list I should work")
+cli_parser.add_argument('--transport', action='store', type=str, required=False, default=redis_transport, choices=["list","stream"],help="Read messages from own Redis list, or from Redis stream through consumer group (stream needs Redis 6.2+)")
+cli_parser.add_argument('--redis-stream', action='store', type=str, required=False, default=redis_stream,help="Redis stream used with stream transport")
+cli_parser.add_argument('--redis-group', action='store', type=str, required=False, default=None,help="Redis stream consumer group, defaults to Redis list name")
 cli_parser.add_argument('--redis-database', action='store', type=int, required=False, default=redis_database,help="On which Redis list I should work")
 cli_parser.add_argument('--logger-file', action='store', type=str, required=False, default=env_logger_file,help="Debug messages to file")
+cli_parser.add_argument('--batch-size', action='store', type=int, required=False, default=batch_size,help="Max number of messages sent to graphite in one request")
+cli_parser.add_argument('--batch-linger', action='store', type=float, required=False, default=batch_linger,help="Max time in seconds to wait for a full batch before sending")
+cli_parser.add_argument('--aggregate-window', action='store', type=int, required=False, default=aggregate_window,help="Send min/max/mean/last/count per window of this many seconds instead of raw messages, 0 sends raw")
+cli_parser.add_argument('--aggregate-max-pending', action='store', type=int, required=False, default=aggregate_max_pending,help="Aggregated windows kept for retry while export fails, oldest are dropped above it (raw messages are already acked)")
+cli_parser.add_argument('--http-timeout', action='store', type=float, required=False, default=http_timeout,help="Max time in seconds to wait for graphite response")
+cli_parser.add_argument('--http-gzip-threshold', action='store', type=int, required=False, default=http_gzip_threshold,help="Gzip request bodies of at least this many bytes, 0 disables compression (default, endpoint has to accept gzip request bodies)")
+cli_parser.add_argument('--retry-base-delay', action='store', type=float, required=False, default=retry_base_delay,help="Delay in seconds after first publishing error, doubled on each next error")
+cli_parser.add_argument('--retry-max-delay', action='store', type=float, required=False, default=retry_max_delay,help="Max delay in seconds between publishing retries")
+cli_parser.add_argument('--circuit-failure-threshold', action='store', type=int, required=False, default=circuit_failure_threshold,help="Consecutive publishing errors after which publishing is paused")
+cli_parser.add_argument('--circuit-reset-timeout', action='store', type=float, required=False, default=circuit_reset_timeout,help="Seconds publishing stays paused before a probe is sent")
+cli_parser.add_argument('--block-timeout', action='store', type=int, required=False, default=block_timeout,help="Max time in seconds to block on empty Redis list")
+cli_parser.add_argument('--consumer-name', action='store', type=str, required=False, default=consumer_name,help="Name of this consumer, used for its Redis in-flight list")
+cli_parser.add_argument('--max-attempts', action='store', type=int, required=False, default=max_attempts,help="Failed sends after which a message goes to dead letter list, 0 retries without limit")
 
 cli_args = cli_parser.parse_args()
 
@@ -103,40 +153,97 @@ if __name__ == '__main__':
         logging.fatal("Cant load configuraion for graphite")
         sys.exit(-1)
 
-    redis_list_length = redis_connection.llen(cli_args.redis_list)
+    graphite_client = graphite_http_client_open(graphite_configuration,timeout=cli_args.http_timeout,gzip_threshold=cli_args.http_gzip_threshold)
+
+    if cli_args.transport == "stream":
+        redis_consumer = RedisStreamConsumer(redis_connection,cli_args.redis_stream,cli_args.redis_group or cli_args.redis_list,cli_args.consumer_name,block_timeout=cli_args.block_timeout,max_attempts=cli_args.max_attempts)
+    else:
+        redis_consumer = RedisReliableConsumer(redis_connection,cli_args.redis_list,cli_args.consumer_name,block_timeout=cli_args.block_timeout,max_attempts=cli_args.max_attempts)
+
+    recovered_count = redis_consumer.recover_in_flight()
+    logging.info("Statup: Messages requeued from previous run: {count}".format(count=recovered_count))
+
+    redis_list_length = redis_consumer.get_queue_length()
     logging.info("Statup: Redis queue length to process: {llen}".format(llen=redis_list_length))
 
-    while True:
+    message_aggregator = None
+    if cli_args.aggregate_window > 0:
+        logging.info("Aggregating messages in {window}s windows".format(window=cli_args.aggregate_window))
+        message_aggregator = MessageAggregator(window=cli_args.aggregate_window,max_pending=cli_args.aggregate_max_pending)
+
+    retry_policy = RetryPolicy(base_delay=cli_args.retry_base_delay,max_delay=cli_args.retry_max_delay)
+    circuit_breaker = CircuitBreaker(failure_threshold=cli_args.circuit_failure_threshold,reset_timeout=cli_args.circuit_reset_timeout)
 
-        redis_list_length = redis_connection.llen(cli_args.redis_list)
-        if redis_list_length % 10 == 0:
-            logging.info("Redis queue length to process: {llen}".format(llen=redis_list_length))
+    while True:
 
-        if redis_list_length > 0:
+        # while circuit is open messages stay in Redis
+        if not circuit_breaker.allow_request():
+            time.sleep(circuit_breaker.get_wait_time())
+            continue
+
+        try:
+            rmsgs = redis_consumer.read_batch(cli_args.batch_size,linger=cli_args.batch_linger)
+        except Exception:
+            rmsgs = []
+            traceback.print_exc()
+            logging.error(traceback.print_exc())
+            time.sleep(1)
+
+        msg_batch = []
+        rmsg_batch = []
+        rmsg_invalid = []
+        # whole backlog batch is decoded at once
+        for rmsg, msg_object in zip(rmsgs,decode_messages(rmsgs)):
+            if msg_object is not None:
+                msg_batch.append(msg_object)
+                rmsg_batch.append(rmsg)
+            else:
+                rmsg_invalid.append(rmsg)
+
+        # invalid messages will never be sent, drop them from in-flight list
+        redis_consumer.ack(rmsg_invalid)
+
+        if message_aggregator is not None:
+            # raw messages are folded into open windows and acked, closed windows are sent instead
+            for msg_object in msg_batch:
+                message_aggregator.add(msg_object)
+            redis_consumer.ack(rmsg_batch)
+            msg_batch = message_aggregator.collect()
+            rmsg_batch = msg_batch
+
+        # messages which can not be turned into metrics would fail on every retry
+        graphite_metrics = get_graphite_batch_metrics(msg_batch,graphite_configuration)
+        rmsg_unserializable = [rmsg for rmsg, metrics in zip(rmsg_batch,graphite_metrics) if metrics is None]
+        if len(rmsg_unserializable) > 0:
+            dead_letter_messages(rmsg_unserializable,redis_consumer,message_aggregator)
+            msg_batch = [msg_object for msg_object, metrics in zip(msg_batch,graphite_metrics) if metrics is not None]
+            rmsg_batch = [rmsg for rmsg, metrics in zip(rmsg_batch,graphite_metrics) if metrics is not None]
+
+        if len(msg_batch) > 0:
+            logging.info("Sending batch of {count} messages to graphite".format(count=len(msg_batch)))
+            graphite_data = [metric for metrics in graphite_metrics if metrics is not None for metric in metrics]
+            publishing_status = None
             try:
-                rmsg = redis_connection.lpop(cli_args.redis_list)
-                msg_object = MessageObject()
-                msg_object.create_message_from_json(rmsg)
-                if msg_object.validate():
-                    try:
-                        publishing_result = graphite_write_metrics(msg_object,configuration=graphite_configuration)
-                        if not publishing_result:
-                            publish_error_counter += 1
-                    except Exception:
-                        publish_error_counter += 1
-                        logging.error("Error during message publishing")
-                        traceback.print_exc()
-                        logging.error(traceback.print_exc())
-                        time.sleep(60*publish_error_counter)
-                        
-                time.sleep(1)
+                publishing_result = graphite_write_data(graphite_data,http_client=graphite_client)
+                publishing_status = publishing_result.status_code
+                publishing_ok = publishing_result.ok
             except Exception:
+                publishing_ok = False
+                logging.error("Error during message publishing")
                 traceback.print_exc()
-                logging.error(traceback.print_exc())    
-        else:
-            logging.info("Redis queue is empty. waiting")
-            time.sleep(60)
-
-        if publish_error_counter > 10:
-            logging.fatal("Over 10 error related with message publishing. Exiting")
-            sys.exit(-1)
\ No newline at end of file
+                logging.error(traceback.print_exc())
+
+            if publishing_ok:
+                ack_messages(rmsg_batch,redis_consumer,message_aggregator)
+                retry_policy.record_success()
+                circuit_breaker.record_success()
+            elif is_permanent_status(publishing_status):
+                # client error, sending the same batch again would fail too
+                logging.error("Graphite rejected batch with status {code}, moving it to dead letter list".format(code=publishing_status))
+                dead_letter_messages(rmsg_batch,redis_consumer,message_aggregator)
+            else:
+                requeue_messages(rmsg_batch,redis_consumer,message_aggregator)
+                circuit_breaker.record_failure()
+                time.sleep(retry_policy.record_failure())
+        elif len(rmsgs) == 0:
+            logging.debug("Redis queue is empty. waiting")
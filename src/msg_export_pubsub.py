@@ -8,12 +8,21 @@ import redis
 import logging
 import traceback
 import json
+import socket
 from google.oauth2 import service_account
 
 from google.cloud import pubsub_v1
 
 sys.path.append(os.path.abspath(os.path.dirname(__file__))+"/lib")
 
+from message_object import MessageObject
+from message_aggregator import MessageAggregator
+from message_batch import decode_messages
+from redis_consumer import RedisReliableConsumer
+from redis_stream_transport import RedisStreamConsumer
+from retry_policy import RetryPolicy, CircuitBreaker, is_permanent_error
+from pubsub_publisher import PipelinedPublisher, StubPublisherClient, get_envelope
+
 ## functions
 def redis_connection_open(host,port,database):
     redis_conn = redis.Redis(host=host,port=port,db=database)
@@ -26,6 +35,32 @@ def redis_connection_close(redis):
 def redis_write_message(msg,redis_conn,redis_list):
     return redis_conn.lpush(redis_list, msg)
 
+def ack_messages(rmsgs,redis_consumer,message_aggregator):
+    # aggregated windows are not in Redis, raw messages were acked when folded
+    if message_aggregator is not None:
+        return True
+    return redis_consumer.ack(rmsgs)
+
+def requeue_messages(rmsgs,redis_consumer,message_aggregator):
+    if message_aggregator is not None:
+        return message_aggregator.requeue(rmsgs)
+    return redis_consumer.requeue(rmsgs)
+
+def dead_letter_messages(rmsgs,redis_consumer,message_aggregator):
+    # messages PubSub will never accept are not retried
+    if message_aggregator is not None:
+        logging.error("Dropping {count} aggregated windows PubSub will not accept".format(count=len(rmsgs)))
+        return 0
+    return redis_consumer.dead_letter(rmsgs)
+
+def aggregate_messages(rmsgs,redis_consumer,message_aggregator):
+    # raw messages are folded into open windows and acked, closed windows are published instead
+    for msg_object in decode_messages(rmsgs):
+        if msg_object is not None:
+            message_aggregator.add(msg_object)
+    redis_consumer.ack(rmsgs)
+    return message_aggregator.collect()
+
 ## local defaults
 env_gcp_topic_name = "iot-data"
 env_gcp_project_name = "data-integration-playground"
@@ -33,10 +68,27 @@ env_gcp_auth_file = "{homedir}/data-integration-playground.json".format(homedir=
 redis_server = "localhost"
 redis_port = 6379
 redis_list = "metrics_pubsub"
+redis_transport = "list"
+redis_stream = "metrics_stream"
 redis_database = 0
 env_logger_file = "{homedir}/pubsub_exporter.log".format(homedir=os.path.expanduser("~"))
 
-publish_error_counter = 0
+block_timeout = 30
+batch_size = 500
+batch_linger = 0.5
+aggregate_window = 0
+aggregate_max_pending = 10000
+max_in_flight = 1000
+envelope_size = 0
+pubsub_max_messages = 100
+pubsub_max_bytes = 1024*1024
+pubsub_max_latency = 0.05
+consumer_name = socket.gethostname()
+max_attempts = 0
+retry_base_delay = 1.0
+retry_max_delay = 300.0
+circuit_failure_threshold = 5
+circuit_reset_timeout = 30.0
 
 ## CLI parser
 cli_parser = argparse.ArgumentParser(description='Script for exporting messages from redis queue to pubsub topic')
@@ -48,7 +100,27 @@ cli_parser.add_argument('--gcp-auth-json', action='store', type=str, required=Fa
 cli_parser.add_argument('--redis-port', action='store', type=int, required=False, default=redis_port,help="Redis port to connect too")
 cli_parser.add_argument('--redis-server', action='store', type=str, required=False, default=redis_server,help="Redis server host address")
 cli_parser.add_argument('--redis-list', action='append', type=str, required=False, default=redis_list,help="On which Redis list I should work")
+cli_parser.add_argument('--transport', action='store', type=str, required=False, default=redis_transport, choices=["list","stream"],help="Read messages from own Redis list, or from Redis stream through consumer group (stream needs Redis 6.2+)")
+cli_parser.add_argument('--redis-stream', action='store', type=str, required=False, default=redis_stream,help="Redis stream used with stream transport")
+cli_parser.add_argument('--redis-group', action='store', type=str, required=False, default=None,help="Redis stream consumer group, defaults to Redis list name")
 cli_parser.add_argument('--redis-database', action='store', type=int, required=False, default=redis_database,help="On which Redis list I should work")
+cli_parser.add_argument('--retry-base-delay', action='store', type=float, required=False, default=retry_base_delay,help="Delay in seconds after first publishing error, doubled on each next error")
+cli_parser.add_argument('--retry-max-delay', action='store', type=float, required=False, default=retry_max_delay,help="Max delay in seconds between publishing retries")
+cli_parser.add_argument('--circuit-failure-threshold', action='store', type=int, required=False, default=circuit_failure_threshold,help="Consecutive publishing errors after which publishing is paused")
+cli_parser.add_argument('--circuit-reset-timeout', action='store', type=float, required=False, default=circuit_reset_timeout,help="Seconds publishing stays paused before a probe is sent")
+cli_parser.add_argument('--block-timeout', action='store', type=int, required=False, default=block_timeout,help="Max time in seconds to block on empty Redis list")
+cli_parser.add_argument('--batch-size', action='store', type=int, required=False, default=batch_size,help="Max number of messages taken from Redis in one round trip")
+cli_parser.add_argument('--batch-linger', action='store', type=float, required=False, default=batch_linger,help="Max time in seconds to wait for a full batch from Redis")
+cli_parser.add_argument('--aggregate-window', action='store', type=int, required=False, default=aggregate_window,help="Send min/max/mean/last/count per window of this many seconds instead of raw messages, 0 sends raw. Window rows add interval, count, min_value, max_value and last_value fields, the BigQuery table needs these columns")
+cli_parser.add_argument('--aggregate-max-pending', action='store', type=int, required=False, default=aggregate_max_pending,help="Aggregated windows kept for retry while export fails, oldest are dropped above it (raw messages are already acked)")
+cli_parser.add_argument('--envelope-size', action='store', type=int, required=False, default=envelope_size,help="Pack up to this many messages into one PubSub message as NDJSON envelope, 0 publishes each message alone")
+cli_parser.add_argument('--max-in-flight', action='store', type=int, required=False, default=max_in_flight,help="Max number of PubSub publish requests waiting for confirmation")
+cli_parser.add_argument('--pubsub-max-messages', action='store', type=int, required=False, default=pubsub_max_messages,help="PubSub client batch setting: max messages in one request")
+cli_parser.add_argument('--pubsub-max-bytes', action='store', type=int, required=False, default=pubsub_max_bytes,help="PubSub client batch setting: max bytes in one request")
+cli_parser.add_argument('--pubsub-max-latency', action='store', type=float, required=False, default=pubsub_max_latency,help="PubSub client batch setting: max seconds to wait before sending a request")
+cli_parser.add_argument('--pubsub-stub', action='store_true', required=False, default=False,help="Use local stub instead of GCP PubSub (testing and benchmarks)")
+cli_parser.add_argument('--consumer-name', action='store', type=str, required=False, default=consumer_name,help="Name of this consumer, used for its Redis in-flight list")
+cli_parser.add_argument('--max-attempts', action='store', type=int, required=False, default=max_attempts,help="Failed publishes after which a message goes to dead letter list, 0 retries without limit")
 cli_parser.add_argument('--logger-file', action='store', type=str, required=False, default=env_logger_file,help="Debug messages to file")
 
 cli_args = cli_parser.parse_args()
@@ -67,47 +139,134 @@ if __name__ == '__main__':
     logging.info("Setting up Redis connection")
     redis_connection = redis_connection_open(host=cli_args.redis_server,port=cli_args.redis_port,database=cli_args.redis_database)
 
-    logging.info("Performing GCP Auth using {auth_file}".format(auth_file=cli_args.gcp_auth_json))
-    service_account_info = json.load(open(cli_args.gcp_auth_json))
-    
-    credentials = service_account.Credentials.from_service_account_info(service_account_info)
+    if cli_args.pubsub_stub:
+        logging.info("Using local stub PubSub publisher")
+        publisher = StubPublisherClient()
+    else:
+        logging.info("Performing GCP Auth using {auth_file}".format(auth_file=cli_args.gcp_auth_json))
+        service_account_info = json.load(open(cli_args.gcp_auth_json))
+
+        credentials = service_account.Credentials.from_service_account_info(service_account_info)
 
-    publisher = pubsub_v1.PublisherClient(credentials=credentials)
+        batch_settings = pubsub_v1.types.BatchSettings(
+            max_messages=cli_args.pubsub_max_messages,
+            max_bytes=cli_args.pubsub_max_bytes,
+            max_latency=cli_args.pubsub_max_latency
+        )
+        publisher = pubsub_v1.PublisherClient(batch_settings=batch_settings,credentials=credentials)
 
     pubsub_topic = publisher.topic_path(cli_args.gcp_project, cli_args.pubsub_topic)
+    pipelined_publisher = PipelinedPublisher(publisher,pubsub_topic,max_in_flight=cli_args.max_in_flight)
 
-    redis_list_length = redis_connection.llen(cli_args.redis_list)
+    if cli_args.transport == "stream":
+        redis_consumer = RedisStreamConsumer(redis_connection,cli_args.redis_stream,cli_args.redis_group or cli_args.redis_list,cli_args.consumer_name,block_timeout=cli_args.block_timeout,max_attempts=cli_args.max_attempts)
+    else:
+        redis_consumer = RedisReliableConsumer(redis_connection,cli_args.redis_list,cli_args.consumer_name,block_timeout=cli_args.block_timeout,max_attempts=cli_args.max_attempts)
+
+    recovered_count = redis_consumer.recover_in_flight()
+    logging.info("Statup: Messages requeued from previous run: {count}".format(count=recovered_count))
+
+    redis_list_length = redis_consumer.get_queue_length()
     logging.info("Statup: Redis queue length to process: {llen}".format(llen=redis_list_length))
 
+    message_aggregator = None
+    if cli_args.aggregate_window > 0:
+        logging.info("Aggregating messages in {window}s windows".format(window=cli_args.aggregate_window))
+        message_aggregator = MessageAggregator(window=cli_args.aggregate_window,max_pending=cli_args.aggregate_max_pending)
+
+    retry_policy = RetryPolicy(base_delay=cli_args.retry_base_delay,max_delay=cli_args.retry_max_delay)
+    circuit_breaker = CircuitBreaker(failure_threshold=cli_args.circuit_failure_threshold,reset_timeout=cli_args.circuit_reset_timeout)
+
+    rmsg_failed = []
+    rmsg_rejected = []
     while True:
 
-        redis_list_length = redis_connection.llen(cli_args.redis_list)
-        if redis_list_length % 10 == 0:
-            logging.info("Redis queue length to process: {llen}".format(llen=redis_list_length))
+        # confirmations arrive on PubSub client threads, Redis is updated from here in bulk
+        try:
+            rmsg_published, publish_failures = pipelined_publisher.collect_results()
+            for rmsg, error in publish_failures:
+                logging.error("Error during message publishing: {err}".format(err=error))
+                if is_permanent_error(error):
+                    rmsg_rejected.append(rmsg)
+                else:
+                    rmsg_failed.append(rmsg)
+
+            ack_messages(rmsg_published,redis_consumer,message_aggregator)
+            if len(rmsg_rejected) > 0:
+                # invalid or too large messages, publishing them again would fail too
+                dead_letter_messages(rmsg_rejected,redis_consumer,message_aggregator)
+                rmsg_rejected = []
+            if len(rmsg_failed) > 0:
+                requeue_messages(rmsg_failed,redis_consumer,message_aggregator)
+                rmsg_failed = []
+                circuit_breaker.record_failure()
+                time.sleep(retry_policy.record_failure())
+            elif len(rmsg_published) > 0:
+                retry_policy.record_success()
+                circuit_breaker.record_success()
+        except Exception:
+            traceback.print_exc()
+            logging.error(traceback.print_exc())
 
-        if redis_list_length > 0:
+        # while circuit is open messages stay in Redis
+        if not circuit_breaker.allow_request():
+            time.sleep(circuit_breaker.get_wait_time())
+            continue
+
+        # do not block for long while confirmations are still waiting to be acked
+        read_block_timeout = None
+        if pipelined_publisher.get_in_flight() > 0 or not pipelined_publisher.completed.empty():
+            read_block_timeout = 1
+
+        try:
+            rmsgs = redis_consumer.read_batch(cli_args.batch_size,linger=cli_args.batch_linger,block_timeout=read_block_timeout)
+        except Exception:
+            rmsgs = []
+            traceback.print_exc()
+            logging.error(traceback.print_exc())
+            time.sleep(1)
+
+        if message_aggregator is not None:
             try:
-                rmsg = redis_connection.lpop(cli_args.redis_list)
+                rmsgs = aggregate_messages(rmsgs,redis_consumer,message_aggregator)
+            except Exception:
+                rmsgs = []
+                traceback.print_exc()
+                logging.error(traceback.print_exc())
 
+        if cli_args.envelope_size > 0:
+            for envelope_start in range(0,len(rmsgs),cli_args.envelope_size):
+                rmsg_envelope = rmsgs[envelope_start:envelope_start+cli_args.envelope_size]
                 try:
-                    publishing_result = publisher.publish(pubsub_topic, rmsg)
-                    
-                except Exception:
-                    publish_error_counter += 1
-                    logging.error("Error during message publishing")
+                    if message_aggregator is not None:
+                        envelope_data, envelope_attributes = get_envelope([rmsg.export_message_bytes() for rmsg in rmsg_envelope])
+                    else:
+                        envelope_data, envelope_attributes = get_envelope(rmsg_envelope)
+                    pipelined_publisher.publish_envelope(rmsg_envelope,envelope_data,attributes=envelope_attributes)
+                except Exception as e:
+                    if is_permanent_error(e):
+                        rmsg_rejected.extend(rmsg_envelope)
+                    else:
+                        rmsg_failed.extend(rmsg_envelope)
                     traceback.print_exc()
                     logging.error(traceback.print_exc())
-                    time.sleep(60*publish_error_counter)
-                    
-                time.sleep(0.05)
-            except Exception:
-                traceback.print_exc()
-                logging.error(traceback.print_exc())    
+            rmsgs_single = []
         else:
-            logging.info("Redis queue is empty. waiting")
-            time.sleep(60)
+            rmsgs_single = rmsgs
+
+        for rmsg in rmsgs_single:
+            try:
+                if message_aggregator is not None:
+                    pipelined_publisher.publish(rmsg,data=rmsg.export_message_bytes())
+                else:
+                    pipelined_publisher.publish(rmsg)
+            except Exception as e:
+                if is_permanent_error(e):
+                    rmsg_rejected.append(rmsg)
+                else:
+                    rmsg_failed.append(rmsg)
+                traceback.print_exc()
+                logging.error(traceback.print_exc())
 
-        if publish_error_counter > 10:
-            logging.fatal("Over 10 error related with message publishing. Exiting")
-            sys.exit(-1)
-        
+        if len(rmsgs) == 0:
+            logging.debug("Redis queue is empty. waiting")
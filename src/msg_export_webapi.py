@@ -8,12 +8,18 @@ import redis
 import logging
 import traceback
 import json
-import requests
+import socket
 
 sys.path.append(os.path.abspath(os.path.dirname(__file__))+"/lib")
 
 # import message_object
 from message_object import MessageObject
+from redis_consumer import RedisReliableConsumer
+from redis_stream_transport import RedisStreamConsumer
+from retry_policy import RetryPolicy, CircuitBreaker
+from export_sinks import webapi_http_client_open, webapi_send_messages
+from message_aggregator import MessageAggregator
+from message_batch import decode_messages
 
 ## functions
 def redis_connection_open(host,port,database):
@@ -27,34 +33,81 @@ def redis_connection_close(redis):
 def redis_write_message(msg,redis_conn,redis_list):
     return redis_conn.lpush(redis_list, msg)
 
-def webapi_write_metrics(msg_obj,configuration):
-
-    headers = {
-        "Authorization": "Bearer {auth_bearer}".format(auth_bearer=configuration['auth']),
-        'Content-Type': 'application/json'
-    }
-
-    print(msg_obj.export_message())
-    result = requests.post(configuration['url'], data=msg_obj.export_message(), headers=headers)
-    if not result.ok:
-        logging.error("Error while exporting data to graphite: {}".format(result.text))
-    return result.ok
+def ack_messages(rmsgs,redis_consumer,message_aggregator):
+    # aggregated windows are not in Redis, raw messages were acked when folded
+    if message_aggregator is not None:
+        return True
+    return redis_consumer.ack(rmsgs)
+
+def requeue_messages(rmsgs,redis_consumer,message_aggregator):
+    if message_aggregator is not None:
+        return message_aggregator.requeue(rmsgs)
+    return redis_consumer.requeue(rmsgs)
+
+def dead_letter_messages(rmsgs,redis_consumer,message_aggregator):
+    # messages webapi will never accept are not retried
+    if message_aggregator is not None:
+        logging.error("Dropping {count} aggregated windows webapi will not accept".format(count=len(rmsgs)))
+        return 0
+    return redis_consumer.dead_letter(rmsgs)
+
+def is_serializable(msg_obj):
+    # serialized bytes are cached in message, sending them later costs nothing more
+    try:
+        msg_obj.export_message_bytes()
+        return True
+    except (TypeError,ValueError):
+        logging.error("Cant serialize {name} message from device {device} for webapi".format(name=msg_obj.get_measure_name(),device=msg_obj.get_device_id()))
+        return False
 
 ## local defaults
 redis_server = "localhost"
 redis_port = 6379
 redis_list = "metrics_webapi"
+redis_transport = "list"
+redis_stream = "metrics_stream"
 redis_database = 0
 env_logger_file = "{homedir}/webapi_exporter.log".format(homedir=os.path.expanduser("~"))
 webapi_cfg_file = "{homedir}/webapi_cfg.json".format(homedir=os.path.expanduser("~"))
-publish_error_counter = 0
+block_timeout = 30
+http_timeout = 30
+http_gzip_threshold = 0
+consumer_name = socket.gethostname()
+max_attempts = 0
+batch_format = None
+batch_size = 100
+batch_linger = 5.0
+aggregate_window = 0
+aggregate_max_pending = 10000
+webapi_measure_names = ["MSGC_TEMPERATURE","MSGC_HUMIDITY"]
+retry_base_delay = 1.0
+retry_max_delay = 300.0
+circuit_failure_threshold = 5
+circuit_reset_timeout = 30.0
 
 ## CLI parser
 cli_parser = argparse.ArgumentParser(description='Script for exporting messages from redis queue to pubsub topic')
 cli_parser.add_argument('--redis-port', action='store', type=int, required=False, default=redis_port,help="Redis port to connect too")
 cli_parser.add_argument('--redis-server', action='store', type=str, required=False, default=redis_server,help="Redis server host address")
 cli_parser.add_argument('--redis-list', action='append', type=str, required=False, default=redis_list,help="On which Redis list I should work")
+cli_parser.add_argument('--transport', action='store', type=str, required=False, default=redis_transport, choices=["list","stream"],help="Read messages from own Redis list, or from Redis stream through consumer group (stream needs Redis 6.2+)")
+cli_parser.add_argument('--redis-stream', action='store', type=str, required=False, default=redis_stream,help="Redis stream used with stream transport")
+cli_parser.add_argument('--redis-group', action='store', type=str, required=False, default=None,help="Redis stream consumer group, defaults to Redis list name")
 cli_parser.add_argument('--redis-database', action='store', type=int, required=False, default=redis_database,help="On which Redis list I should work")
+cli_parser.add_argument('--http-timeout', action='store', type=float, required=False, default=http_timeout,help="Max time in seconds to wait for webapi response")
+cli_parser.add_argument('--http-gzip-threshold', action='store', type=int, required=False, default=http_gzip_threshold,help="Gzip request bodies of at least this many bytes, 0 disables compression (default, endpoint has to accept gzip request bodies)")
+cli_parser.add_argument('--batch-format', action='store', type=str, required=False, default=batch_format, choices=["array","ndjson"],help="Send messages in batches as JSON array or NDJSON, single messages if not set")
+cli_parser.add_argument('--batch-size', action='store', type=int, required=False, default=batch_size,help="Max number of messages sent to webapi in one request")
+cli_parser.add_argument('--batch-linger', action='store', type=float, required=False, default=batch_linger,help="Max time in seconds to wait for a full batch before sending")
+cli_parser.add_argument('--aggregate-window', action='store', type=int, required=False, default=aggregate_window,help="Send min/max/mean/last/count per window of this many seconds instead of raw messages, 0 sends raw")
+cli_parser.add_argument('--aggregate-max-pending', action='store', type=int, required=False, default=aggregate_max_pending,help="Aggregated windows kept for retry while export fails, oldest are dropped above it (raw messages are already acked)")
+cli_parser.add_argument('--retry-base-delay', action='store', type=float, required=False, default=retry_base_delay,help="Delay in seconds after first publishing error, doubled on each next error")
+cli_parser.add_argument('--retry-max-delay', action='store', type=float, required=False, default=retry_max_delay,help="Max delay in seconds between publishing retries")
+cli_parser.add_argument('--circuit-failure-threshold', action='store', type=int, required=False, default=circuit_failure_threshold,help="Consecutive publishing errors after which publishing is paused")
+cli_parser.add_argument('--circuit-reset-timeout', action='store', type=float, required=False, default=circuit_reset_timeout,help="Seconds publishing stays paused before a probe is sent")
+cli_parser.add_argument('--block-timeout', action='store', type=int, required=False, default=block_timeout,help="Max time in seconds to block on empty Redis list")
+cli_parser.add_argument('--consumer-name', action='store', type=str, required=False, default=consumer_name,help="Name of this consumer, used for its Redis in-flight list")
+cli_parser.add_argument('--max-attempts', action='store', type=int, required=False, default=max_attempts,help="Failed sends after which a message goes to dead letter list, 0 retries without limit")
 cli_parser.add_argument('--logger-file', action='store', type=str, required=False, default=env_logger_file,help="Debug messages to file")
 cli_parser.add_argument('--webapi-cfg-file', action='store', type=str, required=False, default=webapi_cfg_file ,help="Graphite configuration in JSON file")
 
@@ -84,41 +137,101 @@ if __name__ == '__main__':
         logging.fatal("Cant load configuraion for webapi")
         sys.exit(-1)
 
-    redis_list_length = redis_connection.llen(cli_args.redis_list)
+    webapi_client = webapi_http_client_open(webapi_configuration,timeout=cli_args.http_timeout,gzip_threshold=cli_args.http_gzip_threshold)
+
+    # measures to export can be set in configuration file
+    measure_names_exported = frozenset(webapi_configuration.get('measure_names',webapi_measure_names))
+    logging.info("Exported measures: {names}".format(names=",".join(sorted(measure_names_exported))))
+
+    message_aggregator = None
+    if cli_args.aggregate_window > 0:
+        logging.info("Aggregating messages in {window}s windows".format(window=cli_args.aggregate_window))
+        message_aggregator = MessageAggregator(window=cli_args.aggregate_window,max_pending=cli_args.aggregate_max_pending)
+
+    webapi_batch_format = cli_args.batch_format
+    if webapi_batch_format is None and message_aggregator is None:
+        read_batch_size = 1
+        read_batch_linger = 0
+    else:
+        read_batch_size = cli_args.batch_size
+        read_batch_linger = cli_args.batch_linger
+
+    if cli_args.transport == "stream":
+        redis_consumer = RedisStreamConsumer(redis_connection,cli_args.redis_stream,cli_args.redis_group or cli_args.redis_list,cli_args.consumer_name,block_timeout=cli_args.block_timeout,max_attempts=cli_args.max_attempts)
+    else:
+        redis_consumer = RedisReliableConsumer(redis_connection,cli_args.redis_list,cli_args.consumer_name,block_timeout=cli_args.block_timeout,max_attempts=cli_args.max_attempts)
+
+    recovered_count = redis_consumer.recover_in_flight()
+    logging.info("Statup: Messages requeued from previous run: {count}".format(count=recovered_count))
+
+    redis_list_length = redis_consumer.get_queue_length()
     logging.info("Statup: Redis queue length to process: {llen}".format(llen=redis_list_length))
 
+    retry_policy = RetryPolicy(base_delay=cli_args.retry_base_delay,max_delay=cli_args.retry_max_delay)
+    circuit_breaker = CircuitBreaker(failure_threshold=cli_args.circuit_failure_threshold,reset_timeout=cli_args.circuit_reset_timeout)
+
     while True:
 
-        redis_list_length = redis_connection.llen(cli_args.redis_list)
-        if redis_list_length % 10 == 0:
-            logging.info("Redis queue length to process: {llen}".format(llen=redis_list_length))
-
-        if redis_list_length > 0:
-            try:
-                rmsg = redis_connection.lpop(cli_args.redis_list)
-                msg_object = MessageObject()
-                msg_object.create_message_from_json(rmsg)
-                if msg_object.validate():
-                    if msg_object.get_measure_name() == 'MSGC_TEMPERATURE' or msg_object.get_measure_name() == 'MSGC_HUMIDITY':
-                        try:
-                            publishing_result = webapi_write_metrics(msg_object,configuration=webapi_configuration)
-                            if not publishing_result:
-                                publish_error_counter += 1
-                        except Exception:
-                            publish_error_counter += 1
-                            logging.error("Error during message publishing")
-                            traceback.print_exc()
-                            logging.error(traceback.print_exc())
-                            time.sleep(60*publish_error_counter)
-
-                time.sleep(0.5)
-            except Exception:
-                traceback.print_exc()
-                logging.error(traceback.print_exc())
-        else:
-            logging.info("Redis queue is empty. waiting")
-            time.sleep(60)
-
-        if publish_error_counter > 10:
-            logging.fatal("Over 10 error related with message publishing. Exiting")
-            sys.exit(-1)
+        # while circuit is open messages stay in Redis
+        if not circuit_breaker.allow_request():
+            time.sleep(circuit_breaker.get_wait_time())
+            continue
+
+        try:
+            rmsgs = redis_consumer.read_batch(read_batch_size,linger=read_batch_linger)
+        except Exception:
+            rmsgs = []
+            traceback.print_exc()
+            logging.error(traceback.print_exc())
+            time.sleep(1)
+
+        if len(rmsgs) == 0 and message_aggregator is None:
+            logging.debug("Redis queue is empty. waiting")
+            continue
+
+        try:
+            msg_batch = []
+            rmsg_batch = []
+            rmsg_skipped = []
+            for rmsg, msg_object in zip(rmsgs,decode_messages(rmsgs)):
+                if msg_object is not None and msg_object.get_measure_name() in measure_names_exported:
+                    msg_batch.append(msg_object)
+                    rmsg_batch.append(rmsg)
+                else:
+                    rmsg_skipped.append(rmsg)
+
+            # skipped and invalid messages are acked too, only failed sends go back to queue
+            redis_consumer.ack(rmsg_skipped)
+
+            if message_aggregator is not None:
+                # raw messages are folded into open windows and acked, closed windows are sent instead
+                for msg_object in msg_batch:
+                    message_aggregator.add(msg_object)
+                redis_consumer.ack(rmsg_batch)
+                msg_batch = message_aggregator.collect()
+                rmsg_batch = msg_batch
+
+            # messages which can not be serialized would fail on every retry
+            msg_serializable = [is_serializable(msg_object) for msg_object in msg_batch]
+            if not all(msg_serializable):
+                dead_letter_messages([rmsg for rmsg, serializable in zip(rmsg_batch,msg_serializable) if not serializable],redis_consumer,message_aggregator)
+                msg_batch = [msg_object for msg_object, serializable in zip(msg_batch,msg_serializable) if serializable]
+                rmsg_batch = [rmsg for rmsg, serializable in zip(rmsg_batch,msg_serializable) if serializable]
+
+            if len(msg_batch) > 0:
+                # too large batches are split, bad ones go as single messages, see webapi_send_messages
+                rmsg_sent, rmsg_failed, rmsg_rejected, webapi_batch_format = webapi_send_messages(msg_batch,rmsg_batch,webapi_client,webapi_batch_format)
+                ack_messages(rmsg_sent,redis_consumer,message_aggregator)
+                if len(rmsg_rejected) > 0:
+                    logging.error("Webapi rejected {count} messages, moving them to dead letter list".format(count=len(rmsg_rejected)))
+                    dead_letter_messages(rmsg_rejected,redis_consumer,message_aggregator)
+                if len(rmsg_failed) > 0:
+                    requeue_messages(rmsg_failed,redis_consumer,message_aggregator)
+                    circuit_breaker.record_failure()
+                    time.sleep(retry_policy.record_failure())
+                else:
+                    retry_policy.record_success()
+                    circuit_breaker.record_success()
+        except Exception:
+            traceback.print_exc()
+            logging.error(traceback.print_exc())
@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+
+import sys
+import argparse
+import os
+import asyncio
+import collections
+import logging
+import traceback
+import json
+import socket
+import redis.asyncio
+
+sys.path.append(os.path.abspath(os.path.dirname(__file__))+"/lib")
+
+# import message_object
+from message_object import MessageObject
+from redis_consumer import AsyncRedisReliableConsumer
+from redis_stream_transport import AsyncRedisStreamConsumer
+from retry_policy import RetryPolicy, CircuitBreaker
+from export_sinks import GraphiteSink, WebapiSink, PubSubSink
+from pubsub_publisher import StubPublisherClient
+from message_batch import decode_messages
+
+## functions
+class ParsedMessageCache:
+
+    # reader pushes the same bytes to every list, so each message is parsed once for all sinks
+    def __init__(self,max_size=10000):
+        self.max_size = max_size
+        self.messages = collections.OrderedDict()
+
+    def get(self,rmsg):
+        return self.get_batch([rmsg])[0]
+
+    def get_batch(self,rmsgs):
+        # cache misses of one read are decoded together
+        missing = [rmsg for rmsg in dict.fromkeys(rmsgs) if rmsg not in self.messages]
+        decoded = dict(zip(missing,decode_messages(missing)))
+        msg_objs = []
+        for rmsg in rmsgs:
+            msg_obj = self.messages.get(rmsg)
+            if msg_obj is None:
+                msg_obj = decoded[rmsg] or False
+                self.messages[rmsg] = msg_obj
+            else:
+                self.messages.move_to_end(rmsg)
+            msg_objs.append(msg_obj)
+        while len(self.messages) > self.max_size:
+            self.messages.popitem(last=False)
+        return msg_objs
+
+def load_json_configuration(file_name,name):
+    try:
+        with open(file_name,"r") as json_file:
+            configuration = json.load(json_file)
+        logging.info("{name} configuration loaded".format(name=name))
+        return configuration
+    except Exception:
+        logging.fatal("Cant load configuraion for {name}".format(name=name))
+        sys.exit(-1)
+
+def create_pubsub_publisher(cli_args):
+    if cli_args.pubsub_stub:
+        logging.info("Using local stub PubSub publisher")
+        return StubPublisherClient()
+
+    from google.oauth2 import service_account
+    from google.cloud import pubsub_v1
+
+    logging.info("Performing GCP Auth using {auth_file}".format(auth_file=cli_args.gcp_auth_json))
+    service_account_info = json.load(open(cli_args.gcp_auth_json))
+    credentials = service_account.Credentials.from_service_account_info(service_account_info)
+    batch_settings = pubsub_v1.types.BatchSettings(
+        max_messages=cli_args.pubsub_max_messages,
+        max_bytes=cli_args.pubsub_max_bytes,
+        max_latency=cli_args.pubsub_max_latency
+    )
+    return pubsub_v1.PublisherClient(batch_settings=batch_settings,credentials=credentials)
+
+def create_sinks(cli_args):
+    sinks = []
+    if "graphite" in cli_args.sink:
+        sinks.append(GraphiteSink(
+            load_json_configuration(cli_args.graphite_cfg_file,"graphite"),
+            timeout=cli_args.http_timeout,
+            gzip_threshold=cli_args.http_gzip_threshold,
+            concurrency=cli_args.graphite_concurrency,
+            aggregate_window=cli_args.graphite_aggregate_window,
+            aggregate_max_pending=cli_args.aggregate_max_pending
+        ))
+    if "webapi" in cli_args.sink:
+        sinks.append(WebapiSink(
+            load_json_configuration(cli_args.webapi_cfg_file,"webapi"),
+            batch_format=cli_args.webapi_batch_format,
+            timeout=cli_args.http_timeout,
+            gzip_threshold=cli_args.http_gzip_threshold,
+            concurrency=cli_args.webapi_concurrency,
+            aggregate_window=cli_args.webapi_aggregate_window,
+            aggregate_max_pending=cli_args.aggregate_max_pending
+        ))
+    if "pubsub" in cli_args.sink:
+        publisher = create_pubsub_publisher(cli_args)
+        sinks.append(PubSubSink(
+            publisher,
+            publisher.topic_path(cli_args.gcp_project,cli_args.pubsub_topic),
+            concurrency=cli_args.pubsub_concurrency,
+            envelope_size=cli_args.pubsub_envelope_size,
+            aggregate_window=cli_args.pubsub_aggregate_window,
+            aggregate_max_pending=cli_args.aggregate_max_pending
+        ))
+    return sinks
+
+async def sink_reader(sink,redis_consumer,sink_queue,message_cache,circuit_breaker,batch_linger):
+    while True:
+        # while circuit is open messages stay in Redis
+        if not circuit_breaker.allow_request():
+            await asyncio.sleep(circuit_breaker.get_wait_time())
+            continue
+
+        try:
+            rmsgs = await redis_consumer.read_batch(sink.batch_size,linger=batch_linger)
+            msg_batch = []
+            rmsg_batch = []
+            rmsg_skipped = []
+            for rmsg, msg_obj in zip(rmsgs,message_cache.get_batch(rmsgs)):
+                if msg_obj and sink.accepts(msg_obj):
+                    msg_batch.append(msg_obj)
+                    rmsg_batch.append(rmsg)
+                else:
+                    rmsg_skipped.append(rmsg)
+
+            await redis_consumer.ack(rmsg_skipped)
+            if sink.aggregator is not None:
+                # raw messages are folded into open windows and acked, closed windows are sent instead
+                for msg_obj in msg_batch:
+                    sink.aggregator.add(msg_obj)
+                await redis_consumer.ack(rmsg_batch)
+                msg_batch = sink.aggregator.collect()
+                rmsg_batch = [msg_obj.export_message_bytes() for msg_obj in msg_batch]
+            if len(msg_batch) > 0:
+                # bounded queue, a slow sink only holds back its own reader
+                await sink_queue.put((msg_batch,rmsg_batch))
+        except Exception:
+            logging.error("[{sink}] Error while reading from Redis".format(sink=sink.name))
+            logging.error(traceback.format_exc())
+            await asyncio.sleep(1)
+
+async def sink_worker(sink,redis_consumer,sink_queue,retry_policy,circuit_breaker):
+    while True:
+        msg_batch, rmsg_batch = await sink_queue.get()
+        try:
+            rmsg_failed = await sink.send_batch(msg_batch,rmsg_batch)
+        except Exception:
+            logging.error("[{sink}] Error during message publishing".format(sink=sink.name))
+            logging.error(traceback.format_exc())
+            rmsg_failed = rmsg_batch
+
+        try:
+            # consumers track messages by object identity, equal bytes may be different entries
+            rmsg_failed_ids = set([id(rmsg) for rmsg in rmsg_failed])
+            rmsg_sent = [rmsg for rmsg in rmsg_batch if id(rmsg) not in rmsg_failed_ids]
+            if sink.aggregator is not None:
+                # windows are not in Redis anymore, failed ones go back to aggregator
+                sink.aggregator.requeue([msg_obj for msg_obj, rmsg in zip(msg_batch,rmsg_batch) if id(rmsg) in rmsg_failed_ids])
+            else:
+                await redis_consumer.ack(rmsg_sent)
+
+            if len(rmsg_failed) > 0:
+                if sink.aggregator is None:
+                    await redis_consumer.requeue(rmsg_failed)
+                circuit_breaker.record_failure()
+                await asyncio.sleep(retry_policy.record_failure())
+            else:
+                logging.debug("[{sink}] Sent {count} messages".format(sink=sink.name,count=len(rmsg_sent)))
+                retry_policy.record_success()
+                circuit_breaker.record_success()
+        except Exception:
+            logging.error("[{sink}] Error while updating Redis".format(sink=sink.name))
+            logging.error(traceback.format_exc())
+        finally:
+            sink_queue.task_done()
+
+async def run_exporter(cli_args):
+    logging.info("Setting up Redis connection pool")
+    redis_pool = redis.asyncio.ConnectionPool(host=cli_args.redis_server,port=cli_args.redis_port,db=cli_args.redis_database)
+    redis_connection = redis.asyncio.Redis(connection_pool=redis_pool)
+    message_cache = ParsedMessageCache(max_size=cli_args.parse_cache_size)
+
+    sink_tasks = []
+    sinks = create_sinks(cli_args)
+    for sink in sinks:
+        if cli_args.transport == "stream":
+            # one consumer group per sink, named as the sink list so separate exporters can take over
+            redis_consumer = AsyncRedisStreamConsumer(redis_connection,cli_args.redis_stream,sink.redis_list,cli_args.consumer_name,block_timeout=cli_args.block_timeout,max_attempts=cli_args.max_attempts)
+        else:
+            redis_consumer = AsyncRedisReliableConsumer(redis_connection,sink.redis_list,cli_args.consumer_name,block_timeout=cli_args.block_timeout,max_attempts=cli_args.max_attempts)
+        recovered_count = await redis_consumer.recover_in_flight()
+        redis_list_length = await redis_consumer.get_queue_length()
+        logging.info("[{sink}] Statup: requeued from previous run: {count}, queue length: {llen}, workers: {workers}" \
+            .format(sink=sink.name,count=recovered_count,llen=redis_list_length,workers=sink.concurrency)
+        )
+
+        sink_queue = asyncio.Queue(maxsize=cli_args.sink_queue_size)
+        retry_policy = RetryPolicy(base_delay=cli_args.retry_base_delay,max_delay=cli_args.retry_max_delay)
+        circuit_breaker = CircuitBreaker(failure_threshold=cli_args.circuit_failure_threshold,reset_timeout=cli_args.circuit_reset_timeout)
+
+        sink_tasks.append(asyncio.create_task(sink_reader(sink,redis_consumer,sink_queue,message_cache,circuit_breaker,cli_args.batch_linger)))
+        for worker_number in range(sink.concurrency):
+            sink_tasks.append(asyncio.create_task(sink_worker(sink,redis_consumer,sink_queue,retry_policy,circuit_breaker)))
+
+    try:
+        await asyncio.gather(*sink_tasks)
+    finally:
+        for sink in sinks:
+            sink.close()
+
+## local defaults
+redis_server = "localhost"
+redis_port = 6379
+redis_database = 0
+redis_transport = "list"
+redis_stream = "metrics_stream"
+env_logger_file = "{homedir}/msg_exporter.log".format(homedir=os.path.expanduser("~"))
+graphite_cfg_file = "{homedir}/graphite_cfg.json".format(homedir=os.path.expanduser("~"))
+webapi_cfg_file = "{homedir}/webapi_cfg.json".format(homedir=os.path.expanduser("~"))
+env_gcp_topic_name = "iot-data"
+env_gcp_project_name = "data-integration-playground"
+env_gcp_auth_file = "{homedir}/data-integration-playground.json".format(homedir=os.path.expanduser("~"))
+export_sinks = ["graphite","webapi","pubsub"]
+consumer_name = socket.gethostname()
+max_attempts = 0
+aggregate_max_pending = 10000
+block_timeout = 30
+batch_linger = 5.0
+http_timeout = 30
+http_gzip_threshold = 0
+sink_queue_size = 4
+parse_cache_size = 10000
+pubsub_max_messages = 100
+pubsub_max_bytes = 1024*1024
+pubsub_max_latency = 0.05
+retry_base_delay = 1.0
+retry_max_delay = 300.0
+circuit_failure_threshold = 5
+circuit_reset_timeout = 30.0
+
+## CLI parser
+cli_parser = argparse.ArgumentParser(description='Script for exporting messages from redis queues to graphite, webapi and pubsub in one process')
+
+cli_parser.add_argument('--sink', action='store', type=str, nargs='+', required=False, default=export_sinks, choices=export_sinks,help="Sinks to run")
+cli_parser.add_argument('--graphite-cfg-file', action='store', type=str, required=False, default=graphite_cfg_file ,help="Graphite configuration in JSON file")
+cli_parser.add_argument('--webapi-cfg-file', action='store', type=str, required=False, default=webapi_cfg_file ,help="Webapi configuration in JSON file")
+cli_parser.add_argument('--webapi-batch-format', action='store', type=str, required=False, default=None, choices=["array","ndjson"],help="Send webapi messages in batches as JSON array or NDJSON")
+cli_parser.add_argument('--pubsub-topic', action='store', type=str, required=False, default=env_gcp_topic_name,help="GCP PubSub topic name")
+cli_parser.add_argument('--gcp-project', action='store', type=str, required=False, default=env_gcp_project_name,help="GCP Project name")
+cli_parser.add_argument('--gcp-auth-json', action='store', type=str, required=False, default=env_gcp_auth_file,help="GCP service account file")
+cli_parser.add_argument('--pubsub-envelope-size', action='store', type=int, required=False, default=0,help="Pack up to this many messages into one PubSub message as NDJSON envelope, 0 publishes each message alone")
+cli_parser.add_argument('--pubsub-max-messages', action='store', type=int, required=False, default=pubsub_max_messages,help="PubSub client batch setting: max messages in one request")
+cli_parser.add_argument('--pubsub-max-bytes', action='store', type=int, required=False, default=pubsub_max_bytes,help="PubSub client batch setting: max bytes in one request")
+cli_parser.add_argument('--pubsub-max-latency', action='store', type=float, required=False, default=pubsub_max_latency,help="PubSub client batch setting: max seconds to wait before sending a request")
+cli_parser.add_argument('--pubsub-stub', action='store_true', required=False, default=False,help="Use local stub instead of GCP PubSub (testing and benchmarks)")
+
+cli_parser.add_argument('--graphite-concurrency', action='store', type=int, required=False, default=GraphiteSink.default_concurrency,help="Number of graphite worker tasks")
+cli_parser.add_argument('--webapi-concurrency', action='store', type=int, required=False, default=WebapiSink.default_concurrency,help="Number of webapi worker tasks")
+cli_parser.add_argument('--pubsub-concurrency', action='store', type=int, required=False, default=PubSubSink.default_concurrency,help="Number of pubsub worker tasks")
+cli_parser.add_argument('--graphite-aggregate-window', action='store', type=int, required=False, default=0,help="Send graphite min/max/mean/last/count per window of this many seconds instead of raw messages, 0 sends raw")
+cli_parser.add_argument('--webapi-aggregate-window', action='store', type=int, required=False, default=0,help="Send webapi min/max/mean/last/count per window of this many seconds instead of raw messages, 0 sends raw")
+cli_parser.add_argument('--pubsub-aggregate-window', action='store', type=int, required=False, default=0,help="Send pubsub min/max/mean/last/count per window of this many seconds instead of raw messages, 0 sends raw. Window rows add interval, count, min_value, max_value and last_value fields, the BigQuery table needs these columns")
+cli_parser.add_argument('--aggregate-max-pending', action='store', type=int, required=False, default=aggregate_max_pending,help="Aggregated windows kept for retry by each sink while export fails, oldest are dropped above it (raw messages are already acked)")
+cli_parser.add_argument('--sink-queue-size', action='store', type=int, required=False, default=sink_queue_size,help="Max number of batches waiting for workers of one sink")
+cli_parser.add_argument('--parse-cache-size', action='store', type=int, required=False, default=parse_cache_size,help="Number of parsed messages shared between sinks")
+cli_parser.add_argument('--batch-linger', action='store', type=float, required=False, default=batch_linger,help="Max time in seconds to wait for a full batch before sending")
+cli_parser.add_argument('--http-timeout', action='store', type=float, required=False, default=http_timeout,help="Max time in seconds to wait for HTTP response")
+cli_parser.add_argument('--http-gzip-threshold', action='store', type=int, required=False, default=http_gzip_threshold,help="Gzip request bodies of at least this many bytes, 0 disables compression (default, endpoint has to accept gzip request bodies)")
+
+cli_parser.add_argument('--retry-base-delay', action='store', type=float, required=False, default=retry_base_delay,help="Delay in seconds after first publishing error, doubled on each next error")
+cli_parser.add_argument('--retry-max-delay', action='store', type=float, required=False, default=retry_max_delay,help="Max delay in seconds between publishing retries")
+cli_parser.add_argument('--circuit-failure-threshold', action='store', type=int, required=False, default=circuit_failure_threshold,help="Consecutive publishing errors after which publishing is paused")
+cli_parser.add_argument('--circuit-reset-timeout', action='store', type=float, required=False, default=circuit_reset_timeout,help="Seconds publishing stays paused before a probe is sent")
+
+cli_parser.add_argument('--redis-port', action='store', type=int, required=False, default=redis_port,help="Redis port to connect too")
+cli_parser.add_argument('--redis-server', action='store', type=str, required=False, default=redis_server,help="Redis server host address")
+cli_parser.add_argument('--redis-database', action='store', type=int, required=False, default=redis_database,help="On which Redis list I should work")
+cli_parser.add_argument('--transport', action='store', type=str, required=False, default=redis_transport, choices=["list","stream"],help="Read messages from Redis list per sink, or from Redis stream with consumer group per sink (stream needs Redis 6.2+)")
+cli_parser.add_argument('--redis-stream', action='store', type=str, required=False, default=redis_stream,help="Redis stream used with stream transport")
+cli_parser.add_argument('--block-timeout', action='store', type=int, required=False, default=block_timeout,help="Max time in seconds to block on empty Redis list")
+cli_parser.add_argument('--consumer-name', action='store', type=str, required=False, default=consumer_name,help="Name of this consumer, used for its Redis in-flight lists")
+cli_parser.add_argument('--max-attempts', action='store', type=int, required=False, default=max_attempts,help="Failed sends after which a message goes to dead letter list of its sink, 0 retries without limit")
+cli_parser.add_argument('--logger-file', action='store', type=str, required=False, default=env_logger_file,help="Debug messages to file")
+
+
+## main code
+if __name__ == '__main__':
+    # arguments are parsed here, so tests can import sink tasks without command line
+    cli_args = cli_parser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s %(levelname)s [%(threadName)10s]: %(message)s', datefmt='%Y/%m/%d %H:%M:%S', \
+        level=logging.DEBUG, \
+        filename =cli_args.logger_file \
+    )
+    logging.info("Setting up env")
+
+    asyncio.run(run_exporter(cli_args))
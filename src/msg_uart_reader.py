@@ -15,6 +15,12 @@ sys.path.append(os.path.abspath(os.path.dirname(__file__))+"/lib")
 
 # import message_object
 from message_object import MessageObject
+from serial_line_reader import SerialLineReader
+from radio_log_writer import RotatingLogWriter
+from spill_queue import SpillQueue
+from redis_outage_buffer import RedisOutageBuffer, redis_push_messages_list
+from message_deduplicator import MessageDeduplicator
+from redis_stream_transport import redis_stream_add_messages
 
 def redis_connection_open(host,port,database):
     redis_conn = redis.Redis(host=host,port=port,db=database)
@@ -32,42 +38,102 @@ def validate_deviceid_drop_list(device_id,drop_list):
         return True
     return False
 
-def write_message_to_storage(processing_queue,redis_lists):
+def decode_spilled_message(msg_bytes):
+    msg = MessageObject()
+    if not msg.create_message_from_json(msg_bytes.decode('utf-8')):
+        raise ValueError("Spilled message not valid: {err}".format(err=",".join(msg.get_validation_errors())))
+    return msg
+
+def redis_push_messages_stream(redis_pipeline,redis_stream,msgs):
+    return redis_stream_add_messages(redis_pipeline,redis_stream,msgs,maxlen=cli_args.redis_stream_maxlen)
+
+def get_messages_from_queue(processing_queue,batch_size,timeout=None):
+    try:
+        msgs = [processing_queue.get(timeout=timeout)]
+    except queue.Empty:
+        return []
+    while len(msgs) < batch_size:
+        try:
+            msgs.append(processing_queue.get_nowait())
+        except queue.Empty:
+            break
+    return msgs
+
+def write_message_to_storage(processing_queue,redis_lists,batch_size=100):
+    global msg_received_count
+
     while True:
-        msg = processing_queue.get()
-        msg_received_count =+ 1
+        # wake up at least once per group commit interval even when radio is quiet
+        msgs = get_messages_from_queue(processing_queue,batch_size,timeout=cli_args.logger_flush_interval)
+        msgs_bytes = []
+        msgs_redis_bytes = []
 
-        logging.debug("Processing {sensor_id}:{measurment_id}:{cycle}" \
-            .format(sensor_id=msg.get_device_id(),measurment_id=msg.get_measure_code(),cycle=msg.get_cycle_number())
-        )
+        try:
+            radio_log.commit_if_due()
+        except Exception:
+            traceback.print_exc()
+            logging.error(traceback.print_exc())
 
-        if validate_deviceid_drop_list(msg.get_device_id(),msg_drop_by_deviceid):
-            processing_queue.task_done()
+        if len(msgs) == 0:
             continue
 
+        msg_received_count_before = msg_received_count
+        for msg in msgs:
+            msg_received_count += 1
+
+            logging.debug("Processing {sensor_id}:{measurment_id}:{cycle}" \
+                .format(sensor_id=msg.get_device_id(),measurment_id=msg.get_measure_code(),cycle=msg.get_cycle_number())
+            )
+
+            if validate_deviceid_drop_list(msg.get_device_id(),msg_drop_by_deviceid):
+                continue
+
+            # serialized once, same bytes go to file and every redis list (file stays JSON with binary wire format)
+            try:
+                msg_bytes = msg.export_message_bytes()
+            except Exception:
+                logging.error("Message can not be serialized, skipping: {sensor_id}:{measurment_id}:{cycle}: {err}" \
+                    .format(sensor_id=msg.get_device_id(),measurment_id=msg.get_measure_code(),cycle=msg.get_cycle_number(),err=traceback.format_exc())
+                )
+                continue
+            msgs_bytes.append(msg_bytes)
+            if cli_args.wire_format == "binary":
+                try:
+                    msgs_redis_bytes.append(msg.export_message_binary())
+                except ValueError:
+                    # exporters detect format per message, so JSON can be mixed in
+                    msgs_redis_bytes.append(msg_bytes)
+
         # writing to file
         try:
-            radio_log.write("{msgd}\n".format(msgd=msg.export_message()))
+            for msg_bytes in msgs_bytes:
+                radio_log.write(msg_bytes)
 
-            if msg_received_count % 100 == 0:
+            if msg_received_count // 100 != msg_received_count_before // 100:
                 logging.info("Messages processed: {msg_c}".format(msg_c=msg_received_count))
-                radio_log.flush()
+                logging.info("Queue stats: {stats}".format(stats=processing_queue.get_stats()))
+                logging.info("Redis outage buffer stats: {stats}".format(stats=redis_outage_buffer.get_stats()))
+                if message_deduplicator is not None:
+                    logging.info("Deduplication stats: {stats}".format(stats=message_deduplicator.get_stats()))
 
         except Exception:
             traceback.print_exc()
             logging.error(traceback.print_exc())
 
-        # writing to redis
-        for r_list in redis_lists:
+        # writing to redis, lists which failed get the messages through local outage buffer
+        if cli_args.wire_format != "binary":
+            msgs_redis_bytes = msgs_bytes
+        if len(msgs_redis_bytes) > 0:
             try:
-                redis_writing_status = redis_write_message(msg=msg.export_message(),redis_conn=redis_connection,redis_list=r_list)
-                if redis_writing_status == False:
-                    logging.error("Problem with writing message to redis database")
+                redis_outage_buffer.write(redis_lists,msgs_redis_bytes)
             except Exception:
                 traceback.print_exc()
                 logging.error(traceback.print_exc())
 
-        processing_queue.task_done()
+        for msg in msgs:
+            processing_queue.task_done()
+        # batch is in Redis or outage buffer, spilled messages of it are not replayed after restart
+        processing_queue.commit()
 
 ####
 
@@ -75,13 +141,30 @@ redis_server = "localhost"
 redis_port = 6379
 redis_lists = ["metrics_pubsub","metrics_graphite","metrics_webapi"]
 redis_database = 0
+redis_transport = "list"
+redis_stream = "metrics_stream"
+redis_stream_maxlen = 1000000
+wire_format = "json"
 msg_logger_file = "{homedir}/radio_msg.log".format(homedir=os.path.expanduser("~"))
 msg_logger_debug = "{homedir}/msg_uart_reader.log".format(homedir=os.path.expanduser("~"))
 msg_received_count = 0
 msg_drop_by_deviceid = ["99"]
 uart_cfg_file = "{homedir}/uart_reader_cfg.json".format(homedir=os.path.expanduser("~"))
-
-messages_queue = queue.Queue()
+writer_batch_size = 100
+logger_max_bytes = 16*1024*1024
+logger_max_age = 24*3600
+logger_flush_count = 100
+logger_flush_interval = 1.0
+logger_max_segments = 0
+logger_max_total_bytes = 0
+queue_high_water_mark = 10000
+queue_spill_segment_size = 64*1024*1024
+outage_buffer_file = "{homedir}/uart_reader_outage.db".format(homedir=os.path.expanduser("~"))
+outage_replay_interval = 5
+outage_replay_batch_size = 500
+queue_spill_file = "{homedir}/uart_reader_spill.dat".format(homedir=os.path.expanduser("~"))
+dedupe_cache_size = 4096
+dedupe_max_age = 300
 
 # CLI parser
 cli_parser = argparse.ArgumentParser(description='Script for getting messages from RPI UART and putting them into redis database')
@@ -89,9 +172,30 @@ cli_parser = argparse.ArgumentParser(description='Script for getting messages fr
 cli_parser.add_argument('--redis-port', action='store', type=int, required=False, default=redis_port,help="Redis port to connect too")
 cli_parser.add_argument('--redis-server', action='store', type=str, required=False, default=redis_server,help="Redis server host address")
 cli_parser.add_argument('--redis-list', action='append', type=str, required=False, default=redis_lists,help="On which Redis list I should work")
+cli_parser.add_argument('--transport', action='store', type=str, required=False, default=redis_transport, choices=["list","stream"],help="Write every message to each Redis list, or once to Redis stream read by consumer groups")
+cli_parser.add_argument('--redis-stream', action='store', type=str, required=False, default=redis_stream,help="Redis stream used with stream transport")
+cli_parser.add_argument('--redis-stream-maxlen', action='store', type=int, required=False, default=redis_stream_maxlen,help="Approximate max number of entries kept in Redis stream, 0 disables trimming")
+cli_parser.add_argument('--wire-format', action='store', type=str, required=False, default=wire_format, choices=["json","binary"],help="Format of messages written to Redis, exporters detect it on their own")
 cli_parser.add_argument('--redis-database', action='store', type=int, required=False, default=redis_database,help="On which Redis list I should work")
 cli_parser.add_argument('--logger-file', action='store', type=str, required=False, default=msg_logger_file,help="Name of the file to store data (beside Redis)")
+cli_parser.add_argument('--logger-max-bytes', action='store', type=int, required=False, default=logger_max_bytes,help="Rotate data file after it reaches this size in bytes")
+cli_parser.add_argument('--logger-max-age', action='store', type=int, required=False, default=logger_max_age,help="Rotate data file after this many seconds")
+cli_parser.add_argument('--logger-flush-count', action='store', type=int, required=False, default=logger_flush_count,help="Flush data file after this many messages")
+cli_parser.add_argument('--logger-flush-interval', action='store', type=float, required=False, default=logger_flush_interval,help="Flush data file at least every this many seconds")
+cli_parser.add_argument('--logger-fsync', action='store_true', required=False, default=False,help="Call fsync on every data file flush")
+cli_parser.add_argument('--logger-max-segments', action='store', type=int, required=False, default=logger_max_segments,help="Keep at most this many rotated data file segments, oldest are removed (0 keeps all)")
+cli_parser.add_argument('--logger-max-total-bytes', action='store', type=int, required=False, default=logger_max_total_bytes,help="Keep rotated data file segments within this many bytes in total, oldest are removed (0 keeps all)")
+cli_parser.add_argument('--logger-compression', action='store', type=str, required=False, default=None, choices=["gzip","zstd"],help="Compress rotated data file segments")
 cli_parser.add_argument('--logger-debug',action='store', type=str, required=False, default=msg_logger_debug, help="File with internal debug and other logs")
+cli_parser.add_argument('--writer-batch-size', action='store', type=int, required=False, default=writer_batch_size,help="Max number of queued messages written to Redis in one round trip")
+cli_parser.add_argument('--queue-high-water-mark', action='store', type=int, required=False, default=queue_high_water_mark,help="Max number of messages kept in memory, above it messages are spilled to disk")
+cli_parser.add_argument('--queue-spill-file', action='store', type=str, required=False, default=queue_spill_file,help="File for messages spilled from memory queue")
+cli_parser.add_argument('--queue-spill-segment-size', action='store', type=int, required=False, default=queue_spill_segment_size,help="Spill file segment size in bytes, segments are deleted once all their messages are stored")
+cli_parser.add_argument('--outage-buffer-file', action='store', type=str, required=False, default=outage_buffer_file,help="SQLite file buffering messages while Redis is not available")
+cli_parser.add_argument('--outage-replay-interval', action='store', type=float, required=False, default=outage_replay_interval,help="Seconds between attempts to replay buffered messages to Redis")
+cli_parser.add_argument('--outage-replay-batch-size', action='store', type=int, required=False, default=outage_replay_batch_size,help="Max number of buffered messages replayed to Redis in one round trip")
+cli_parser.add_argument('--dedupe-cache-size', action='store', type=int, required=False, default=dedupe_cache_size,help="Number of recent device/cycle/measure keys kept to drop retransmitted messages, 0 disables deduplication")
+cli_parser.add_argument('--dedupe-max-age', action='store', type=float, required=False, default=dedupe_max_age,help="Seconds after which same device/cycle/measure key is a new message (cycle counter wraps)")
 cli_parser.add_argument('--cfg-file', action='store', type=str, required=False, default=uart_cfg_file ,help="Graphite configuration in JSON file")
 
 cli_args = cli_parser.parse_args()
@@ -127,19 +231,74 @@ if __name__ == '__main__':
     logging.info("Setting up Redis connection")
     redis_connection = redis_connection_open(host=cli_args.redis_server,port=cli_args.redis_port,database=cli_args.redis_database)
 
+    if cli_args.redis_stream_maxlen == 0:
+        cli_args.redis_stream_maxlen = None
+    if cli_args.transport == "stream":
+        logging.info("Using Redis stream {r_stream} as transport".format(r_stream=cli_args.redis_stream))
+        redis_targets = [cli_args.redis_stream]
+        redis_push_messages = redis_push_messages_stream
+    else:
+        redis_targets = cli_args.redis_list
+        redis_push_messages = redis_push_messages_list
+
+    logging.info("Setting up Redis outage buffer")
+    redis_outage_buffer = RedisOutageBuffer(
+        cli_args.outage_buffer_file,
+        redis_connection,
+        replay_batch_size=cli_args.outage_replay_batch_size,
+        replay_interval=cli_args.outage_replay_interval,
+        push_messages=redis_push_messages
+    )
+    logging.info("Messages buffered by previous run to replay: {count}".format(count=redis_outage_buffer.get_pending_count()))
+    redis_outage_buffer.start_replay_thread()
+
     logging.info("Setting up local file for writing")
-    radio_log = open(cli_args.logger_file,'a')
+    radio_log = RotatingLogWriter(
+        cli_args.logger_file,
+        max_bytes=cli_args.logger_max_bytes,
+        max_age=cli_args.logger_max_age,
+        flush_count=cli_args.logger_flush_count,
+        flush_interval=cli_args.logger_flush_interval,
+        fsync=cli_args.logger_fsync,
+        compression=cli_args.logger_compression,
+        max_segments=cli_args.logger_max_segments,
+        max_total_bytes=cli_args.logger_max_total_bytes
+    )
+
+    logging.info("Setting up message queue")
+    messages_queue = SpillQueue(
+        cli_args.queue_spill_file,
+        encode=lambda msg: msg.export_message_bytes(),
+        decode=decode_spilled_message,
+        high_water_mark=cli_args.queue_high_water_mark,
+        segment_max_bytes=cli_args.queue_spill_segment_size
+    )
+    if messages_queue.qsize() > 0:
+        logging.info("Messages spilled by previous run to replay: {count}".format(count=messages_queue.qsize()))
+
+    message_deduplicator = None
+    if cli_args.dedupe_cache_size > 0:
+        message_deduplicator = MessageDeduplicator(max_size=cli_args.dedupe_cache_size,max_age=cli_args.dedupe_max_age)
 
     logging.info("Setting up threads")
-    thread_msg_writer = threading.Thread(name="msgWriter", target=write_message_to_storage, args=(messages_queue,cli_args.redis_list))
+    thread_msg_writer = threading.Thread(name="msgWriter", target=write_message_to_storage, args=(messages_queue,redis_targets,cli_args.writer_batch_size))
     thread_msg_writer.setDaemon(True)
     thread_msg_writer.start()
 
     logging.info("Reading messages from serial in loop")
+    serial_reader = SerialLineReader(serial_proxy)
     while True:
-        if serial_proxy.in_waiting > 0:
+        try:
+            raw_lines = serial_reader.read_lines()
+        except Exception:
+            raw_lines = []
+            traceback.print_exc()
+            logging.error(traceback.print_exc())
+            time.sleep(1)
+
+        for raw_line in raw_lines:
             try:
-                line = serial_proxy.readline().decode('ascii').strip()
+                line = raw_line.decode('ascii').strip()
                 logging.info("RAW MSG received: {msg}".format(msg=line))
 
                 if MessageObject.detect_version(line):
@@ -148,6 +307,11 @@ if __name__ == '__main__':
 
                     # put message to queue for further processing
                     if msg.validate() == True:
+                        if message_deduplicator is not None and message_deduplicator.is_duplicate(msg):
+                            logging.debug("Duplicate dropped: {sensor_id}:{measurment_id}:{cycle}" \
+                                .format(sensor_id=msg.get_device_id(),measurment_id=msg.get_measure_code(),cycle=msg.get_cycle_number())
+                            )
+                            continue
                         messages_queue.put(msg)
                         logging.debug("Message queued: {sensor_id}:{measurment_id}:{cycle}" \
                             .format(sensor_id=msg.get_device_id(),measurment_id=msg.get_measure_code(),cycle=msg.get_cycle_number())
@@ -161,7 +325,8 @@ if __name__ == '__main__':
                 logging.error(traceback.print_exc())
 
     messages_queue.join()
+    messages_queue.close()
+    redis_outage_buffer.close()
     redis_connection_close(redis_connection)
-    radio_log.flush()
     radio_log.close()
     
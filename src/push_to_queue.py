@@ -6,11 +6,15 @@ import logging
 import traceback
 import sys,os
 import datetime
+import time
+import multiprocessing
 
 sys.path.append(os.path.abspath(os.path.dirname(__file__))+"/lib")
 
 # import message_object
 from message_object import MessageObject
+from message_batch import numpy
+from bulk_loader import open_input_file, get_input_ranges, read_line_chunks, get_valid_messages
 
 
 def redis_connection_open(host,port,database):
@@ -24,12 +28,66 @@ def redis_connection_close(redis):
 def redis_write_message(msg,redis_conn,redis_list):
     return redis_conn.lpush(redis_list, msg)
 
+def bulk_load_range(start_offset,end_offset):
+    worker_name = multiprocessing.current_process().name
+    redis_connection = redis_connection_open(host=cli_args.redis_server,port=cli_args.redis_port,database=cli_args.redis_database)
+    stats = {"lines": 0, "valid": 0, "invalid": 0, "pushed": 0}
+    offset = start_offset
+    progress_time = time.time()
+    started = progress_time
+
+    with open_input_file(cli_args.json_file) as input_file:
+        for lines, chunk_end_offset in read_line_chunks(input_file,cli_args.chunk_size,start_offset,end_offset):
+            try:
+                msgs, records_count = get_valid_messages(lines,cli_args.wire_format)
+                redis_pipeline = redis_connection.pipeline(transaction=False)
+                for msgs_start in range(0,len(msgs),cli_args.push_size):
+                    redis_pipeline.lpush(cli_args.redis_list,*msgs[msgs_start:msgs_start+cli_args.push_size])
+                redis_pipeline.execute()
+            except Exception:
+                # everything before offset is in Redis already, range of this worker ends at end_offset
+                resume_args = "--start-offset {offset}".format(offset=offset)
+                if end_offset is not None:
+                    resume_args += " --end-offset {end_offset}".format(end_offset=end_offset)
+                logging.error("[{worker}] Loading chunk failed, resume with {resume_args}".format(worker=worker_name,resume_args=resume_args))
+                raise
+            stats["lines"] += records_count
+            stats["valid"] += len(msgs)
+            stats["invalid"] += records_count - len(msgs)
+            stats["pushed"] += len(msgs)
+            offset = chunk_end_offset
+
+            now = time.time()
+            if now - progress_time >= cli_args.progress_interval:
+                progress_time = now
+                logging.info("[{worker}] Progress: {stats}, offset {offset}, {rate:.0f} lines/s" \
+                    .format(worker=worker_name,stats=stats,offset=offset,rate=stats["lines"]/(now-started))
+                )
+
+    logging.info("[{worker}] Finished range {start}-{end}: {stats}, offset {offset}".format(worker=worker_name,start=start_offset,end=end_offset,stats=stats,offset=offset))
+    return stats
+
+def bulk_load():
+    input_ranges = get_input_ranges(cli_args.json_file,cli_args.start_offset,cli_args.end_offset,cli_args.workers)
+    if numpy is None:
+        logging.info("numpy not available, messages are validated one by one")
+    if len(input_ranges) == 1:
+        return bulk_load_range(*input_ranges[0])
+
+    logging.info("Loading {count} ranges in worker processes: {ranges}".format(count=len(input_ranges),ranges=input_ranges))
+    with multiprocessing.Pool(len(input_ranges)) as worker_pool:
+        ranges_stats = worker_pool.starmap(bulk_load_range,input_ranges)
+    return {key: sum([range_stats[key] for range_stats in ranges_stats]) for key in ranges_stats[0]}
+
 ####
 
 redis_server = "localhost"
 redis_port = 6379
 redis_list = "metrics_pubsub"
 redis_database = 0
+chunk_size = 5000
+push_size = 1000
+progress_interval = 10
 msg_logger_debug = "{homedir}/json_loader.{dt}.log".format(homedir=os.path.expanduser("~"),dt=datetime.datetime.now().strftime('%Y%m%d_%H%M'))
 
 # CLI parser
@@ -40,6 +98,14 @@ cli_parser.add_argument('--redis-server', action='store', type=str, required=Fal
 cli_parser.add_argument('--redis-list', action='store', type=str, required=False, default=redis_list,help="On which Redis list I should work")
 cli_parser.add_argument('--redis-database', action='store', type=int, required=False, default=redis_database,help="On which Redis list I should work")
 cli_parser.add_argument('--json-file', action='store', type=str, required=True, help="File with JSONs to insert into Redis")
+cli_parser.add_argument('--bulk', action='store_true', required=False, default=False,help="Load file in chunks with batch validation and pipelined multi-value LPUSH")
+cli_parser.add_argument('--chunk-size', action='store', type=int, required=False, default=chunk_size,help="Bulk mode: number of lines read and validated at once")
+cli_parser.add_argument('--push-size', action='store', type=int, required=False, default=push_size,help="Bulk mode: max number of messages in one LPUSH")
+cli_parser.add_argument('--progress-interval', action='store', type=float, required=False, default=progress_interval,help="Bulk mode: seconds between progress reports")
+cli_parser.add_argument('--start-offset', action='store', type=int, required=False, default=0,help="Bulk mode: byte offset to start from (resume), uncompressed offset for gzip files")
+cli_parser.add_argument('--end-offset', action='store', type=int, required=False, default=None,help="Bulk mode: byte offset to stop at, lines starting before it are loaded")
+cli_parser.add_argument('--workers', action='store', type=int, required=False, default=1,help="Bulk mode: number of worker processes, each loads its own part of uncompressed file")
+cli_parser.add_argument('--wire-format', action='store', type=str, required=False, default="json", choices=["json","binary"],help="Bulk mode: format of messages written to Redis")
 cli_parser.add_argument('--logger-debug',action='store', type=str, required=False, default=msg_logger_debug, help="File with internal debug and other logs")
 
 cli_args = cli_parser.parse_args()
@@ -56,6 +122,15 @@ logging.basicConfig(
 logging.info("Setting up env")
 
 if __name__ == '__main__':
+    if cli_args.bulk:
+        logging.info("Bulk loading {file_name}".format(file_name=cli_args.json_file))
+        try:
+            logging.info("Bulk load finished: {stats}".format(stats=bulk_load()))
+        except Exception:
+            logging.error(traceback.format_exc())
+            sys.exit(1)
+        sys.exit(0)
+
     # open redis communication
     logging.info("Setting up Redis connection")
     redis_connection = redis_connection_open(host=cli_args.redis_server,port=cli_args.redis_port,database=cli_args.redis_database)
@@ -1,59 +1,167 @@
 from google.cloud import bigquery
 import base64, json, sys, os
+import struct
 import datetime
 import traceback
 
+def get_env_flag(name):
+    # flags come as strings, "0" or "false" must not turn them on
+    return os.environ.get(name,"") in ("1","true","True")
+
 env_bq_table_name = "iot_base_data"
 env_bq_dataset = "iot_data"
-env_debug = False
+env_debug = get_env_flag('ENV_DEBUG')
+env_bq_ignore_unknown = get_env_flag('ENV_BQ_IGNORE_UNKNOWN')
 
 if 'ENV_BQ_TABLE' in os.environ:
     env_bq_table_name = os.environ['ENV_BQ_TABLE']
-    
+
 if 'ENV_BQ_DATASET' in os.environ:
     env_bq_dataset = os.environ['ENV_BQ_DATASET']
 
-if 'ENV_DEBUG' in os.environ:
-    env_debug = os.environ['ENV_DEBUG'] 
-    
+# envelope with many messages from edge exporter, recognised by PubSub attributes
+envelope_schema_ndjson = "iot_msg_ndjson"
+envelope_schema_binary = "iot_msg_binary"
+
+# binary wire format v1, same layout as MessageObject.binary_struct on the edge
+binary_magic = 0xB1
+binary_struct = struct.Struct("<Bd2s1sdIHB")
+measure_names = {
+    "1": "MSGC_TEMPERATURE",
+    "2": "MSGC_HUMIDITY",
+    "3": "MSGC_BATTERY_VOLTAGE",
+    "4": "MSGC_TEMP_SENSOR_ERROR",
+    "5": "MSGC_ALL_MESSAGES_SUCCESS",
+    "6": "MSGC_ALL_SENDING_TRIALS",
+    "7": "MSGC_AVG_CYCLE_LENGTH",
+    "8": "MSGC_DELIVERY_RATIO",
+    "9": "MSGC_RETRANSMISSIONS",
+    "a": "MSGC_ACCU_VOLTAGE",
+    "b": "MSGC_ID_1",
+    "c": "MSGC_ID_2",
+    "d": "MSGC_ID_3",
+    "e": "MSGC_ID_4",
+    "f": "MSGC_STARTUP_CODE"
+}
+
+# client and table (with schema) live as long as the warm instance
+bq_client = None
+bq_destination_table = None
 
 def debug_me(msg):
-    if env_debug == 1:
+    if env_debug:
         print(msg)
 
 def prepare_data(event):
     dst_event = event
     if 'timestamp' in dst_event:
         msg_timestamp = dst_event.pop("timestamp")
-        dst_event['event_timestamp'] = datetime.datetime.fromtimestamp(msg_timestamp)
+        # insert_rows_json takes JSON values only
+        dst_event['event_timestamp'] = datetime.datetime.fromtimestamp(msg_timestamp,tz=datetime.timezone.utc).isoformat()
     else:
         return "Unknown data", 417
     return dst_event
 
-def insert_into_bigquery(event):
-    try:
+def get_destination_table():
+    global bq_client, bq_destination_table
+    if bq_destination_table is None:
         bq_client = bigquery.Client()
-        bq_client_dataset = bq_client.dataset(env_bq_dataset)
-        bq_client_table = bq_client_dataset.table(env_bq_table_name)
+        bq_client_table = bq_client.dataset(env_bq_dataset).table(env_bq_table_name)
         bq_destination_table = bq_client.get_table(bq_client_table)
-        result = bq_client.insert_rows(bq_destination_table, [event])
-        if result != []:
-            debug_me(result)
+    return bq_client, bq_destination_table
+
+def insert_into_bigquery(events):
+    global bq_client, bq_destination_table
+    try:
+        client, destination_table = get_destination_table()
+        # one streaming insert for the whole payload
+        result = client.insert_rows_json(destination_table, events, ignore_unknown_values=env_bq_ignore_unknown)
     except Exception:
+        # table could be recreated meanwhile, next invocation fetches it again
+        bq_client = None
+        bq_destination_table = None
         print("Error while message inserting")
-        debug_me(traceback.print_exc())
+        debug_me(traceback.format_exc())
+        return "insert error", 424
+    if result != []:
+        # rejected rows fail the whole insert, PubSub delivers the message again
+        print("BigQuery rejected {count} of {total} rows".format(count=len(result),total=len(events)))
+        debug_me(result)
         return "insert error", 424
 
+def decode_binary_messages(pubsub_src_data):
+    # one bad record is skipped, the rest of the envelope is still inserted
+    events = []
+    records_count = len(pubsub_src_data) // binary_struct.size
+    if len(pubsub_src_data) % binary_struct.size != 0:
+        print("Skipping {count} trailing bytes of binary envelope".format(count=len(pubsub_src_data) % binary_struct.size))
+    for record_offset in range(0,records_count * binary_struct.size,binary_struct.size):
+        magic, timestamp, device_id, measure_code, measure_value, cycle_number, location_id, version = binary_struct.unpack_from(pubsub_src_data,record_offset)
+        try:
+            if magic != binary_magic:
+                raise ValueError("Unknown binary message format {magic}".format(magic=magic))
+            device_id = device_id.decode('ascii')
+            measure_code = measure_code.decode('ascii')
+        except (ValueError,UnicodeDecodeError) as e:
+            print("Skipping binary message at offset {offset}: {err}".format(offset=record_offset,err=e))
+            continue
+        events.append({
+            "timestamp": timestamp,
+            "device_id": device_id,
+            "measure_code": measure_code,
+            "measure_value": measure_value,
+            "measure_name": measure_names.get(measure_code),
+            "cycle_number": cycle_number,
+            "version": version,
+            "location_id": location_id
+        })
+    return events
+
+def decode_ndjson_messages(pubsub_src_message):
+    events = []
+    for line in pubsub_src_message.splitlines():
+        if not line.strip():
+            continue
+        try:
+            events.append(json.loads(line))
+        except ValueError as e:
+            print("Skipping NDJSON message: {err}".format(err=e))
+    return events
+
+def get_events(pubsub_src_data,attributes=None):
+    schema = (attributes or {}).get('schema')
+    if schema == envelope_schema_binary or (schema is None and pubsub_src_data[:1] == bytes([binary_magic])):
+        return decode_binary_messages(pubsub_src_data)
+
+    if schema == envelope_schema_ndjson:
+        return decode_ndjson_messages(pubsub_src_data.decode('utf-8',errors='replace'))
+
+    pubsub_src_message = pubsub_src_data.decode('utf-8')
+
+    # older edge nodes send single message object, or JSON array of messages
+    events = json.loads(pubsub_src_message)
+    if isinstance(events,dict):
+        return [events]
+    return events
+
 def pubsub_to_bigq(event, context):
     try:
         # get data from pubsub message
-        pubsub_src_message = base64.b64decode(event['data']).decode('utf-8')
-        debug_me("Source msg: {}".format(pubsub_src_message))
+        pubsub_src_data = base64.b64decode(event['data'])
+        debug_me("Source msg: {}".format(pubsub_src_data))
         # convert source data into BQ row format
-        event_data = prepare_data(json.loads(pubsub_src_message))
+        events_data = []
+        for src_event in get_events(pubsub_src_data,event.get('attributes')):
+            event_data = prepare_data(src_event)
+            if isinstance(event_data,dict):
+                events_data.append(event_data)
+            else:
+                print("Skipping message without timestamp")
     except Exception:
         print("Error while preparing message")
-        debug_me(traceback.print_exc())
+        debug_me(traceback.format_exc())
         return "Data error", 422
+    if len(events_data) == 0:
+        return "Unknown data", 417
     # insert data into BigQuery
-    insert_into_bigquery(event_data)
+    return insert_into_bigquery(events_data)
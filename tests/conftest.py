@@ -0,0 +1,20 @@
+import os
+import sys
+
+# scripts import shared modules from src/lib the same way
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),"..","src","lib"))
+
+import pytest
+
+from local_redis import LocalRedis, redis_server_bin
+
+@pytest.fixture
+def local_redis(tmp_path):
+    pytest.importorskip("redis")
+    if redis_server_bin is None:
+        pytest.skip("redis-server binary not found")
+    local_redis = LocalRedis(tmp_path)
+    local_redis.start()
+    yield local_redis
+    if local_redis.process.poll() is None:
+        local_redis.kill()
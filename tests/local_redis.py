@@ -0,0 +1,44 @@
+import os
+import time
+import shutil
+import socket
+import subprocess
+
+# real server for tests, they are skipped when there is no redis-server binary
+redis_server_bin = os.environ.get("REDIS_SERVER_BIN") or shutil.which("redis-server")
+
+def get_free_port():
+    with socket.socket() as free_socket:
+        free_socket.bind(("127.0.0.1",0))
+        return free_socket.getsockname()[1]
+
+class LocalRedis:
+
+    def __init__(self,data_dir):
+        self.data_dir = data_dir
+        self.port = get_free_port()
+        self.process = None
+
+    def start(self):
+        import redis
+        # append only file with fsync on every write, acknowledged pushes survive kill
+        self.process = subprocess.Popen([redis_server_bin,"--port",str(self.port),"--bind","127.0.0.1","--dir",str(self.data_dir),"--save","","--appendonly","yes","--appendfsync","always"],stdout=subprocess.DEVNULL,stderr=subprocess.DEVNULL)
+        redis_conn = redis.Redis(host="127.0.0.1",port=self.port)
+        for i in range(100):
+            try:
+                redis_conn.ping()
+                return
+            except redis.exceptions.ConnectionError:
+                time.sleep(0.05)
+        raise RuntimeError("redis-server did not start")
+
+    def kill(self):
+        self.process.kill()
+        self.process.wait()
+
+    def connect(self,**kwargs):
+        import redis
+        from redis.retry import Retry
+        from redis.backoff import NoBackoff
+        # client does not retry by itself, callers decide what to do on errors
+        return redis.Redis(host="127.0.0.1",port=self.port,socket_timeout=1,socket_connect_timeout=1,retry=Retry(NoBackoff(),0),**kwargs)
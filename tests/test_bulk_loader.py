@@ -0,0 +1,89 @@
+import io
+import json
+
+import pytest
+
+import bulk_loader
+from message_object import MessageObject
+
+def get_record(**fields):
+    msg = {"timestamp": 1700000000.5, "device_id": "01", "measure_code": "1", "measure_value": 21.5, "cycle_number": 17, "location_id": 101, "version": 1}
+    msg.update(fields)
+    for key, value in list(msg.items()):
+        if value is None:
+            del msg[key]
+    return json.dumps(msg).encode('utf-8')
+
+valid_records = [
+    get_record(),
+    get_record(cycle_number=0,measure_value=-3.25),
+    MessageObject("013-3.25|17").export_message_binary()
+]
+invalid_records = [
+    get_record(timestamp=None),
+    get_record(measure_value=float("nan")),
+    get_record(cycle_number="abc"),
+    get_record(cycle_number=-1),
+    get_record(device_id="001"),
+    get_record(measure_code="z"),
+    b"garbage",
+    b'{"x": 1}'
+]
+
+@pytest.fixture(params=["fallback","numpy"])
+def validation_path(request,monkeypatch):
+    if request.param == "numpy":
+        pytest.importorskip("numpy")
+    else:
+        monkeypatch.setattr(bulk_loader,"numpy",None)
+    return request.param
+
+@pytest.mark.parametrize("wire_format",["json","binary"])
+def test_valid_and_invalid_records(validation_path,wire_format):
+    lines = [record + b"\n" for record in valid_records[:2] + invalid_records]
+    msgs, records_count = bulk_loader.get_valid_messages(lines,wire_format)
+    assert records_count == 2 + len(invalid_records)
+    assert len(msgs) == 2
+
+    for msg_bytes in msgs:
+        msg = MessageObject()
+        assert msg.create_message_from_bytes(msg_bytes)
+        assert MessageObject.is_binary_message(msg_bytes) == (wire_format == "binary")
+
+def test_binary_record_accepted(validation_path):
+    msgs, records_count = bulk_loader.get_valid_messages([valid_records[2]],"binary")
+    assert msgs == [valid_records[2]]
+
+def test_line_ranges_cover_file_once():
+    data = b"".join([b"line%d\n" % i for i in range(1000)])
+    lines = []
+    range_size = 997
+    for start_offset in range(0,len(data),range_size):
+        input_file = io.BytesIO(data)
+        for chunk, offset in bulk_loader.read_line_chunks(input_file,7,start_offset,min(len(data),start_offset+range_size)):
+            lines.extend(chunk)
+    assert b"".join(lines) == data
+
+def test_resume_from_offset_inside_line():
+    data = b"aaaa\nbbbb\ncccc\n"
+    chunks = list(bulk_loader.read_line_chunks(io.BytesIO(data),10,start_offset=7))
+    assert chunks == [([b"cccc\n"],len(data))]
+
+def test_gzip_input(tmp_path):
+    import gzip
+    file_name = str(tmp_path / "radio_msg.log.gz")
+    with gzip.open(file_name,"wb") as gzip_file:
+        gzip_file.write(b"a\nb\nc\n")
+    assert bulk_loader.get_input_ranges(file_name,0,None,4) == [(0,None)]
+    with bulk_loader.open_input_file(file_name) as input_file:
+        assert list(bulk_loader.read_line_chunks(input_file,10,start_offset=2)) == [([b"b\n",b"c\n"],6)]
+
+def test_json_wire_format_pushes_exported_messages(validation_path):
+    # binary input and JSON without measure name come out as the reader writes them
+    records = [get_record(),valid_records[2]]
+    msgs, records_count = bulk_loader.get_valid_messages(records,"json")
+    for record, msg_bytes in zip(records,msgs):
+        msg = MessageObject()
+        assert msg.create_message_from_bytes(record)
+        assert msg_bytes == msg.export_message_bytes()
+        assert json.loads(msg_bytes)["measure_name"] == msg.get_measure_name()
@@ -0,0 +1,56 @@
+import base64
+import json
+import os
+import sys
+
+import pytest
+
+pytest.importorskip("google.cloud.bigquery")
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),"..","src_cf"))
+
+import main as cf_main
+
+def pack_record(device_id=b"01",measure_code=b"1",magic=cf_main.binary_magic):
+    return cf_main.binary_struct.pack(magic,1700000000.5,device_id,measure_code,21.5,17,101,1)
+
+def test_binary_envelope_skips_bad_records():
+    envelope = pack_record() + pack_record(device_id=b"\xff\xfe") + pack_record(magic=0x01) + pack_record(measure_code=b"2") + b"\xb1\x00"
+    events = cf_main.get_events(envelope,{"schema": cf_main.envelope_schema_binary})
+    assert [event["measure_name"] for event in events] == ["MSGC_TEMPERATURE","MSGC_HUMIDITY"]
+    assert events[0]["device_id"] == "01"
+
+def test_ndjson_envelope_skips_bad_lines():
+    envelope = b"\n".join([json.dumps({"device_id": "01"}).encode(),b"{broken",b"",json.dumps({"device_id": "02"}).encode()])
+    events = cf_main.get_events(envelope,{"schema": cf_main.envelope_schema_ndjson})
+    assert [event["device_id"] for event in events] == ["01","02"]
+
+class FakeBigQueryClient:
+
+    def __init__(self,row_errors):
+        self.row_errors = row_errors
+        self.inserted = []
+
+    def insert_rows_json(self,table,rows,ignore_unknown_values=False):
+        self.inserted.extend(rows)
+        return self.row_errors
+
+def get_pubsub_event(msgs):
+    return {"data": base64.b64encode(json.dumps(msgs).encode()), "attributes": {}}
+
+def test_row_errors_return_424(monkeypatch):
+    bq_client = FakeBigQueryClient([{"index": 0, "errors": [{"reason": "invalid"}]}])
+    monkeypatch.setattr(cf_main,"get_destination_table",lambda: (bq_client,None))
+    assert cf_main.pubsub_to_bigq(get_pubsub_event([{"timestamp": 1700000000.5, "device_id": "01"}]),None) == ("insert error",424)
+
+    bq_client.row_errors = []
+    assert cf_main.pubsub_to_bigq(get_pubsub_event([{"timestamp": 1700000000.5, "device_id": "01"}]),None) is None
+    assert bq_client.inserted[-1]["event_timestamp"].startswith("2023-11-14")
+
+@pytest.mark.parametrize("value,enabled",[("1",True),("true",True),("0",False),("false",False),(None,False)])
+def test_env_flag(monkeypatch,value,enabled):
+    if value is None:
+        monkeypatch.delenv("ENV_DEBUG",raising=False)
+    else:
+        monkeypatch.setenv("ENV_DEBUG",value)
+    assert cf_main.get_env_flag("ENV_DEBUG") == enabled
@@ -0,0 +1,98 @@
+import asyncio
+import json
+
+import pytest
+
+pytest.importorskip("requests")
+
+from export_sinks import WebapiSink, webapi_send_messages
+from message_object import MessageObject
+
+class FakeResponse:
+
+    def __init__(self,status_code):
+        self.status_code = status_code
+        self.ok = status_code < 400
+        self.text = "status {code}".format(code=status_code)
+
+class FakeHttpClient:
+
+    # responds with status from get_status for each body, records bodies sent
+    def __init__(self,get_status):
+        self.get_status = get_status
+        self.posts = []
+
+    def post_data(self,body,content_type='application/json'):
+        self.posts.append(body)
+        return FakeResponse(self.get_status(body))
+
+    def close(self):
+        pass
+
+def get_messages(count):
+    msg_objs = [MessageObject("011{value}|{cycle}".format(value=20+i,cycle=i)) for i in range(count)]
+    return msg_objs, [msg_obj.export_message_bytes() for msg_obj in msg_objs]
+
+def get_cycles(body):
+    msgs = json.loads(body)
+    if isinstance(msgs,dict):
+        return [msgs["cycle_number"]]
+    return [msg["cycle_number"] for msg in msgs]
+
+def test_batch_sent_in_one_request():
+    msg_objs, rmsgs = get_messages(4)
+    http_client = FakeHttpClient(lambda body: 200)
+    assert webapi_send_messages(msg_objs,rmsgs,http_client,"array") == (rmsgs,[],[],"array")
+    assert len(http_client.posts) == 1
+
+def test_too_large_batch_is_halved_and_retried():
+    msg_objs, rmsgs = get_messages(8)
+    http_client = FakeHttpClient(lambda body: 413 if len(get_cycles(body)) > 2 else 200)
+    rmsg_sent, rmsg_failed, rmsg_rejected, batch_format = webapi_send_messages(msg_objs,rmsgs,http_client,"array")
+    assert rmsg_sent == rmsgs
+    assert batch_format == "array"
+    assert [get_cycles(body) for body in http_client.posts if len(get_cycles(body)) <= 2] == [[0,1],[2,3],[4,5],[6,7]]
+
+def test_bad_request_falls_back_to_single_messages_for_this_batch_only():
+    msg_objs, rmsgs = get_messages(3)
+    http_client = FakeHttpClient(lambda body: 400 if len(get_cycles(body)) > 1 or get_cycles(body) == [1] else 200)
+    rmsg_sent, rmsg_failed, rmsg_rejected, batch_format = webapi_send_messages(msg_objs,rmsgs,http_client,"array")
+    assert rmsg_sent == [rmsgs[0],rmsgs[2]]
+    assert rmsg_rejected == [rmsgs[1]]
+    assert rmsg_failed == []
+    assert batch_format == "array"
+
+def test_unsupported_batches_switch_to_single_messages():
+    msg_objs, rmsgs = get_messages(2)
+    http_client = FakeHttpClient(lambda body: 404 if len(get_cycles(body)) > 1 else 200)
+    assert webapi_send_messages(msg_objs,rmsgs,http_client,"array") == (rmsgs,[],[],None)
+
+def test_server_error_fails_whole_batch():
+    msg_objs, rmsgs = get_messages(2)
+    http_client = FakeHttpClient(lambda body: 503)
+    assert webapi_send_messages(msg_objs,rmsgs,http_client,"ndjson") == ([],rmsgs,[],"ndjson")
+
+def test_webapi_sink_uses_same_batch_handling():
+    msg_objs, rmsgs = get_messages(4)
+    sink = WebapiSink({"url": "http://localhost", "auth": "token"},batch_format="array")
+    sink.http_client = FakeHttpClient(lambda body: 413 if len(get_cycles(body)) > 1 else 200)
+    assert asyncio.run(sink.send_batch(msg_objs,rmsgs)) == []
+    assert sink.batch_format == "array"
+
+    sink.http_client = FakeHttpClient(lambda body: 400 if get_cycles(body) != [0] else 200)
+    assert asyncio.run(sink.send_batch(msg_objs,rmsgs)) == rmsgs[1:]
+    sink.close()
+
+@pytest.mark.parametrize("gzip_threshold,compressed",[(None,False),(0,False),(10,True)])
+def test_http_client_gzip_is_opt_in(gzip_threshold,compressed):
+    from http_client import ExporterHttpClient
+    if gzip_threshold is None:
+        http_client = ExporterHttpClient("http://localhost")
+    else:
+        http_client = ExporterHttpClient("http://localhost",gzip_threshold=gzip_threshold)
+    posts = []
+    http_client.session.post = lambda url, **kwargs: posts.append(kwargs)
+    http_client.post_data(b"x" * 100)
+    assert ("Content-Encoding" in posts[0]["headers"]) == compressed
+    assert (posts[0]["data"] != b"x" * 100) == compressed
+    http_client.close()
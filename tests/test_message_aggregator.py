@@ -0,0 +1,102 @@
+from message_object import MessageObject
+from message_aggregator import MessageAggregator
+
+class FakeClock:
+
+    def __init__(self,now=0.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+def get_message(timestamp,value,cycle_number,device_id="01",measure_code="1"):
+    msg = MessageObject("{device_id}{measure_code}{value}|{cycle}".format(device_id=device_id,measure_code=measure_code,value=value,cycle=cycle_number))
+    msg.set_timestamp(timestamp)
+    return msg
+
+def test_newest_first_backlog_gives_one_aggregate_per_window():
+    clock = FakeClock(10000)
+    aggregator = MessageAggregator(window=60,grace=5,clock=clock)
+    # 10 readings over two windows, read from Redis list head (newest first)
+    msgs = [get_message(1020 + i * 10,i,i) for i in range(10)]
+    for msg in reversed(msgs):
+        aggregator.add(msg)
+
+    assert aggregator.collect() == []
+    clock.now += 5
+    aggregates = sorted(aggregator.collect(),key=lambda aggregate: aggregate.get_timestamp())
+
+    assert [aggregate.get_timestamp() for aggregate in aggregates] == [1020,1080]
+    assert [aggregate.get_count() for aggregate in aggregates] == [6,4]
+    assert aggregates[0].get_min_value() == 0
+    assert aggregates[0].get_max_value() == 5
+    assert aggregates[0].get_measure_value() == 2.5
+    assert aggregates[0].get_last_value() == 5
+    assert aggregates[0].get_cycle_number() == "5"
+
+def test_batches_split_inside_window_are_merged():
+    clock = FakeClock(10000)
+    aggregator = MessageAggregator(window=60,grace=5,clock=clock)
+    aggregator.add(get_message(1030,1,1))
+    assert aggregator.collect() == []
+    clock.now += 1
+    aggregator.add(get_message(1025,2,0))
+    clock.now += 5
+    aggregates = aggregator.collect()
+    assert len(aggregates) == 1
+    assert aggregates[0].get_count() == 2
+
+def test_open_window_waits_for_end():
+    clock = FakeClock(1030)
+    aggregator = MessageAggregator(window=60,grace=5,clock=clock)
+    aggregator.add(get_message(1025,1,1))
+    clock.now = 1070
+    assert aggregator.collect() == []
+    clock.now = 1080
+    assert len(aggregator.collect()) == 1
+
+def test_windows_per_series_are_bounded():
+    clock = FakeClock(100000)
+    aggregator = MessageAggregator(window=60,grace=5,max_windows=2,clock=clock)
+    for i in range(10):
+        aggregator.add(get_message(1020 + i * 60,i,i))
+        assert aggregator.get_stats()["open_windows"] <= 2
+    assert aggregator.get_stats()["evicted_total"] == 8
+    clock.now += 5
+    assert len(aggregator.collect()) == 10
+
+def test_series_are_separate():
+    clock = FakeClock(10000)
+    aggregator = MessageAggregator(window=60,grace=5,clock=clock)
+    aggregator.add(get_message(1020,1,1,device_id="01"))
+    aggregator.add(get_message(1020,2,1,device_id="02"))
+    aggregator.add(get_message(1020,3,1,device_id="01",measure_code="2"))
+    clock.now += 5
+    assert len(aggregator.collect()) == 3
+
+def test_requeued_aggregates_come_back_first():
+    clock = FakeClock(10000)
+    aggregator = MessageAggregator(window=60,grace=5,clock=clock)
+    aggregator.add(get_message(1020,1,1))
+    clock.now += 5
+    aggregates = aggregator.collect()
+    aggregator.requeue(aggregates)
+    assert aggregator.collect() == aggregates
+
+def test_requeued_aggregates_are_capped_at_max_pending():
+    clock = FakeClock(10000)
+    aggregator = MessageAggregator(window=60,grace=5,max_pending=3,clock=clock)
+    for device_id in ["01","02","03"]:
+        aggregator.add(get_message(1020,1,1,device_id=device_id))
+    clock.now += 5
+    aggregates = aggregator.collect()
+    assert aggregator.requeue(aggregates) == 3
+
+    # export keeps failing while new windows close, oldest windows are dropped
+    aggregator.add(get_message(1080,1,1,device_id="04"))
+    clock.now += 120
+    aggregates = aggregator.collect()
+    assert len(aggregates) == 4
+    assert aggregator.requeue(aggregates) == 3
+    assert [aggregate.get_device_id() for aggregate in aggregator.collect()] == ["02","03","04"]
+    assert aggregator.get_stats()["dropped_total"] == 1
@@ -0,0 +1,43 @@
+import json
+
+import pytest
+
+import message_batch
+from message_batch import decode_messages
+from message_object import MessageObject
+
+def get_record(**fields):
+    msg = {"timestamp": 1700000000.5, "device_id": "01", "measure_code": "1", "measure_value": 21.5, "cycle_number": 17, "location_id": 101, "version": 1}
+    msg.update(fields)
+    return json.dumps(msg).encode('utf-8')
+
+records = [
+    get_record(),
+    b"garbage",
+    MessageObject("013-3.25|17").export_message_binary(),
+    # too long for device id column, MessageObject still accepts it
+    get_record(device_id="001"),
+    get_record(measure_code="z")
+]
+
+@pytest.fixture(params=["fallback","numpy"])
+def decode_path(request,monkeypatch):
+    if request.param == "numpy":
+        pytest.importorskip("numpy")
+    else:
+        monkeypatch.setattr(message_batch,"numpy",None)
+    return request.param
+
+def test_decode_messages_matches_per_object_decode(decode_path):
+    msg_objs = decode_messages(records)
+    assert len(msg_objs) == len(records)
+    for record, msg_obj in zip(records,msg_objs):
+        expected = MessageObject()
+        if expected.create_message_from_bytes(record):
+            assert msg_obj is not None
+            assert msg_obj.export_message() == expected.export_message()
+        else:
+            assert msg_obj is None
+
+def test_decode_messages_empty(decode_path):
+    assert decode_messages([]) == []
@@ -0,0 +1,43 @@
+from message_object import MessageObject
+from message_deduplicator import MessageDeduplicator
+
+class FakeClock:
+
+    def __init__(self,now=0.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+def get_message(device_id="01",measure_code="1",cycle_number=1):
+    return MessageObject("{device_id}{measure_code}21.5|{cycle}".format(device_id=device_id,measure_code=measure_code,cycle=cycle_number))
+
+def test_retransmission_is_duplicate():
+    message_deduplicator = MessageDeduplicator(clock=FakeClock())
+    assert not message_deduplicator.is_duplicate(get_message())
+    assert message_deduplicator.is_duplicate(get_message())
+    assert not message_deduplicator.is_duplicate(get_message(measure_code="2"))
+    assert not message_deduplicator.is_duplicate(get_message(cycle_number=2))
+    assert message_deduplicator.get_stats()["duplicates_total"] == 1
+
+def test_same_key_after_max_age_is_new_message():
+    clock = FakeClock()
+    message_deduplicator = MessageDeduplicator(max_age=300,clock=clock)
+    assert not message_deduplicator.is_duplicate(get_message())
+    clock.now += 299
+    assert message_deduplicator.is_duplicate(get_message())
+    # duplicates do not extend the window, cycle counter wrap is still noticed
+    clock.now += 1
+    assert not message_deduplicator.is_duplicate(get_message())
+
+def test_duplicate_hit_keeps_key_from_eviction():
+    message_deduplicator = MessageDeduplicator(max_size=2,clock=FakeClock())
+    message_deduplicator.is_duplicate(get_message(device_id="01"))
+    message_deduplicator.is_duplicate(get_message(device_id="02"))
+    assert message_deduplicator.is_duplicate(get_message(device_id="01"))
+
+    # least recently seen key is evicted, not the oldest inserted one
+    message_deduplicator.is_duplicate(get_message(device_id="03"))
+    assert message_deduplicator.is_duplicate(get_message(device_id="01"))
+    assert not message_deduplicator.is_duplicate(get_message(device_id="02"))
+    assert message_deduplicator.get_stats()["evicted_total"] == 2
@@ -0,0 +1,47 @@
+import pytest
+
+from message_object import MessageObject
+
+@pytest.mark.parametrize("raw_line",["01125.5|17","01125.5!17","01125.5|17 "])
+def test_raw_line_valid(raw_line):
+    msg = MessageObject(raw_line)
+    assert msg.validate()
+    assert msg.get_cycle_number() == "17"
+    assert msg.export_message_bytes()
+
+@pytest.mark.parametrize("raw_line",["01125.5|","01125.5|abc","0112|-1","01125.5|1.5"])
+def test_raw_line_bad_cycle_number_is_invalid(raw_line):
+    msg = MessageObject(raw_line)
+    assert not msg.validate()
+    assert "no cycle_number" in msg.get_validation_errors()
+
+def test_binary_round_trip():
+    msg = MessageObject("013-3.25|17")
+    msg.set_location_id(202)
+    msg_binary = msg.export_message_binary()
+    assert len(msg_binary) == MessageObject.binary_struct.size
+
+    msg_decoded = MessageObject()
+    assert msg_decoded.create_message_from_bytes(msg_binary)
+    assert msg_decoded.export_message_bytes() == msg.export_message_bytes()
+
+def test_json_bytes_detected():
+    msg = MessageObject("01125.5|17")
+    msg_decoded = MessageObject()
+    assert msg_decoded.create_message_from_bytes(msg.export_message_bytes())
+    assert msg_decoded.get_measure_value() == 25.5
+
+@pytest.mark.parametrize("cycle_number,location_id",[(-1,101),(2**32,101),(17,70000),(17,-5)])
+def test_binary_out_of_range_raises_value_error(cycle_number,location_id):
+    msg = MessageObject("01125.5|17")
+    msg.set_cycle_number(cycle_number)
+    msg.set_location_id(location_id)
+    with pytest.raises(ValueError):
+        msg.export_message_binary()
+
+@pytest.mark.parametrize("device_id,measure_code",[(b"\xff\xfe",b"1"),(b"01",b"\xe9")])
+def test_binary_non_ascii_is_invalid(device_id,measure_code):
+    msg_binary = MessageObject.binary_struct.pack(MessageObject.binary_magic,1700000000.5,device_id,measure_code,21.5,17,101,1)
+    msg = MessageObject()
+    assert not msg.create_message_from_bytes(msg_binary)
+    assert "cant unpack binary data" in msg.get_validation_errors()
@@ -0,0 +1,150 @@
+import asyncio
+import os
+import sys
+import threading
+
+import pytest
+
+pytest.importorskip("redis")
+pytest.importorskip("requests")
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),"..","src"))
+
+import msg_exporter
+from export_sinks import ExportSink, PubSubSink
+from message_object import MessageObject
+from pubsub_publisher import StubPublisherClient
+from retry_policy import RetryPolicy, CircuitBreaker
+
+class FakeConsumer:
+
+    def __init__(self,batches=None):
+        self.batches = list(batches or [])
+        self.acked = []
+        self.requeued = []
+
+    async def read_batch(self,count,linger=None):
+        if len(self.batches) > 0:
+            return self.batches.pop(0)
+        # nothing more to read, reader waits until cancelled
+        await asyncio.Event().wait()
+
+    async def ack(self,rmsgs):
+        self.acked.extend(rmsgs)
+
+    async def requeue(self,rmsgs):
+        self.requeued.extend(rmsgs)
+
+class FakeSink(ExportSink):
+
+    name = "fake"
+
+    def __init__(self,failed_count=0,**kwargs):
+        super().__init__(**kwargs)
+        self.failed_count = failed_count
+        self.sent = []
+
+    def accepts(self,msg_obj):
+        return msg_obj.get_measure_name() == "MSGC_TEMPERATURE"
+
+    async def send_batch(self,msg_objs,rmsgs):
+        self.sent.extend(rmsgs)
+        return rmsgs[:self.failed_count]
+
+def get_rmsg(measure_code="1",cycle_number=1):
+    return MessageObject("01{code}21.5|{cycle}".format(code=measure_code,cycle=cycle_number)).export_message_bytes()
+
+def run_worker(sink,redis_consumer,batches):
+    retry_policy = RetryPolicy(base_delay=0.0,max_delay=0.0,jitter=0.0)
+    circuit_breaker = CircuitBreaker(failure_threshold=2)
+
+    async def run():
+        sink_queue = asyncio.Queue()
+        for msg_batch, rmsg_batch in batches:
+            sink_queue.put_nowait((msg_batch,rmsg_batch))
+        worker = asyncio.create_task(msg_exporter.sink_worker(sink,redis_consumer,sink_queue,retry_policy,circuit_breaker))
+        await sink_queue.join()
+        worker.cancel()
+
+    asyncio.run(run())
+    return retry_policy, circuit_breaker
+
+def test_parsed_message_cache_decodes_each_message_once():
+    message_cache = msg_exporter.ParsedMessageCache(max_size=2)
+    rmsg = get_rmsg(cycle_number=1)
+    msg_objs = message_cache.get_batch([rmsg,b"garbage",rmsg])
+    assert msg_objs[0] is msg_objs[2]
+    assert msg_objs[1] is False
+    assert message_cache.get(rmsg) is msg_objs[0]
+
+    rmsg_next = get_rmsg(cycle_number=2)
+    message_cache.get(rmsg_next)
+    # least recently used entry is evicted
+    assert list(message_cache.messages) == [rmsg,rmsg_next]
+
+def test_sink_reader_acks_skipped_and_queues_accepted():
+    rmsgs = [get_rmsg("1"),get_rmsg("2"),b"garbage"]
+    redis_consumer = FakeConsumer([rmsgs])
+    sink = FakeSink()
+
+    async def run():
+        sink_queue = asyncio.Queue()
+        reader = asyncio.create_task(msg_exporter.sink_reader(sink,redis_consumer,sink_queue,msg_exporter.ParsedMessageCache(),CircuitBreaker(),0))
+        msg_batch, rmsg_batch = await asyncio.wait_for(sink_queue.get(),5)
+        reader.cancel()
+        return msg_batch, rmsg_batch
+
+    msg_batch, rmsg_batch = asyncio.run(run())
+    assert rmsg_batch == [rmsgs[0]]
+    assert msg_batch[0].get_measure_name() == "MSGC_TEMPERATURE"
+    assert redis_consumer.acked == rmsgs[1:]
+    sink.close()
+
+def test_sink_worker_acks_sent_batch():
+    rmsgs = [get_rmsg(cycle_number=1),get_rmsg(cycle_number=2)]
+    redis_consumer = FakeConsumer()
+    sink = FakeSink()
+    retry_policy, circuit_breaker = run_worker(sink,redis_consumer,[(["m1","m2"],rmsgs)])
+    assert redis_consumer.acked == rmsgs
+    assert redis_consumer.requeued == []
+    assert retry_policy.failures == 0
+    sink.close()
+
+def test_sink_worker_requeues_failed_messages_and_opens_circuit():
+    rmsgs = [get_rmsg(cycle_number=1),get_rmsg(cycle_number=2)]
+    redis_consumer = FakeConsumer()
+    sink = FakeSink(failed_count=1)
+    retry_policy, circuit_breaker = run_worker(sink,redis_consumer,[(["m1","m2"],rmsgs),(["m1","m2"],rmsgs)])
+    assert redis_consumer.acked == [rmsgs[1],rmsgs[1]]
+    assert redis_consumer.requeued == [rmsgs[0],rmsgs[0]]
+    assert circuit_breaker.get_state() == "open"
+    sink.close()
+
+def test_sink_blocking_calls_run_on_own_executor():
+    sink = FakeSink(concurrency=3)
+    other_sink = FakeSink()
+
+    async def run():
+        return await asyncio.gather(*[sink.run_blocking(lambda: threading.current_thread().name) for i in range(6)])
+
+    thread_names = asyncio.run(run())
+    assert all(thread_name.startswith("fake") for thread_name in thread_names)
+    assert sink.executor is not other_sink.executor
+    assert sink.executor._max_workers == 3
+
+    sink.close()
+    other_sink.close()
+    with pytest.raises(RuntimeError):
+        sink.executor.submit(print)
+
+@pytest.mark.parametrize("envelope_size",[0,2])
+def test_pubsub_sink_reports_failed_messages(envelope_size):
+    rmsgs = [get_rmsg(cycle_number=i) for i in range(5)]
+    publisher = StubPublisherClient()
+    sink = PubSubSink(publisher,"projects/test/topics/test",envelope_size=envelope_size)
+    assert asyncio.run(sink.send_batch(None,rmsgs)) == []
+    assert publisher.published_count == (5 if envelope_size == 0 else 3)
+
+    publisher.failure_rate = 1.0
+    assert asyncio.run(sink.send_batch(None,rmsgs)) == rmsgs
+    sink.close()
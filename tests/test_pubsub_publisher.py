@@ -0,0 +1,86 @@
+import threading
+import time
+
+import pytest
+
+from message_object import MessageObject
+from pubsub_publisher import PipelinedPublisher, StubPublisherClient, get_envelope, envelope_schema_binary, envelope_schema_ndjson
+
+topic = "projects/test/topics/test"
+
+def get_rmsgs(count):
+    return [b"msg-%d" % i for i in range(count)]
+
+def test_publish_blocks_while_window_is_full():
+    publisher = PipelinedPublisher(StubPublisherClient(latency=0.3,workers=8),topic,max_in_flight=2)
+    rmsgs = get_rmsgs(3)
+    publish_thread = threading.Thread(target=lambda: [publisher.publish(rmsg) for rmsg in rmsgs])
+    publish_thread.start()
+
+    time.sleep(0.1)
+    # third publish waits for one of the first two futures
+    assert publish_thread.is_alive()
+    assert publisher.get_in_flight() == 2
+
+    publish_thread.join(5)
+    assert publisher.wait_all(timeout=5)
+    succeeded, failed = publisher.collect_results()
+    assert sorted(succeeded) == rmsgs
+    assert failed == []
+
+def test_collect_results_reports_failures():
+    stub_client = StubPublisherClient(failure_rate=1.0)
+    publisher = PipelinedPublisher(stub_client,topic)
+    rmsgs = get_rmsgs(4)
+    for rmsg in rmsgs:
+        publisher.publish(rmsg)
+    assert publisher.wait_all(timeout=5)
+
+    succeeded, failed = publisher.collect_results()
+    assert succeeded == []
+    assert sorted([rmsg for rmsg, error in failed]) == rmsgs
+    assert all(isinstance(error,RuntimeError) for rmsg, error in failed)
+    # results are handed out once
+    assert publisher.collect_results() == ([],[])
+
+def test_publish_error_releases_window():
+    stub_client = StubPublisherClient()
+    publisher = PipelinedPublisher(stub_client,topic,max_in_flight=1)
+
+    def publish_failing(topic,data,**attrs):
+        raise ValueError("bad message")
+
+    stub_client.publish = publish_failing
+    with pytest.raises(ValueError):
+        publisher.publish(b"msg-0")
+    assert publisher.get_in_flight() == 0
+
+@pytest.mark.parametrize("failure_rate",[0.0,1.0])
+def test_publish_envelope_reports_each_message(failure_rate):
+    publisher = PipelinedPublisher(StubPublisherClient(failure_rate=failure_rate),topic)
+    rmsgs = get_rmsgs(3)
+    envelope_data, envelope_attributes = get_envelope(rmsgs)
+    publisher.publish_envelope(rmsgs,envelope_data,envelope_attributes)
+    assert publisher.wait_all(timeout=5)
+
+    succeeded, failed = publisher.collect_results()
+    if failure_rate == 0.0:
+        assert succeeded == rmsgs
+        assert failed == []
+    else:
+        assert succeeded == []
+        assert [rmsg for rmsg, error in failed] == rmsgs
+
+def test_envelope_schema():
+    binary_rmsgs = [MessageObject("011{value}|1".format(value=value)).export_message_binary() for value in (20,21)]
+    envelope_data, envelope_attributes = get_envelope(binary_rmsgs)
+    assert envelope_data == b"".join(binary_rmsgs)
+    assert envelope_attributes == {"schema": envelope_schema_binary, "version": "1", "count": "2"}
+
+    # mixed batch goes as NDJSON, binary messages are converted to JSON
+    json_rmsg = MessageObject("01122|1").export_message_bytes()
+    envelope_data, envelope_attributes = get_envelope([json_rmsg,binary_rmsgs[0]])
+    assert envelope_data.split(b"\n")[0] == json_rmsg
+    assert envelope_data.endswith(b"\n")
+    assert envelope_attributes["schema"] == envelope_schema_ndjson
+    assert envelope_attributes["count"] == "2"
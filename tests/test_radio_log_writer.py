@@ -0,0 +1,101 @@
+import gzip
+import os
+import time
+
+from radio_log_writer import RotatingLogWriter
+
+def get_segment_files(log_file_name):
+    return sorted(file_name for file_name in os.listdir(os.path.dirname(log_file_name)) if file_name.startswith(os.path.basename(log_file_name) + "."))
+
+def read_file(file_name):
+    with open(file_name,'rb') as log_file:
+        return log_file.read()
+
+def wait_for(condition,timeout=5.0):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline
+        time.sleep(0.01)
+
+def test_group_commit_flushes_after_flush_count(tmp_path):
+    log_file_name = str(tmp_path / "radio.log")
+    radio_log = RotatingLogWriter(log_file_name,flush_count=3,flush_interval=3600)
+    radio_log.write(b"m1")
+    radio_log.write(b"m2")
+    assert read_file(log_file_name) == b""
+    radio_log.write(b"m3")
+    assert read_file(log_file_name) == b"m1\nm2\nm3\n"
+    radio_log.close()
+
+def test_group_commit_flushes_after_flush_interval(tmp_path):
+    log_file_name = str(tmp_path / "radio.log")
+    radio_log = RotatingLogWriter(log_file_name,flush_count=100,flush_interval=0)
+    radio_log.write(b"m1")
+    assert read_file(log_file_name) == b""
+    radio_log.commit_if_due()
+    assert read_file(log_file_name) == b"m1\n"
+    radio_log.close()
+
+def test_rotates_by_size(tmp_path):
+    log_file_name = str(tmp_path / "radio.log")
+    radio_log = RotatingLogWriter(log_file_name,max_bytes=10,flush_count=1)
+    for i in range(5):
+        radio_log.write(b"msg-%d" % i)
+    radio_log.close()
+
+    segment_files = get_segment_files(log_file_name)
+    assert len(segment_files) == 2
+    assert [read_file(str(tmp_path / segment_file)) for segment_file in segment_files] == [b"msg-0\nmsg-1\n",b"msg-2\nmsg-3\n"]
+    assert read_file(log_file_name) == b"msg-4\n"
+
+def test_rotates_by_age(tmp_path):
+    log_file_name = str(tmp_path / "radio.log")
+    radio_log = RotatingLogWriter(log_file_name,max_age=0,flush_count=100)
+    radio_log.commit_if_due()
+    assert get_segment_files(log_file_name) == []
+    radio_log.write(b"m1")
+    radio_log.close()
+    assert len(get_segment_files(log_file_name)) == 1
+
+def test_compresses_rotated_segment(tmp_path):
+    log_file_name = str(tmp_path / "radio.log")
+    radio_log = RotatingLogWriter(log_file_name,flush_count=1,compression="gzip")
+    radio_log.write(b"m1")
+    radio_log.rotate()
+    radio_log.close()
+
+    wait_for(lambda: len(get_segment_files(log_file_name)) == 1 and get_segment_files(log_file_name)[0].endswith(".gz"))
+    with gzip.open(str(tmp_path / get_segment_files(log_file_name)[0]),'rb') as segment_file:
+        assert segment_file.read() == b"m1\n"
+
+def test_retention_keeps_max_segments(tmp_path):
+    log_file_name = str(tmp_path / "radio.log")
+    radio_log = RotatingLogWriter(log_file_name,flush_count=1,max_segments=2)
+    for i in range(5):
+        radio_log.write(b"msg-%d" % i)
+        radio_log.rotate()
+    radio_log.close()
+
+    segment_files = get_segment_files(log_file_name)
+    assert [read_file(str(tmp_path / segment_file)) for segment_file in segment_files] == [b"msg-3\n",b"msg-4\n"]
+
+def test_retention_keeps_max_total_bytes_of_compressed_segments(tmp_path):
+    log_file_name = str(tmp_path / "radio.log")
+    radio_log = RotatingLogWriter(log_file_name,flush_count=1,compression="gzip")
+    radio_log.write(b"msg-0")
+    radio_log.rotate()
+    wait_for(lambda: all(segment_file.endswith(".gz") for segment_file in get_segment_files(log_file_name)))
+    segment_size = os.path.getsize(str(tmp_path / get_segment_files(log_file_name)[0]))
+
+    radio_log.max_total_bytes = 2 * segment_size
+    for i in range(1,4):
+        radio_log.write(b"msg-%d" % i)
+        radio_log.rotate()
+        wait_for(lambda: all(segment_file.endswith(".gz") for segment_file in get_segment_files(log_file_name)))
+    radio_log.close()
+
+    # retention runs on compress thread once segment is compressed
+    wait_for(lambda: len(get_segment_files(log_file_name)) == 2)
+    segment_files = get_segment_files(log_file_name)
+    with gzip.open(str(tmp_path / segment_files[-1]),'rb') as segment_file:
+        assert segment_file.read() == b"msg-3\n"
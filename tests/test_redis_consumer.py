@@ -0,0 +1,120 @@
+import asyncio
+
+import pytest
+
+redis = pytest.importorskip("redis")
+import redis.asyncio
+
+from redis_consumer import RedisReliableConsumer, AsyncRedisReliableConsumer
+
+redis_list = "metrics_test"
+
+def push_messages(redis_conn,msgs):
+    # reader pushes with LPUSH, oldest message ends at the head
+    redis_conn.lpush(redis_list,*reversed(msgs))
+
+def get_list(redis_conn,name):
+    return redis_conn.lrange(name,0,-1)
+
+def test_read_batch_moves_messages_to_processing_list(local_redis):
+    redis_conn = local_redis.connect()
+    redis_consumer = RedisReliableConsumer(redis_conn,redis_list,"c1",block_timeout=1)
+    msgs = [b"msg-%d" % i for i in range(10)]
+    push_messages(redis_conn,msgs)
+
+    assert redis_consumer.read_batch(4) == msgs[:4]
+    assert get_list(redis_conn,redis_consumer.processing_list) == msgs[:4]
+    assert redis_consumer.get_queue_length() == 6
+
+def test_read_batch_larger_than_lua_unpack_limit(local_redis):
+    redis_conn = local_redis.connect()
+    redis_consumer = RedisReliableConsumer(redis_conn,redis_list,"c1",block_timeout=1)
+    msgs = [b"msg-%d" % i for i in range(20000)]
+    push_messages(redis_conn,msgs)
+
+    assert redis_consumer.read_batch(len(msgs)) == msgs
+    assert redis_consumer.get_in_flight_length() == len(msgs)
+
+def test_ack_removes_messages_in_one_round_trip(local_redis):
+    redis_conn = local_redis.connect()
+    redis_consumer = RedisReliableConsumer(redis_conn,redis_list,"c1",block_timeout=1)
+    msgs = [b"msg-%d" % i for i in range(5)]
+    push_messages(redis_conn,msgs)
+    rmsgs = redis_consumer.read_batch(5)
+
+    redis_consumer.ack(rmsgs[1:4])
+    assert get_list(redis_conn,redis_consumer.processing_list) == [msgs[0],msgs[4]]
+    redis_consumer.ack(rmsgs)
+    assert redis_consumer.get_in_flight_length() == 0
+
+def test_requeue_keeps_order_and_dead_letters_after_max_attempts(local_redis):
+    redis_conn = local_redis.connect()
+    redis_consumer = RedisReliableConsumer(redis_conn,redis_list,"c1",block_timeout=1,max_attempts=3)
+    msgs = [b"msg-%d" % i for i in range(5)]
+    push_messages(redis_conn,msgs)
+
+    for attempt in range(2):
+        rmsgs = redis_consumer.read_batch(5)
+        assert rmsgs == msgs
+        assert redis_consumer.requeue(rmsgs) == 5
+        assert redis_consumer.get_in_flight_length() == 0
+
+    # first message is sent fine on third attempt, rest fail again
+    rmsgs = redis_consumer.read_batch(5)
+    redis_consumer.ack(rmsgs[:1])
+    assert redis_consumer.requeue(rmsgs[1:]) == 0
+    assert get_list(redis_conn,redis_consumer.dead_letter_list) == msgs[1:]
+    assert redis_consumer.get_queue_length() == 0
+    assert redis_conn.hlen(redis_consumer.attempts_hash) == 0
+
+def test_dead_letter_skips_retries(local_redis):
+    redis_conn = local_redis.connect()
+    redis_consumer = RedisReliableConsumer(redis_conn,redis_list,"c1",block_timeout=1)
+    msgs = [b"msg-%d" % i for i in range(3)]
+    push_messages(redis_conn,msgs)
+    rmsgs = redis_consumer.read_batch(3)
+
+    redis_consumer.requeue(rmsgs[:1])
+    assert redis_consumer.dead_letter(rmsgs[1:]) == 2
+    assert get_list(redis_conn,redis_consumer.dead_letter_list) == msgs[1:]
+    assert get_list(redis_conn,redis_list) == msgs[:1]
+    assert redis_consumer.get_in_flight_length() == 0
+
+def test_recover_in_flight_after_restart(local_redis):
+    redis_conn = local_redis.connect()
+    redis_consumer = RedisReliableConsumer(redis_conn,redis_list,"c1",block_timeout=1)
+    msgs = [b"msg-%d" % i for i in range(6)]
+    push_messages(redis_conn,msgs)
+    rmsgs = redis_consumer.read_batch(4)
+    redis_consumer.ack(rmsgs[:1])
+
+    # consumer with same name after crash gets unacked messages first, in original order
+    redis_consumer = RedisReliableConsumer(redis_conn,redis_list,"c1",block_timeout=1)
+    assert redis_consumer.recover_in_flight() == 3
+    assert redis_consumer.get_in_flight_length() == 0
+    assert redis_consumer.read_batch(10) == msgs[1:]
+
+    other_consumer = RedisReliableConsumer(redis_conn,redis_list,"c2",block_timeout=1)
+    assert other_consumer.recover_in_flight() == 0
+
+def test_async_consumer_shares_queue_layout(local_redis):
+    msgs = [b"msg-%d" % i for i in range(5)]
+    push_messages(local_redis.connect(),msgs)
+
+    async def run():
+        redis_conn = redis.asyncio.Redis(host="127.0.0.1",port=local_redis.port)
+        redis_consumer = AsyncRedisReliableConsumer(redis_conn,redis_list,"c1",block_timeout=1,max_attempts=2)
+        rmsgs = await redis_consumer.read_batch(5)
+        await redis_consumer.ack(rmsgs[:2])
+        await redis_consumer.requeue(rmsgs[2:])
+        rmsgs = await redis_consumer.read_batch(5)
+        requeued = await redis_consumer.requeue(rmsgs[:1])
+        dead_lettered = await redis_consumer.dead_letter(rmsgs[1:])
+        await redis_conn.aclose()
+        return rmsgs, requeued, dead_lettered
+
+    rmsgs, requeued, dead_lettered = asyncio.run(run())
+    assert rmsgs == msgs[2:]
+    assert requeued == 0
+    assert dead_lettered == 2
+    assert get_list(local_redis.connect(),redis_list + ":dead") == msgs[2:]
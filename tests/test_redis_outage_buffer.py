@@ -0,0 +1,103 @@
+import time
+
+import pytest
+
+redis = pytest.importorskip("redis")
+
+from redis_outage_buffer import RedisOutageBuffer
+from local_redis import redis_server_bin
+
+# real server, killed and started again while messages are written
+pytestmark = pytest.mark.skipif(redis_server_bin is None,reason="redis-server binary not found")
+
+redis_lists = ["metrics_pubsub","metrics_graphite"]
+
+def wait_for(condition,timeout=10.0):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline
+        time.sleep(0.05)
+
+def test_no_loss_no_duplicates_across_restart(local_redis,tmp_path):
+    # client does not retry by itself, outage buffer is what retries
+    redis_conn = local_redis.connect()
+    outage_buffer = RedisOutageBuffer(str(tmp_path / "outage.db"),redis_conn,replay_batch_size=7)
+    sent = []
+    buffered_batches = 0
+
+    for batch_index in range(60):
+        msgs = [b"msg-%d-%d" % (batch_index,i) for i in range(5)]
+        sent.extend(msgs)
+        if batch_index == 20:
+            local_redis.kill()
+        if batch_index == 30:
+            # replay while server is still away keeps everything buffered
+            pending_count = outage_buffer.get_pending_count()
+            with pytest.raises(redis.exceptions.RedisError):
+                outage_buffer.replay_once()
+            assert outage_buffer.get_pending_count() == pending_count
+        if batch_index == 40:
+            local_redis.start()
+        # same write path as uart reader
+        if outage_buffer.write(redis_lists,msgs) != []:
+            buffered_batches += 1
+
+    assert buffered_batches == 20
+    while outage_buffer.replay_once() > 0:
+        pass
+
+    for redis_list in redis_lists:
+        stored = redis_conn.lrange(redis_list,0,-1)
+        assert len(stored) == len(sent)
+        assert sorted(stored) == sorted(sent)
+    assert outage_buffer.get_stats() == {"pending": 0, "stored_total": 200, "replayed_total": 200}
+
+    # server killed after replay, acknowledged messages are still there and nothing is replayed again
+    local_redis.kill()
+    local_redis.start()
+    assert outage_buffer.replay_once() == 0
+    assert sorted(redis_conn.lrange(redis_lists[0],0,-1)) == sorted(sent)
+    outage_buffer.close()
+
+def test_replay_thread_delivers_buffered_messages(local_redis,tmp_path):
+    redis_conn = local_redis.connect()
+    outage_buffer = RedisOutageBuffer(str(tmp_path / "outage.db"),redis_conn,replay_batch_size=10,replay_interval=0.05)
+    outage_buffer.start_replay_thread()
+
+    local_redis.kill()
+    sent = []
+    for batch_index in range(10):
+        msgs = [b"msg-%d-%d" % (batch_index,i) for i in range(5)]
+        sent.extend(msgs)
+        assert outage_buffer.write(redis_lists,msgs) == redis_lists
+    assert outage_buffer.get_pending_count() == 100
+
+    # replay thread keeps trying while server is away and empties the buffer once it is back
+    time.sleep(0.2)
+    local_redis.start()
+    wait_for(lambda: outage_buffer.get_pending_count() == 0)
+    outage_buffer.close()
+
+    for redis_list in redis_lists:
+        assert sorted(redis_conn.lrange(redis_list,0,-1)) == sorted(sent)
+    assert outage_buffer.replayed_total == 100
+
+def test_replay_deletes_only_rows_of_lists_which_succeeded(local_redis,tmp_path):
+    redis_conn = local_redis.connect()
+    outage_buffer = RedisOutageBuffer(str(tmp_path / "outage.db"),redis_conn)
+    msgs = [b"msg-0",b"msg-1"]
+    outage_buffer.store("metrics_pubsub",msgs)
+    outage_buffer.store("metrics_graphite",msgs)
+
+    # LPUSH to a string key fails, other list is replayed
+    redis_conn.set("metrics_graphite","not a list")
+    assert outage_buffer.replay_once() == 2
+    assert redis_conn.lrange("metrics_pubsub",0,-1) == list(reversed(msgs))
+    assert outage_buffer.get_pending_count() == 2
+
+    redis_conn.delete("metrics_graphite")
+    assert outage_buffer.replay_once() == 2
+    assert redis_conn.lrange("metrics_graphite",0,-1) == list(reversed(msgs))
+    assert redis_conn.lrange("metrics_pubsub",0,-1) == list(reversed(msgs))
+    assert outage_buffer.get_pending_count() == 0
+    outage_buffer.close()
@@ -0,0 +1,123 @@
+import asyncio
+
+import pytest
+
+redis = pytest.importorskip("redis")
+import redis.asyncio
+
+from redis_stream_transport import RedisStreamConsumer, AsyncRedisStreamConsumer, redis_write_messages_stream, check_redis_version, get_group_queue_length
+
+redis_stream = "metrics_stream_test"
+group_name = "metrics_graphite"
+
+def get_consumer(redis_conn,consumer_name="c1",**kwargs):
+    return RedisStreamConsumer(redis_conn,redis_stream,group_name,consumer_name,block_timeout=0.1,**kwargs)
+
+def get_pending_count(redis_conn):
+    return redis_conn.xpending(redis_stream,group_name)["pending"]
+
+def test_check_redis_version():
+    assert check_redis_version({"redis_version": "7.2.4"}) == (7,2)
+    with pytest.raises(RuntimeError):
+        check_redis_version({"redis_version": "6.0.16"})
+
+def test_queue_length_is_lag_even_when_zero():
+    groups_info = [{"name": group_name.encode(), "lag": 0, "pending": 5}]
+    assert get_group_queue_length(groups_info,group_name,10) == 0
+    # without lag (Redis before 7) stream length is used
+    assert get_group_queue_length([{"name": group_name, "pending": 5}],group_name,10) == 10
+    assert get_group_queue_length([],group_name,10) == 0
+
+def test_read_batch_and_ack(local_redis):
+    redis_conn = local_redis.connect()
+    redis_consumer = get_consumer(redis_conn)
+    msgs = [b"msg-%d" % i for i in range(5)]
+    redis_write_messages_stream(msgs,redis_conn,redis_stream)
+
+    assert redis_consumer.get_queue_length() == 5
+    rmsgs = redis_consumer.read_batch(3)
+    assert rmsgs == msgs[:3]
+    assert redis_consumer.get_in_flight_length() == 3
+
+    redis_consumer.ack(rmsgs)
+    assert redis_consumer.get_in_flight_length() == 0
+    assert get_pending_count(redis_conn) == 0
+    assert redis_consumer.read_batch(10) == msgs[3:]
+
+def test_same_bytes_in_more_entries_are_acked_one_by_one(local_redis):
+    redis_conn = local_redis.connect()
+    redis_consumer = get_consumer(redis_conn)
+    redis_write_messages_stream([b"same",b"same",b"other"],redis_conn,redis_stream)
+    rmsgs = redis_consumer.read_batch(3)
+
+    # acked with equal bytes object which is not the one handed out
+    redis_consumer.ack([bytes(bytearray(b"same"))])
+    assert redis_consumer.get_in_flight_length() == 2
+    assert get_pending_count(redis_conn) == 2
+    redis_consumer.ack(rmsgs[1:])
+    assert get_pending_count(redis_conn) == 0
+
+def test_requeue_redelivers_and_dead_letters_after_max_attempts(local_redis):
+    redis_conn = local_redis.connect()
+    redis_consumer = get_consumer(redis_conn,max_attempts=2)
+    msgs = [b"msg-%d" % i for i in range(3)]
+    redis_write_messages_stream(msgs,redis_conn,redis_stream)
+
+    rmsgs = redis_consumer.read_batch(3)
+    assert redis_consumer.requeue(rmsgs) == 3
+    assert redis_consumer.get_in_flight_length() == 3
+    rmsgs = redis_consumer.read_batch(3)
+    assert rmsgs == msgs
+
+    redis_consumer.ack(rmsgs[:1])
+    assert redis_consumer.requeue(rmsgs[1:]) == 0
+    assert redis_conn.lrange(redis_consumer.dead_letter_list,0,-1) == msgs[1:]
+    assert redis_consumer.get_in_flight_length() == 0
+    assert get_pending_count(redis_conn) == 0
+    assert redis_consumer.attempts == {}
+
+def test_recover_in_flight_claims_entries_of_crashed_consumer(local_redis):
+    redis_conn = local_redis.connect()
+    crashed_consumer = get_consumer(redis_conn,"c1")
+    msgs = [b"msg-%d" % i for i in range(4)]
+    redis_write_messages_stream(msgs,redis_conn,redis_stream)
+    crashed_consumer.read_batch(4)
+
+    redis_consumer = get_consumer(redis_conn,"c2",claim_min_idle=0)
+    assert redis_consumer.recover_in_flight() == 4
+    assert redis_consumer.read_batch(10) == msgs
+    redis_consumer.ack(msgs)
+    assert get_pending_count(redis_conn) == 0
+
+def test_trimmed_pending_entries_are_acked(local_redis):
+    redis_conn = local_redis.connect()
+    redis_consumer = get_consumer(redis_conn)
+    redis_write_messages_stream([b"msg-0",b"msg-1"],redis_conn,redis_stream)
+    redis_consumer.read_batch(2)
+    redis_conn.xtrim(redis_stream,maxlen=0)
+
+    redis_consumer = get_consumer(redis_conn)
+    assert redis_consumer.recover_in_flight() == 0
+    assert get_pending_count(redis_conn) == 0
+
+def test_async_consumer(local_redis):
+    msgs = [b"msg-%d" % i for i in range(4)]
+    redis_write_messages_stream(msgs,local_redis.connect(),redis_stream)
+
+    async def run():
+        redis_conn = redis.asyncio.Redis(host="127.0.0.1",port=local_redis.port)
+        redis_consumer = AsyncRedisStreamConsumer(redis_conn,redis_stream,group_name,"c1",block_timeout=0.1,max_attempts=1)
+        await redis_consumer.recover_in_flight()
+        queue_length = await redis_consumer.get_queue_length()
+        rmsgs = await redis_consumer.read_batch(4)
+        await redis_consumer.ack(rmsgs[:2])
+        await redis_consumer.requeue(rmsgs[2:])
+        await redis_conn.aclose()
+        return queue_length, rmsgs
+
+    queue_length, rmsgs = asyncio.run(run())
+    assert queue_length == 4
+    assert rmsgs == msgs
+    redis_conn = local_redis.connect()
+    assert redis_conn.lrange(redis_stream + ":" + group_name + ":dead",0,-1) == msgs[2:]
+    assert get_pending_count(redis_conn) == 0
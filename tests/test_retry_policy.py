@@ -0,0 +1,186 @@
+import threading
+import http.server
+
+import pytest
+
+from retry_policy import RetryPolicy, CircuitBreaker, is_permanent_status, is_permanent_error
+
+class FakeClock:
+
+    def __init__(self,now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+    def advance(self,seconds):
+        self.now += seconds
+
+def test_backoff_without_jitter():
+    retry_policy = RetryPolicy(base_delay=1.0,max_delay=10.0,jitter=0.5,rand=lambda: 0.0)
+    assert retry_policy.get_delay() == 0
+    assert [retry_policy.record_failure() for i in range(6)] == [1.0,2.0,4.0,8.0,10.0,10.0]
+
+def test_success_resets_backoff():
+    retry_policy = RetryPolicy(base_delay=1.0,rand=lambda: 0.0)
+    for i in range(4):
+        retry_policy.record_failure()
+    retry_policy.record_success()
+    assert retry_policy.get_delay() == 0
+    assert retry_policy.record_failure() == 1.0
+
+@pytest.mark.parametrize("rand_value",[0.0,0.25,0.999999])
+def test_jitter_bounds(rand_value):
+    retry_policy = RetryPolicy(base_delay=2.0,max_delay=300.0,jitter=0.5,rand=lambda: rand_value)
+    for failures in range(1,12):
+        delay = min(300.0,2.0 * 2 ** (failures - 1))
+        assert delay * 0.5 < retry_policy.record_failure() <= delay
+
+@pytest.mark.parametrize("status_code,permanent",[(None,False),(200,False),(400,True),(401,True),(408,False),(413,True),(429,False),(500,False),(503,False)])
+def test_permanent_status(status_code,permanent):
+    assert is_permanent_status(status_code) == permanent
+
+class ApiError(Exception):
+
+    def __init__(self,code):
+        super().__init__("api error")
+        self.code = code
+
+def test_permanent_error():
+    assert is_permanent_error(TypeError("not bytes"))
+    assert is_permanent_error(ApiError(400))
+    assert not is_permanent_error(ApiError(503))
+    assert not is_permanent_error(ConnectionError("refused"))
+
+def test_circuit_opens_after_threshold():
+    clock = FakeClock()
+    circuit_breaker = CircuitBreaker(failure_threshold=3,reset_timeout=30.0,clock=clock)
+    for i in range(2):
+        assert circuit_breaker.allow_request()
+        circuit_breaker.record_failure()
+    assert circuit_breaker.get_state() == CircuitBreaker.STATE_CLOSED
+
+    circuit_breaker.record_failure()
+    assert circuit_breaker.get_state() == CircuitBreaker.STATE_OPEN
+    assert not circuit_breaker.allow_request()
+    clock.advance(10)
+    assert circuit_breaker.get_wait_time() == 20.0
+    assert not circuit_breaker.allow_request()
+
+def test_half_open_probe_success_closes():
+    clock = FakeClock()
+    circuit_breaker = CircuitBreaker(failure_threshold=1,reset_timeout=30.0,clock=clock)
+    circuit_breaker.record_failure()
+    clock.advance(30)
+    assert circuit_breaker.allow_request()
+    assert circuit_breaker.get_state() == CircuitBreaker.STATE_HALF_OPEN
+    assert circuit_breaker.get_wait_time() == 0
+
+    circuit_breaker.record_success()
+    assert circuit_breaker.get_state() == CircuitBreaker.STATE_CLOSED
+    assert circuit_breaker.allow_request()
+
+def test_half_open_probe_failure_reopens_longer():
+    clock = FakeClock()
+    circuit_breaker = CircuitBreaker(failure_threshold=1,reset_timeout=30.0,max_reset_timeout=100.0,clock=clock)
+    circuit_breaker.record_failure()
+    timeouts = []
+    for i in range(4):
+        clock.advance(circuit_breaker.get_wait_time())
+        assert circuit_breaker.allow_request()
+        circuit_breaker.record_failure()
+        assert circuit_breaker.get_state() == CircuitBreaker.STATE_OPEN
+        timeouts.append(circuit_breaker.get_wait_time())
+    assert timeouts == [60.0,100.0,100.0,100.0]
+
+    # success resets timeout back to base
+    clock.advance(100)
+    assert circuit_breaker.allow_request()
+    circuit_breaker.record_success()
+    circuit_breaker.record_failure()
+    assert circuit_breaker.get_wait_time() == 30.0
+
+class FlappingHandler(http.server.BaseHTTPRequestHandler):
+
+    # fails fail_count requests, then accepts ok_count requests, and again
+    fail_count = 6
+    ok_count = 4
+
+    def do_POST(self):
+        server = self.server
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        with server.lock:
+            server.requests_total += 1
+            failing = (server.requests_total - 1) % (self.fail_count + self.ok_count) < self.fail_count
+            if not failing:
+                server.accepted.append(body)
+        self.send_response(503 if failing else 204)
+        self.send_header('Content-Length','0')
+        self.end_headers()
+
+    def log_message(self,format,*args):
+        pass
+
+@pytest.fixture
+def flapping_server():
+    server = http.server.ThreadingHTTPServer(("127.0.0.1",0),FlappingHandler)
+    server.lock = threading.Lock()
+    server.requests_total = 0
+    server.accepted = []
+    server_thread = threading.Thread(target=server.serve_forever,daemon=True)
+    server_thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+def test_flapping_endpoint(flapping_server):
+    pytest.importorskip("requests")
+    from http_client import ExporterHttpClient
+    from export_sinks import webapi_send_messages, get_webapi_batch_body
+    from message_object import MessageObject
+
+    # same loop and send path as webapi exporter, sleeps are replaced by moving fake clock
+    clock = FakeClock()
+    retry_policy = RetryPolicy(base_delay=1.0,max_delay=20.0,rand=lambda: 0.5)
+    circuit_breaker = CircuitBreaker(failure_threshold=3,reset_timeout=15.0,max_reset_timeout=60.0,clock=clock)
+    http_client = ExporterHttpClient("http://127.0.0.1:{port}/".format(port=flapping_server.server_address[1]),timeout=5)
+
+    batches = []
+    for batch_index in range(20):
+        msg_objs = [MessageObject("011{value}|{cycle}".format(value=20+i,cycle=batch_index*3+i)) for i in range(3)]
+        batches.append((msg_objs,[msg_obj.export_message_bytes() for msg_obj in msg_objs]))
+    pending = list(batches)
+    attempts = 0
+    blocked = 0
+    states = set()
+    while len(pending) > 0:
+        assert attempts < 200
+        if not circuit_breaker.allow_request():
+            blocked += 1
+            clock.advance(circuit_breaker.get_wait_time())
+            continue
+        states.add(circuit_breaker.get_state())
+        attempts += 1
+        msg_objs, rmsgs = pending[0]
+        rmsg_sent, rmsg_failed, rmsg_rejected, batch_format = webapi_send_messages(msg_objs,rmsgs,http_client,"array")
+        assert rmsg_rejected == []
+        assert batch_format == "array"
+        if len(rmsg_failed) == 0:
+            assert rmsg_sent == rmsgs
+            pending.pop(0)
+            retry_policy.record_success()
+            circuit_breaker.record_success()
+        else:
+            assert rmsg_failed == rmsgs
+            circuit_breaker.record_failure()
+            delay = retry_policy.record_failure()
+            assert 0 < delay <= 20.0
+            clock.advance(delay)
+    http_client.close()
+
+    # every batch delivered once and in order, open circuit sent nothing
+    assert flapping_server.accepted == [get_webapi_batch_body(msg_objs,"array")[0] for msg_objs, rmsgs in batches]
+    assert flapping_server.requests_total == attempts
+    assert blocked > 0
+    assert CircuitBreaker.STATE_HALF_OPEN in states
+    assert circuit_breaker.get_state() == CircuitBreaker.STATE_CLOSED
@@ -0,0 +1,100 @@
+import os
+import time
+
+import pytest
+
+from serial_line_reader import SerialLineReader
+
+class FakePort:
+
+    # hands out prepared chunks, in_waiting reports what the next read returns
+    def __init__(self,chunks):
+        self.chunks = list(chunks)
+        self.read_sizes = []
+
+    @property
+    def in_waiting(self):
+        if len(self.chunks) == 0:
+            return 0
+        return len(self.chunks[0])
+
+    def read(self,size):
+        self.read_sizes.append(size)
+        if len(self.chunks) == 0:
+            # port timeout
+            return b""
+        chunk = self.chunks.pop(0)
+        assert len(chunk) <= size
+        return chunk
+
+def read_all_lines(serial_reader,reads_count):
+    lines = []
+    for i in range(reads_count):
+        lines.extend(serial_reader.read_lines())
+    return lines
+
+def test_whole_lines_in_one_chunk():
+    serial_reader = SerialLineReader(FakePort([b"01125.5|17\r\n0121.0|18\n"]))
+    assert serial_reader.read_lines() == [b"01125.5|17",b"0121.0|18"]
+
+def test_lines_split_across_chunks():
+    serial_reader = SerialLineReader(FakePort([b"011",b"25.5|1",b"7\n012",b"1.0|18\r",b"\n"]))
+    assert read_all_lines(serial_reader,5) == [b"01125.5|17",b"0121.0|18"]
+
+def test_byte_by_byte():
+    data = b"01125.5|17\n0121.0|18\n\n0131.2|19\n"
+    serial_reader = SerialLineReader(FakePort([data[i:i+1] for i in range(len(data))]))
+    assert read_all_lines(serial_reader,len(data)) == [b"01125.5|17",b"0121.0|18",b"0131.2|19"]
+
+def test_partial_line_kept_over_timeout():
+    serial_reader = SerialLineReader(FakePort([b"01125",b"",b".5|17\n"]))
+    assert serial_reader.read_lines() == []
+    assert serial_reader.read_lines() == []
+    assert serial_reader.read_lines() == [b"01125.5|17"]
+
+def test_reads_what_is_waiting():
+    serial_port = FakePort([b"a" * 10 + b"\n",b"b\n"])
+    serial_reader = SerialLineReader(serial_port)
+    read_all_lines(serial_reader,3)
+    assert serial_port.read_sizes == [11,2,1]
+
+def test_overflow_dropped_and_reader_recovers():
+    # tail of the overflowed line is dropped too, only the next whole line comes out
+    serial_reader = SerialLineReader(FakePort([b"x" * 20,b"x" * 20,b"x\n01125.5|17\n"]),max_line_length=32)
+    assert read_all_lines(serial_reader,3) == [b"01125.5|17"]
+    assert serial_reader.dropped_bytes == 41
+
+def test_overflow_discards_across_chunks_until_newline():
+    serial_reader = SerialLineReader(FakePort([b"z" * 40,b"z" * 10,b"zz",b"z\n0121.0|18\n0131.2|19"]),max_line_length=32)
+    assert read_all_lines(serial_reader,4) == [b"0121.0|18"]
+    assert serial_reader.dropped_bytes == 53
+    assert serial_reader.buffer == b"0131.2|19"
+
+def test_overflow_in_chunk_with_newline():
+    serial_reader = SerialLineReader(FakePort([b"01125.5|17\n" + b"y" * 40]),max_line_length=32)
+    assert serial_reader.read_lines() == [b"01125.5|17"]
+    assert serial_reader.dropped_bytes == 40
+    assert len(serial_reader.buffer) == 0
+
+@pytest.mark.skipif(not hasattr(os,"openpty"),reason="no pty support")
+def test_pty_replay():
+    serial = pytest.importorskip("serial")
+    master_fd, slave_fd = os.openpty()
+    serial_port = serial.Serial(os.ttyname(slave_fd),timeout=0.2)
+    try:
+        lines = [b"01%d.5|%d" % (i % 40,i) for i in range(500)]
+        data = b"".join([line + b"\n" for line in lines])
+        serial_reader = SerialLineReader(serial_port)
+        received = []
+        # written in odd sized pieces while reader runs, like radio module output
+        for offset in range(0,len(data),37):
+            os.write(master_fd,data[offset:offset+37])
+            received.extend(serial_reader.read_lines())
+        deadline = time.time() + 5
+        while len(received) < len(lines) and time.time() < deadline:
+            received.extend(serial_reader.read_lines())
+        assert received == lines
+    finally:
+        serial_port.close()
+        os.close(master_fd)
+        os.close(slave_fd)
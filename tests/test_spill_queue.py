@@ -0,0 +1,165 @@
+import time
+import queue
+import threading
+
+from spill_queue import SpillQueue
+
+def encode_item(item):
+    return str(item).encode('ascii')
+
+def decode_item(item_bytes):
+    return int(item_bytes)
+
+def get_spill_queue(spill_file,high_water_mark=4,segment_max_bytes=64*1024*1024):
+    return SpillQueue(str(spill_file),encode=encode_item,decode=decode_item,high_water_mark=high_water_mark,segment_max_bytes=segment_max_bytes)
+
+def get_items_done(spill_queue,count):
+    # writer stores each item before task_done
+    items = []
+    for i in range(count):
+        items.append(spill_queue.get_nowait())
+        spill_queue.task_done()
+    return items
+
+def get_segment_files(tmp_path):
+    return sorted([path.name for path in tmp_path.glob("spill.dat.*") if path.suffix[1:].isdigit()])
+
+def test_order_kept_across_spill(tmp_path):
+    spill_queue = get_spill_queue(tmp_path / "spill.dat")
+    for i in range(20):
+        spill_queue.put(i)
+    assert spill_queue.get_stats()["memory_depth"] == 4
+    assert spill_queue.get_stats()["spill_depth"] == 16
+    assert get_items_done(spill_queue,20) == list(range(20))
+    assert spill_queue.empty()
+    # drained segment is deleted, new one is empty
+    assert get_segment_files(tmp_path) == ["spill.dat.00000001"]
+    assert (tmp_path / "spill.dat.00000001").stat().st_size == 0
+    spill_queue.close()
+
+def test_restart_does_not_replay_stored_messages(tmp_path):
+    spill_queue = get_spill_queue(tmp_path / "spill.dat")
+    for i in range(10):
+        spill_queue.put(i)
+    # 4 from memory, then refill of 2 lines from disk
+    assert get_items_done(spill_queue,6) == list(range(6))
+    spill_queue.close()
+
+    spill_queue = get_spill_queue(tmp_path / "spill.dat")
+    assert spill_queue.qsize() == 4
+    assert get_items_done(spill_queue,4) == [6,7,8,9]
+    assert spill_queue.empty()
+    spill_queue.close()
+
+    spill_queue = get_spill_queue(tmp_path / "spill.dat")
+    assert spill_queue.empty()
+    spill_queue.close()
+
+def test_restart_replays_handed_out_messages_not_stored(tmp_path):
+    spill_queue = get_spill_queue(tmp_path / "spill.dat")
+    for i in range(10):
+        spill_queue.put(i)
+    assert get_items_done(spill_queue,4) == list(range(4))
+    # writer takes two spilled items and dies before storing them
+    assert [spill_queue.get_nowait() for i in range(2)] == [4,5]
+    spill_queue.close()
+
+    spill_queue = get_spill_queue(tmp_path / "spill.dat")
+    assert get_items_done(spill_queue,6) == [4,5,6,7,8,9]
+    spill_queue.close()
+
+def test_segments_rotated_and_deleted_under_sustained_load(tmp_path):
+    spill_queue = get_spill_queue(tmp_path / "spill.dat",high_water_mark=10,segment_max_bytes=100)
+    max_segments = 0
+    items = []
+    for i in range(2000):
+        spill_queue.put(i)
+        if i % 2 == 0:
+            # writer is slower than radio, backlog keeps growing and shrinking
+            items.extend(get_items_done(spill_queue,1))
+        max_segments = max(max_segments,len(get_segment_files(tmp_path)))
+    items.extend(get_items_done(spill_queue,spill_queue.qsize()))
+
+    assert items == list(range(2000))
+    assert max_segments > 2
+    # each segment is deleted once writer stored past its end
+    assert len(get_segment_files(tmp_path)) == 1
+    assert spill_queue.get_stats()["spill_segments"] == 1
+    spill_queue.close()
+
+def test_single_spill_file_of_older_version_replayed(tmp_path):
+    (tmp_path / "spill.dat").write_bytes(b"1\n2\n3\n")
+    (tmp_path / "spill.dat.offset").write_text("2")
+    spill_queue = get_spill_queue(tmp_path / "spill.dat")
+    assert get_items_done(spill_queue,2) == [2,3]
+    spill_queue.close()
+
+def test_stale_offset_ignored(tmp_path):
+    (tmp_path / "spill.dat.00000000").write_bytes(b"1\n2\n")
+    (tmp_path / "spill.dat.offset").write_text("0 1000")
+    spill_queue = get_spill_queue(tmp_path / "spill.dat")
+    assert [spill_queue.get_nowait() for i in range(2)] == [1,2]
+    spill_queue.close()
+
+def test_decode_error_counted(tmp_path):
+    (tmp_path / "spill.dat.00000000").write_bytes(b"1\nbroken\n3\n")
+    spill_queue = get_spill_queue(tmp_path / "spill.dat")
+    assert [spill_queue.get_nowait() for i in range(2)] == [1,3]
+    assert spill_queue.get_stats()["decode_errors"] == 1
+    spill_queue.close()
+
+class StallingRedis:
+
+    # stands in for Redis which stops answering now and then
+    def __init__(self,stall_every=500,stall_time=0.05):
+        self.stall_every = stall_every
+        self.stall_time = stall_time
+        self.received = []
+
+    def lpush(self,item):
+        if len(self.received) % self.stall_every == 0:
+            time.sleep(self.stall_time)
+        self.received.append(item)
+
+def test_soak_with_stalling_consumer(tmp_path):
+    spill_queue = get_spill_queue(tmp_path / "spill.dat",high_water_mark=100)
+    stalling_redis = StallingRedis()
+    messages_count = 20000
+    max_memory_depth = []
+
+    def writer():
+        while True:
+            item = spill_queue.get()
+            if item == -1:
+                spill_queue.task_done()
+                return
+            stalling_redis.lpush(item)
+            spill_queue.task_done()
+
+    writer_thread = threading.Thread(target=writer,daemon=True)
+    writer_thread.start()
+    for i in range(messages_count):
+        spill_queue.put(i)
+        if i % 1000 == 0:
+            max_memory_depth.append(spill_queue.get_stats()["memory_depth"])
+    # end marker goes through spill file like any other message
+    spill_queue.put(-1)
+    spill_queue.join()
+    writer_thread.join(timeout=10)
+    assert not writer_thread.is_alive()
+
+    assert stalling_redis.received == list(range(messages_count))
+    assert max(max_memory_depth) <= 100
+    assert spill_queue.get_stats()["spilled_total"] > 0
+    assert spill_queue.empty()
+    spill_queue.close()
+
+    # everything was handed out, next run starts empty
+    spill_queue = get_spill_queue(tmp_path / "spill.dat",high_water_mark=100)
+    assert spill_queue.empty()
+    try:
+        spill_queue.get(timeout=0.01)
+        assert False
+    except queue.Empty:
+        pass
+    spill_queue.close()